@@ -3,8 +3,9 @@ import streamlit as st
 from core.env_loader import load_env, init_model, quiet_logs
 from core.data_models import Project
 from core.project_io import DATA_DIR
+from core import profiling
 
-from ui.sidebar import render_sidebar
+from ui.sidebar import render_sidebar, render_profiling_panel
 from ui.section_1_idea import render_section_1
 from ui.section_2_outline import render_section_2
 from ui.section_3_episode import render_section_3
@@ -21,13 +22,21 @@ if "storyline_choices" not in st.session_state:
     st.session_state.storyline_choices = []
 
 # Load .env and init model
-api_key = load_env()
-model_name, use_tts = render_sidebar()   # also handles load/save/export UI
-model = init_model(api_key, model_name) if api_key else None
+with profiling.rerun():
+    api_key = load_env()
+    with profiling.timer("sidebar"):
+        model_name, use_tts = render_sidebar()   # also handles load/save/export UI
+    model = init_model(api_key, model_name) if api_key else None
 
-st.title("🎧 Gemini Story Studio — Xuyên Không / Ngôn Tình / Hệ Thống")
+    st.title("🎧 Gemini Story Studio — Xuyên Không / Ngôn Tình / Hệ Thống")
 
-# Sections
-render_section_1(model)
-render_section_2(model)
-render_section_3(model, use_tts)
+    # Sections
+    with profiling.timer("section_1"):
+        render_section_1(model)
+    with profiling.timer("section_2"):
+        render_section_2(model)
+    with profiling.timer("section_3"):
+        render_section_3(model, use_tts)
+
+# Debug: thời gian rerun (vẽ sau cùng để gồm cả lượt vừa chạy)
+render_profiling_panel()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark làm sạch TTS / tách người nói trên kịch bản cỡ "cả mùa" (~100k từ).
+
+  python benchmarks/bench_text_utils.py            # mặc định 100k từ
+  python benchmarks/bench_text_utils.py --words 300000 --repeat 5
+
+So sánh bản cũ (5 lượt re.sub với pattern chuỗi + parse cả list) với core.text_utils hiện tại,
+đồng thời kiểm tra clean_tts_text cho kết quả giống bản cũ trên dữ liệu mẫu.
+"""
+import argparse
+import random
+import re
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.text_utils import clean_tts_text, iter_tts_lines, parse_tts_lines, seed_char_names_from_tts  # noqa: E402
+
+
+# ====== Bản cũ (để so sánh) ======
+
+def _legacy_fold(s: str) -> str:
+    s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    return s.lower().strip()
+
+
+def legacy_clean_tts_text(text: str) -> str:
+    if not text: return ""
+    s = re.sub(r"\*\*|\*|__|`+", "", text)
+    s = re.sub(r"^\s*(SCN|Cảnh|Scene)\s*\d+\s*[:\-]?.*$", "", s, flags=re.MULTILINE|re.IGNORECASE)
+    s = re.sub(r"\[(?:SFX|FX|Ambience|Âm nền|BGM|Nhạc nền|Transition|Chuyển cảnh)[^\]]*\]", "", s, flags=re.IGNORECASE)
+    s = re.sub(r"\((?:SFX|FX|Ambience|Âm nền|BGM|Nhạc nền|Transition|Chuyển cảnh)[^\)]*\)", "", s, flags=re.IGNORECASE)
+    s = re.sub(r"^\s*(ASSETS|TTS|FULL_SCRIPT)\s*:.*$", "", s, flags=re.MULTILINE)
+    s = re.sub(r"\s+", " ", s)
+    return s.strip()
+
+
+_LEGACY_SPEAKER = re.compile(
+    r"^(?:\s*[-–—]\s*)?(?:\*\s*)?(?P<name>[A-ZÀ-Ỵa-zà-ỹ0-9 _\[\]\(\)HỆ THỐNGSystem]+?)\s*[:：]\s*(?P<line>.+)$"
+)
+
+
+def legacy_parse_tts_lines(text: str):
+    lines = []
+    for raw in text.split('\n'):
+        t = raw.strip()
+        if not t: continue
+        m = _LEGACY_SPEAKER.match(t)
+        if m:
+            name = m.group('name').strip()
+            name = re.sub(r'^[\[\(]\s*|\s*[\]\)]$', '', name).strip()
+            if _legacy_fold(name) in {"he thong", "system", "voice system"}:
+                name = "HỆ THỐNG"
+            lines.append({"speaker": name, "text": m.group('line').strip()})
+        else:
+            lines.append({"speaker": "Người Dẫn Chuyện", "text": t})
+    return lines
+
+
+# ====== Dữ liệu mẫu ======
+
+_SPEAKERS = ["Diệp Minh", "Lâm Tuyết", "Hệ thống", "[Trưởng Lão]", "Tiêu Viêm", "- Mộ Dung Phục"]
+_WORDS = ("thiên địa linh khí cuồn cuộn kiếm quang chói mắt hắn khẽ cười nàng lạnh lùng đáp "
+          "tông môn đại điện sơn cốc ma đạo tu vi đột phá đan dược").split()
+
+
+def make_script(n_words: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    out, count, scene = [], 0, 1
+    while count < n_words:
+        r = rnd.random()
+        if r < 0.03:
+            out.append(f"**Cảnh {scene}: {rnd.choice(_WORDS).title()} Sơn**")
+            scene += 1
+            continue
+        if r < 0.05:
+            out.append(f"[SFX: {rnd.choice(_WORDS)}] ({'BGM'} căng thẳng)")
+            continue
+        k = rnd.randint(8, 25)
+        body = " ".join(rnd.choice(_WORDS) for _ in range(k))
+        count += k
+        if r < 0.55:
+            out.append(f"{rnd.choice(_SPEAKERS)}: *{body}*")
+        else:
+            out.append(body.capitalize() + ".")
+    return "\n".join(out)
+
+
+def _bench(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--words", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    text = make_script(args.words)
+    print(f"Kịch bản mẫu: {args.words:,} từ, {len(text):,} ký tự, {text.count(chr(10)) + 1:,} dòng")
+
+    assert clean_tts_text(text) == legacy_clean_tts_text(text), "clean_tts_text khác bản cũ"
+    assert parse_tts_lines(text) == legacy_parse_tts_lines(text), "parse_tts_lines khác bản cũ"
+
+    rows = [
+        ("clean_tts_text", lambda t: legacy_clean_tts_text(t), lambda t: clean_tts_text(t)),
+        ("parse_tts_lines", lambda t: legacy_parse_tts_lines(t), lambda t: parse_tts_lines(t)),
+        ("clean + parse (cả văn bản)", lambda t: legacy_parse_tts_lines(legacy_clean_tts_text(t)),
+         lambda t: sum(1 for _ in iter_tts_lines(t))),
+        ("seed_char_names_from_tts", None, lambda t: seed_char_names_from_tts(t)),
+    ]
+    print(f"{'bước':<30}{'cũ (ms)':>12}{'mới (ms)':>12}")
+    for name, old, new in rows:
+        t_old = _bench(old, text, args.repeat) * 1000 if old else float("nan")
+        t_new = _bench(new, text, args.repeat) * 1000
+        print(f"{name:<30}{t_old:>12.1f}{t_new:>12.1f}")
+    print("Nhân vật seed:", seed_char_names_from_tts(text))
+
+
+if __name__ == "__main__":
+    main()
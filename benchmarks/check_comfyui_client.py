@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra core.comfyui_client.run_jobs trên server ComfyUI giả lập (core.comfyui_fake), không cần GPU/mạng.
+
+  python benchmarks/check_comfyui_client.py
+
+Các tình huống: back-pressure max_queue, node lỗi lúc /prompt, execution_error, hết thời gian chờ,
+/history trả 503 tạm thời, upload ảnh tham chiếu local. Sai → AssertionError, exit code != 0.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.comfyui_client import run_jobs  # noqa: E402
+from core.comfyui_fake import PNG_1PX, FakeComfyUI  # noqa: E402
+
+
+def _job(i: int, prompt: str = "", **extra) -> dict:
+    return {"index": i, "scene": f"Cảnh {i}", "prompt": prompt or f"donghua scene {i}",
+            "seed": 1000 + i, "aspect_ratio": "16:9", **extra}
+
+
+def _run(server: FakeComfyUI, jobs, out: Path, **kw):
+    kw.setdefault("poll_sec", 0.05)
+    t0 = time.perf_counter()
+    res = run_jobs(server.url, jobs, out, **kw)
+    return res, time.perf_counter() - t0
+
+
+def check_max_queue(out: Path) -> None:
+    srv = FakeComfyUI(run_sec=0.1).start()
+    try:
+        res, dt = _run(srv, [_job(i) for i in range(1, 9)], out / "queue", max_in_flight=6, max_queue=2)
+    finally:
+        srv.stop()
+    assert all(not r["error"] for r in res), [r["error"] for r in res]
+    assert [r["index"] for r in res] == list(range(1, 9))
+    for r in res:
+        assert len(r["images"]) == 1 and Path(r["images"][0]).read_bytes() == PNG_1PX
+    assert srv.submitted == 8
+    assert srv.max_depth_seen <= 2, f"hàng đợi ComfyUI lên tới {srv.max_depth_seen} > max_queue=2"
+    print(f"max_queue: 8 job, độ sâu lớn nhất {srv.max_depth_seen}, {dt:.2f}s")
+
+
+def check_errors_and_timeout(out: Path) -> None:
+    srv = FakeComfyUI(run_sec=0.05).start()
+    jobs = [_job(1), _job(2, "broken [fake:node_error]"), _job(3, "oom [fake:error]"), _job(4, "stuck [fake:hang]")]
+    try:
+        res, dt = _run(srv, jobs, out / "errors", max_in_flight=4, max_queue=4, timeout_sec=1.0)
+    finally:
+        srv.stop()
+    ok, node_err, exec_err, hang = res
+    assert not ok["error"] and ok["images"], ok
+    assert "/prompt 400" in node_err["error"] and not node_err["prompt_id"], node_err
+    assert "CUDA out of memory" in exec_err["error"] and not exec_err["images"], exec_err
+    assert "Hết thời gian chờ" in hang["error"] and hang["prompt_id"], hang
+    assert dt < 10, f"timeout không dừng đúng hạn ({dt:.1f}s)"
+    print(f"lỗi: node_errors / execution_error / timeout báo đúng từng job, {dt:.2f}s")
+
+
+def check_history_retry(out: Path) -> None:
+    srv = FakeComfyUI(run_sec=0.05, history_failures=5).start()
+    try:
+        res, _ = _run(srv, [_job(1), _job(2)], out / "retry", timeout_sec=5.0)
+    finally:
+        srv.stop()
+    assert srv.history_failures == 0
+    assert all(not r["error"] and r["images"] for r in res), [r["error"] for r in res]
+    print("history: 503 tạm thời được thử lại tới khi có kết quả")
+
+
+def check_upload(out: Path) -> None:
+    ref = out / "ref_diep_minh.png"
+    ref.write_bytes(PNG_1PX)
+    srv = FakeComfyUI(run_sec=0.05).start()
+    jobs = [_job(i, characters=["Diệp Minh"], char_ref_images={"Diệp Minh": [str(ref)]}) for i in (1, 2)]
+    try:
+        res, _ = _run(srv, jobs, out / "upload", workflow_name="ipadapter")
+    finally:
+        srv.stop()
+    assert all(not r["error"] and r["images"] for r in res), [r["error"] for r in res]
+    assert srv.uploads == [ref.name], srv.uploads  # cùng file → upload 1 lần
+    print("upload: ảnh tham chiếu local upload 1 lần cho nhiều job")
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp)
+        check_max_queue(out)
+        check_errors_and_timeout(out)
+        check_history_retry(out)
+        check_upload(out)
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Chạy pipeline cả Mùa không cần UI:  outline → episode → veo → images (→ tts)
+
+  python cli.py --project "Tên dự án" --season 1 --stages outline,episode,veo,images --episode-workers 4
+  python cli.py --project "Tên dự án" --season 1 --dry-run      # model giả lập, ghi ra project "<tên>__dryrun"
+
+- Checkpoint từng bước lưu trong project JSON (ep.checkpoints); chạy lại sẽ bỏ qua bước đã xong (trừ --force).
+- Các tập chạy song song (--episode-workers); Veo trong mỗi tập song song theo cảnh (--scene-workers).
+- --comfyui URL: bước images gửi job lên ComfyUI, chờ xong và tải ảnh về <project>_media/.../comfyui/.
+- Bước tts (không chạy mặc định): render giọng đọc cả tập ra <project>_media/.../tts/ (--tts-backend; --dry-run dùng "stub").
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+from core.env_loader import load_env, init_model, quiet_logs
+from core.data_models import Season
+from core.project_io import DATA_DIR, load_project, save_project, episode_media_dir
+from core.text_utils import _safe_name
+from core.episode_pipeline import run_outline_stage, run_episode_stage, run_veo_stage, run_tts_stage
+from core.image_jobs import build_image_jobs_for_episode, save_jobs_json
+from core.comfyui_client import run_jobs as run_comfyui_jobs
+from core.comfyui_workflows import list_workflows
+from core.stub_model import StubModel
+from core.tts_engine import BACKENDS as TTS_BACKENDS
+
+ALL_STAGES = ["outline", "episode", "veo", "images", "tts"]
+DEFAULT_STAGES = ["outline", "episode", "veo", "images"]
+
+
+def _log(msg: str) -> None:
+    sys.stdout.write(f"[{time.strftime('%H:%M:%S')}] {msg}\n")  # 1 lần ghi/dòng: không lẫn dòng giữa các luồng
+    sys.stdout.flush()
+
+
+def _parse_episode_range(spec: Optional[str], n: int) -> List[int]:
+    """'1-3,5' → [0, 1, 2, 4] (chỉ số 0-based); None → tất cả."""
+    if not spec:
+        return list(range(n))
+    out = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            out.extend(range(int(a) - 1, int(b)))
+        else:
+            out.append(int(part) - 1)
+    return [i for i in dict.fromkeys(out) if 0 <= i < n]
+
+
+def _run_episode(model, proj, sidx: int, ep_idx: int, stages: List[str], args, save_lock: threading.Lock) -> str:
+    ep = proj.seasons[sidx].episodes[ep_idx]
+    label = f"Mùa {proj.seasons[sidx].season_index} · Tập {ep.index:02d}"
+    use_cache = not args.no_cache
+
+    def checkpoint(stage: str, **extra) -> None:
+        ep.checkpoints[stage] = {"at": int(time.time()), **extra}
+        with save_lock:
+            save_project(proj)
+
+    for stage in stages:
+        if stage == "outline":
+            continue
+        if stage in ep.checkpoints and not args.force:
+            _log(f"{label}: bỏ qua '{stage}' (đã có checkpoint)")
+            continue
+        _log(f"{label}: bắt đầu '{stage}'")
+        if stage == "episode":
+            if not run_episode_stage(model, proj, sidx, ep_idx, use_cache=use_cache):
+                raise RuntimeError(f"{label}: model trả về dữ liệu không đúng định dạng JSON")
+            checkpoint("episode")
+        elif stage == "veo":
+            n_err = run_veo_stage(model, proj, sidx, ep_idx, max_workers=args.scene_workers, use_cache=use_cache)
+            checkpoint("veo", errors=n_err)
+        elif stage == "images":
+            jobs = build_image_jobs_for_episode(proj, ep)
+            media = episode_media_dir(proj, proj.seasons[sidx].season_index, ep.index)
+            out = media / "image_jobs.json"
+            save_jobs_json(str(out), jobs)
+            extra = {}
+            if args.comfyui:
+                results = run_comfyui_jobs(args.comfyui, jobs, media / "comfyui",
+                                           workflow_name=args.comfyui_workflow,
+                                           max_in_flight=args.comfyui_in_flight, max_queue=args.comfyui_max_queue)
+                extra = {"images": sum(len(r["images"]) for r in results),
+                         "errors": sum(1 for r in results if r["error"])}
+            checkpoint("images", jobs=len(jobs), path=str(out.relative_to(DATA_DIR)), **extra)
+        elif stage == "tts":
+            res = run_tts_stage(proj, sidx, ep_idx, backend=args.tts_backend,
+                                max_workers=args.scene_workers, use_cache=not args.no_tts_cache)
+            if res["errors"]:
+                raise RuntimeError(f"{label}: TTS lỗi {len(res['errors'])} chunk — {res['errors'][0][1]}")
+            checkpoint("tts", path=str(res["path"].relative_to(DATA_DIR)),
+                       chunks=res["chunks"], cached=res["cached"])
+        _log(f"{label}: xong '{stage}'")
+    return label
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Gemini Story Studio — pipeline cả Mùa (headless)")
+    ap.add_argument("--project", required=True, help="Tên project (file projects/<tên>.json)")
+    ap.add_argument("--season", type=int, default=1, help="Số thứ tự Mùa (1-based)")
+    ap.add_argument("--stages", default=",".join(DEFAULT_STAGES), help=f"Các bước, phân tách dấu phẩy: {','.join(ALL_STAGES)}")
+    ap.add_argument("--episodes", default=None, help="Lọc tập, VD: 1-5,8 (mặc định: tất cả)")
+    ap.add_argument("--episode-count", type=int, default=None, help="Số tập khi tạo outline (mặc định theo Mùa)")
+    ap.add_argument("--episode-workers", type=int, default=3, help="Số tập chạy song song")
+    ap.add_argument("--scene-workers", type=int, default=4, help="Số cảnh Veo song song trong mỗi tập")
+    ap.add_argument("--model", default="gemini-2.5-pro")
+    ap.add_argument("--comfyui", default=None, help="URL ComfyUI (VD: http://127.0.0.1:8188) — bước images sẽ gửi job & tải ảnh về")
+    ap.add_argument("--comfyui-workflow", default="sdxl", choices=list_workflows(), help="Template workflow ComfyUI")
+    ap.add_argument("--comfyui-in-flight", type=int, default=4, help="Số job ComfyUI theo dõi đồng thời mỗi tập")
+    ap.add_argument("--comfyui-max-queue", type=int, default=8, help="Chỉ gửi thêm khi hàng đợi ComfyUI nhỏ hơn ngưỡng này")
+    ap.add_argument("--tts-backend", default="gtts", choices=sorted(TTS_BACKENDS), help="Backend giọng đọc cho bước tts")
+    ap.add_argument("--force", action="store_true", help="Chạy lại cả bước đã có checkpoint")
+    ap.add_argument("--no-cache", action="store_true", help="Bỏ qua cache phản hồi Gemini")
+    ap.add_argument("--no-tts-cache", action="store_true", help="Tổng hợp lại mọi chunk TTS (không dùng audio đã cache)")
+    ap.add_argument("--dry-run", action="store_true", help="Dùng model giả lập, ghi ra project '<tên>__dryrun'")
+    args = ap.parse_args(argv)
+
+    quiet_logs()
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in ALL_STAGES]
+    if unknown:
+        ap.error(f"Bước không hỗ trợ: {', '.join(unknown)}")
+
+    path = DATA_DIR / f"{_safe_name(args.project)}.json"
+    if not path.exists():
+        ap.error(f"Không tìm thấy project: {path}")
+    proj = load_project(path)
+
+    if args.dry_run:
+        model = StubModel()
+        proj.name = f"{proj.name}__dryrun"
+        args.no_cache = True
+        args.tts_backend = "stub"
+    else:
+        api_key = load_env()
+        if not api_key:
+            ap.error("Chưa có GEMINI_API_KEY trong .env / môi trường.")
+        model = init_model(api_key, args.model)
+
+    sidx = args.season - 1
+    while len(proj.seasons) <= sidx:
+        proj.seasons.append(Season(season_index=len(proj.seasons) + 1, episode_count=10, outline=[], episodes=[]))
+    season = proj.seasons[sidx]
+
+    if "outline" in stages:
+        if season.outline and not args.force:
+            _log(f"Mùa {season.season_index}: bỏ qua 'outline' (đã có dàn ý)")
+        else:
+            ep_count = args.episode_count or season.episode_count
+            _log(f"Mùa {season.season_index}: tạo dàn ý {ep_count} tập")
+            run_outline_stage(model, proj, sidx, ep_count, use_cache=not args.no_cache)
+            save_project(proj)
+
+    ep_ids = _parse_episode_range(args.episodes, len(season.episodes))
+    if not ep_ids:
+        _log("Không có tập nào để chạy.")
+        save_project(proj)
+        return 0
+
+    save_lock = threading.Lock()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.episode_workers)) as pool:
+        futs = {pool.submit(_run_episode, model, proj, sidx, i, stages, args, save_lock): i for i in ep_ids}
+        for fut in as_completed(futs):
+            try:
+                _log(f"✅ {fut.result()}")
+            except Exception as e:
+                failed += 1
+                _log(f"❌ Tập {futs[fut] + 1}: {e}")
+    with save_lock:
+        f = save_project(proj)
+    _log(f"Hoàn tất: {len(ep_ids) - failed}/{len(ep_ids)} tập — lưu tại {f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,17 @@
 from typing import Optional, List, Dict
 from core.text_utils import seed_char_names_from_tts
-from core.prompt_builders import build_character_bible_prompt
+from core.prompt_builders import build_character_bible_prompt_parts
 from core.gemini_helpers import gemini_json
+from core.schemas import CHARACTER_BIBLE_SCHEMA
 
 def ai_generate_character_bible(model, project_name: str, idea: str, chosen_storyline: str,
-                                outline: Optional[List[Dict[str, str]]], max_chars: int = 6) -> Dict:
-    prompt_cb = build_character_bible_prompt(project_name, idea, chosen_storyline, outline, max_chars)
-    data_cb = gemini_json(model, prompt_cb)
+                                outline: Optional[List[Dict[str, str]]], max_chars: int = 6,
+                                use_cache: bool = True, preset_name: Optional[str] = None,
+                                cache_owner: Optional[str] = None) -> Dict:
+    prefix, prompt_cb = build_character_bible_prompt_parts(project_name, idea, chosen_storyline, outline, max_chars,
+                                                           preset_name=preset_name)
+    data_cb = gemini_json(model, prompt_cb, use_cache=use_cache, prefix=prefix, cache_owner=cache_owner,
+                          schema=CHARACTER_BIBLE_SCHEMA)
     if isinstance(data_cb, dict) and "characters" in data_cb:
         return data_cb
     return {"characters": []}
@@ -0,0 +1,283 @@
+# core/comfyui_client.py
+# -*- coding: utf-8 -*-
+"""
+Client ComfyUI (HTTP API) dùng chung 1 requests.Session có connection pool.
+- Hàm đồng bộ: submit_prompt / get_queue_depth / get_history / download_output.
+- run_jobs_async: gửi nhiều job đồng thời (asyncio + to_thread), chờ xong qua /history,
+  tải ảnh về thư mục project; giới hạn số job trong hàng đợi ComfyUI (back-pressure theo /queue).
+- run_jobs: bản đồng bộ bọc asyncio.run (dùng từ Streamlit / CLI).
+- Chạy thử offline: core.comfyui_fake (server giả lập) + benchmarks/check_comfyui_client.py.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_SERVER = "http://127.0.0.1:8188"
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_POLL_SEC = 1.0
+DEFAULT_JOB_TIMEOUT_SEC = 900
+HTTP_TIMEOUT_SEC = 30
+
+CLIENT_ID = uuid.uuid4().hex  # nhận diện phiên gửi job trên ComfyUI
+
+_SESSIONS: Dict[str, requests.Session] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class ComfyUIError(RuntimeError):
+    """ComfyUI trả lỗi (node lỗi, prompt bị từ chối, hết thời gian chờ…)."""
+
+
+def _base(server_url: str) -> str:
+    return (server_url or DEFAULT_SERVER).rstrip("/")
+
+
+def get_session(server_url: str = DEFAULT_SERVER, pool_size: int = 16) -> requests.Session:
+    """Session dùng lại theo server (keep-alive, pool kết nối) — an toàn khi gọi từ nhiều luồng."""
+    base = _base(server_url)
+    with _SESSIONS_LOCK:
+        s = _SESSIONS.get(base)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _SESSIONS[base] = s
+        return s
+
+
+# ====== API đồng bộ ======
+
+def submit_prompt(server_url: str, workflow: Dict[str, Any], client_id: str = CLIENT_ID) -> str:
+    """POST /prompt → prompt_id."""
+    resp = get_session(server_url).post(
+        f"{_base(server_url)}/prompt",
+        json={"prompt": workflow, "client_id": client_id},
+        timeout=HTTP_TIMEOUT_SEC,
+    )
+    if resp.status_code >= 400:
+        raise ComfyUIError(f"/prompt {resp.status_code}: {resp.text[:500]}")
+    data = resp.json()
+    if data.get("node_errors"):
+        raise ComfyUIError(f"node_errors: {data['node_errors']}")
+    return data.get("prompt_id", "")
+
+
+def get_queue_depth(server_url: str) -> int:
+    """Số job đang chạy + đang chờ trên ComfyUI (GET /queue)."""
+    resp = get_session(server_url).get(f"{_base(server_url)}/queue", timeout=HTTP_TIMEOUT_SEC)
+    resp.raise_for_status()
+    data = resp.json()
+    return len(data.get("queue_running") or []) + len(data.get("queue_pending") or [])
+
+
+def get_history(server_url: str, prompt_id: str) -> Optional[Dict[str, Any]]:
+    """GET /history/{id}; None nếu job chưa xong."""
+    resp = get_session(server_url).get(f"{_base(server_url)}/history/{prompt_id}", timeout=HTTP_TIMEOUT_SEC)
+    resp.raise_for_status()
+    return (resp.json() or {}).get(prompt_id)
+
+
+def upload_image(server_url: str, path: Path) -> str:
+    """POST /upload/image → tên ảnh trong thư mục input của ComfyUI (dùng cho node LoadImage)."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        resp = get_session(server_url).post(
+            f"{_base(server_url)}/upload/image",
+            files={"image": (path.name, f)},
+            data={"overwrite": "true"},
+            timeout=HTTP_TIMEOUT_SEC,
+        )
+    resp.raise_for_status()
+    data = resp.json()
+    return f"{data['subfolder']}/{data['name']}" if data.get("subfolder") else data["name"]
+
+
+_UPLOAD_LOCK = threading.Lock()
+_REF_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def upload_ref_images(server_url: str, refs: List[str], uploaded: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Ảnh tham chiếu là file local → upload (mỗi file 1 lần nhờ dict uploaded); còn lại coi như tên có sẵn trên ComfyUI.
+    """
+    out = []
+    for ref in refs or []:
+        if not ref or not Path(ref).is_file():
+            if ref:
+                out.append(ref)
+            continue
+        if uploaded is not None:
+            with _UPLOAD_LOCK:
+                ref_lock = _REF_LOCKS.setdefault(ref, threading.Lock())
+            with ref_lock:  # nhiều job cùng ảnh chạy song song → chỉ 1 luồng upload, các luồng khác chờ lấy tên
+                with _UPLOAD_LOCK:
+                    name = uploaded.get(ref)
+                if name is None:
+                    name = upload_image(server_url, Path(ref))
+                    with _UPLOAD_LOCK:
+                        uploaded[ref] = name
+        else:
+            name = upload_image(server_url, Path(ref))
+        out.append(name)
+    return out
+
+
+def _prepare_job(server_url: str, job: Dict[str, Any], uploaded: Dict[str, str]) -> Dict[str, Any]:
+    """Bản sao job với ảnh tham chiếu / ảnh control đã upload."""
+    refs = {n: upload_ref_images(server_url, r, uploaded) for n, r in (job.get("char_ref_images") or {}).items()}
+    job = {**job, "char_ref_images": refs}
+    if job.get("control_image"):
+        job["control_image"] = upload_ref_images(server_url, [job["control_image"]], uploaded)[0]
+    return job
+
+
+def _output_images(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Danh sách {"filename","subfolder","type"} từ outputs của history entry."""
+    out = []
+    for node_out in (entry.get("outputs") or {}).values():
+        for img in node_out.get("images") or []:
+            if img.get("type", "output") == "output" and img.get("filename"):
+                out.append(img)
+    return out
+
+
+def download_output(server_url: str, image: Dict[str, Any], dst: Path, chunk_size: int = 1 << 16) -> Path:
+    """GET /view → ghi file theo từng khối (file tạm + rename)."""
+    params = {
+        "filename": image["filename"],
+        "subfolder": image.get("subfolder", ""),
+        "type": image.get("type", "output"),
+    }
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".tmp")
+    with get_session(server_url).get(f"{_base(server_url)}/view", params=params,
+                                     stream=True, timeout=HTTP_TIMEOUT_SEC) as resp:
+        resp.raise_for_status()
+        with open(tmp, "wb") as f:
+            for chunk in resp.iter_content(chunk_size):
+                if chunk:
+                    f.write(chunk)
+    tmp.replace(dst)
+    return dst
+
+
+def _history_error(entry: Dict[str, Any]) -> Optional[str]:
+    status = entry.get("status") or {}
+    if status.get("status_str") == "error":
+        for name, info in status.get("messages") or []:
+            if name == "execution_error":
+                return f"{info.get('node_type', '')}: {info.get('exception_message', '')}".strip()
+        return "execution_error"
+    return None
+
+
+# ====== Chạy nhiều job (async) ======
+
+def _is_transient_http(exc: requests.RequestException) -> bool:
+    """Lỗi kết nối / timeout / 5xx / 429 → đáng thử lại; 4xx khác là lỗi thật."""
+    resp = getattr(exc, "response", None)
+    if resp is None:
+        return True
+    return resp.status_code >= 500 or resp.status_code in (408, 429)
+
+
+async def _wait_for_room(server_url: str, max_queue: int, poll_sec: float) -> None:
+    while True:
+        try:
+            depth = await asyncio.to_thread(get_queue_depth, server_url)
+        except requests.RequestException:
+            depth = 0  # /queue lỗi → không chặn, để /prompt tự báo lỗi nếu server chết
+        if depth < max_queue:
+            return
+        await asyncio.sleep(poll_sec)
+
+
+async def _wait_for_history(server_url: str, prompt_id: str, poll_sec: float, timeout_sec: float) -> Dict[str, Any]:
+    deadline = time.monotonic() + timeout_sec
+    last_err = ""
+    while True:
+        try:
+            entry = await asyncio.to_thread(get_history, server_url, prompt_id)
+        except requests.RequestException as e:
+            if not _is_transient_http(e):
+                raise
+            entry, last_err = None, str(e)  # mạng chập chờn / server bận → thử lại tới deadline
+        if entry is not None and (entry.get("outputs") or _history_error(entry)):
+            return entry
+        if time.monotonic() > deadline:
+            raise ComfyUIError(f"Hết thời gian chờ prompt {prompt_id}" + (f" (lỗi cuối: {last_err})" if last_err else ""))
+        await asyncio.sleep(poll_sec)
+
+
+def _job_filename(job: Dict[str, Any], n: int, image: Dict[str, Any]) -> str:
+    ext = Path(image.get("filename", "")).suffix or ".png"
+    return f"scene_{int(job.get('index', 0)):02d}_{n:02d}{ext}"
+
+
+async def run_jobs_async(
+    server_url: str,
+    jobs: List[Dict[str, Any]],
+    out_dir: Path,
+    build_workflow: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    workflow_name: Optional[str] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    max_queue: int = DEFAULT_MAX_QUEUE,
+    poll_sec: float = DEFAULT_POLL_SEC,
+    timeout_sec: float = DEFAULT_JOB_TIMEOUT_SEC,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Gửi các image job (từ build_image_jobs_for_episode) lên ComfyUI, chờ xong, tải ảnh về out_dir.
+    - Tối đa max_in_flight job do client này theo dõi cùng lúc.
+    - Chỉ gửi job mới khi hàng đợi ComfyUI < max_queue.
+    - workflow_name: template trong core/workflows (mặc định sdxl); ảnh tham chiếu local được upload trước.
+    Trả về list (cùng thứ tự jobs): {"index","scene","prompt_id","images":[path…],"error"}.
+    """
+    if build_workflow is None:
+        from core.image_jobs import job_to_workflow
+        from core.comfyui_workflows import DEFAULT_WORKFLOW
+
+        def build_workflow(job: Dict[str, Any]) -> Dict[str, Any]:
+            return job_to_workflow(job, workflow_name or DEFAULT_WORKFLOW)
+    uploaded: Dict[str, str] = {}
+    out_dir = Path(out_dir)
+    sem = asyncio.Semaphore(max(1, int(max_in_flight)))
+    submit_lock = asyncio.Lock()  # kiểm tra /queue + gửi /prompt là 1 bước, tránh nhiều task cùng thấy "còn chỗ"
+
+    async def one(job: Dict[str, Any]) -> Dict[str, Any]:
+        res = {"index": job.get("index"), "scene": job.get("scene"), "prompt_id": "", "images": [], "error": ""}
+        try:
+            async with sem:
+                job = await asyncio.to_thread(_prepare_job, server_url, job, uploaded)
+                workflow = build_workflow(job)
+                async with submit_lock:
+                    await _wait_for_room(server_url, max_queue, poll_sec)
+                    res["prompt_id"] = await asyncio.to_thread(submit_prompt, server_url, workflow)
+                entry = await _wait_for_history(server_url, res["prompt_id"], poll_sec, timeout_sec)
+                err = _history_error(entry)
+                if err:
+                    raise ComfyUIError(err)
+                for n, img in enumerate(_output_images(entry), 1):
+                    dst = out_dir / _job_filename(job, n, img)
+                    p = await asyncio.to_thread(download_output, server_url, img, dst)
+                    res["images"].append(str(p))
+        except Exception as e:
+            res["error"] = str(e)
+        if on_result:
+            on_result(res)
+        return res
+
+    return list(await asyncio.gather(*(one(j) for j in jobs)))
+
+
+def run_jobs(server_url: str, jobs: List[Dict[str, Any]], out_dir: Path, **kw) -> List[Dict[str, Any]]:
+    """Bản đồng bộ của run_jobs_async (tạo event loop riêng)."""
+    return asyncio.run(run_jobs_async(server_url, jobs, out_dir, **kw))
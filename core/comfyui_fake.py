@@ -0,0 +1,213 @@
+# core/comfyui_fake.py
+# -*- coding: utf-8 -*-
+"""
+Server ComfyUI giả lập (offline, chỉ stdlib) để chạy thử core.comfyui_client — tương tự core.stub_model cho Gemini.
+Hỗ trợ các endpoint client dùng: POST /prompt, GET /queue, GET /history/<id>, GET /view, POST /upload/image.
+- 1 "GPU" chạy tuần tự từng prompt trong run_sec giây; /queue trả queue_running + queue_pending thật.
+- Hành vi theo marker trong prompt text (workflow nào cũng được):
+    [fake:node_error] → /prompt trả 400 + node_errors;
+    [fake:error]      → chạy xong với status error (execution_error);
+    [fake:hang]       → không bao giờ có history (client phải hết thời gian chờ).
+- history_failures=N: N lần GET /history đầu tiên trả 503 (lỗi tạm thời).
+- max_depth_seen: độ sâu hàng đợi lớn nhất ngay sau mỗi lần nhận prompt (kiểm tra back-pressure max_queue).
+
+  server = FakeComfyUI(run_sec=0.1).start()
+  run_jobs(server.url, jobs, out_dir, ...)
+  server.stop()
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# PNG 1x1 trong suốt — đủ để client tải về như ảnh thật
+PNG_1PX = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+_MARKER = re.compile(r"\[fake:(node_error|error|hang)\]")
+_UPLOAD_NAME = re.compile(rb'name="image"; filename="([^"]+)"')
+
+
+class FakeComfyUI:
+    def __init__(self, run_sec: float = 0.1, history_failures: int = 0, host: str = "127.0.0.1", port: int = 0):
+        self.run_sec = run_sec
+        self.history_failures = history_failures
+        self.lock = threading.Lock()
+        self.pending: Deque[str] = deque()
+        self.running: Optional[str] = None
+        self.modes: Dict[str, str] = {}
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.uploads: List[str] = []
+        self.max_depth_seen = 0
+        self.submitted = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeComfyUI":
+        for target in (self.httpd.serve_forever, self._gpu_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def depth(self) -> int:
+        with self.lock:
+            return len(self.pending) + (1 if self.running else 0)
+
+    # ====== "GPU" ======
+
+    def _gpu_loop(self) -> None:
+        while not self._stop.is_set():
+            with self.lock:
+                pid = self.pending.popleft() if self.pending else None
+                self.running = pid
+            if pid is None:
+                self._wake.wait(0.05)
+                self._wake.clear()
+                continue
+            time.sleep(self.run_sec)
+            with self.lock:
+                self.running = None
+                mode = self.modes.get(pid, "ok")
+                if mode == "hang":
+                    continue  # không ghi history
+                self.history[pid] = self._entry(pid, mode)
+
+    @staticmethod
+    def _entry(pid: str, mode: str) -> Dict[str, Any]:
+        if mode == "error":
+            return {
+                "outputs": {},
+                "status": {"status_str": "error", "completed": False, "messages": [
+                    ["execution_start", {"prompt_id": pid}],
+                    ["execution_error", {"prompt_id": pid, "node_type": "KSampler",
+                                         "exception_message": "CUDA out of memory (fake)"}],
+                ]},
+            }
+        img = {"filename": f"{pid}_00001_.png", "subfolder": "", "type": "output"}
+        return {"outputs": {"9": {"images": [img]}},
+                "status": {"status_str": "success", "completed": True, "messages": []}}
+
+    # ====== HTTP ======
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive như ComfyUI (aiohttp)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _send(self, code: int, body: Any, ctype: str = "application/json") -> None:
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def do_GET(self) -> None:
+                u = urlparse(self.path)
+                if u.path == "/queue":
+                    with fake.lock:
+                        running = [[0, fake.running]] if fake.running else []
+                        pending = [[i + 1, pid] for i, pid in enumerate(fake.pending)]
+                    self._send(200, {"queue_running": running, "queue_pending": pending})
+                elif u.path.startswith("/history/"):
+                    pid = u.path[len("/history/"):]
+                    with fake.lock:
+                        if fake.history_failures > 0:
+                            fake.history_failures -= 1
+                            fail = True
+                        else:
+                            fail = False
+                            entry = fake.history.get(pid)
+                    if fail:
+                        self._send(503, {"error": "busy (fake)"})
+                    else:
+                        self._send(200, {pid: entry} if entry else {})
+                elif u.path == "/view":
+                    name = (parse_qs(u.query).get("filename") or [""])[0]
+                    self._send(200 if name else 400, PNG_1PX if name else {"error": "no filename"}, "image/png")
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self) -> None:
+                u = urlparse(self.path)
+                body = self._body()
+                if u.path == "/prompt":
+                    workflow = (json.loads(body or b"{}") or {}).get("prompt") or {}
+                    m = _MARKER.search(json.dumps(workflow, ensure_ascii=False))
+                    mode = m.group(1) if m else "ok"
+                    if mode == "node_error":
+                        self._send(400, {
+                            "error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"},
+                            "node_errors": {"3": {"errors": [{"message": "Value not in list (fake)"}],
+                                                  "class_type": "KSampler"}},
+                        })
+                        return
+                    pid = uuid.uuid4().hex
+                    with fake.lock:
+                        fake.modes[pid] = mode
+                        fake.pending.append(pid)
+                        fake.submitted += 1
+                        fake.max_depth_seen = max(fake.max_depth_seen,
+                                                  len(fake.pending) + (1 if fake.running else 0))
+                        number = fake.submitted
+                    fake._wake.set()
+                    self._send(200, {"prompt_id": pid, "number": number, "node_errors": {}})
+                elif u.path == "/upload/image":
+                    m = _UPLOAD_NAME.search(body)
+                    if not m:
+                        self._send(400, {"error": "no image"})
+                        return
+                    name = m.group(1).decode("utf-8", "replace")
+                    with fake.lock:
+                        fake.uploads.append(name)
+                    self._send(200, {"name": name, "subfolder": "", "type": "input"})
+                else:
+                    self._send(404, {"error": "not found"})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Chạy server ComfyUI giả lập")
+    ap.add_argument("--port", type=int, default=8188)
+    ap.add_argument("--run-sec", type=float, default=1.0)
+    args = ap.parse_args()
+    srv = FakeComfyUI(run_sec=args.run_sec, port=args.port).start()
+    print(f"Fake ComfyUI: {srv.url} (Ctrl+C để dừng)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.stop()
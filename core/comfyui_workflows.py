@@ -0,0 +1,119 @@
+# core/comfyui_workflows.py
+# -*- coding: utf-8 -*-
+"""
+Registry workflow ComfyUI: mỗi template là 1 file core/workflows/<tên>.json
+  {
+    "name": "ipadapter",
+    "description": "...",
+    "requires": ["ref_images"],        # tuỳ chọn: thiếu dữ liệu này → dùng "fallback"
+    "fallback": "sdxl",
+    "patch": {"seed": [["3","seed"]], "prompt": [["5","text"]], "ref_images": [["11","image"], ["13","image"]], ...},
+    "graph": { "<node_id>": {"class_type": ..., "inputs": {...}}, ... }   # định dạng API của ComfyUI
+  }
+- Template được load + kiểm tra 1 lần (lru_cache).
+- patch_workflow chỉ copy các node bị patch (seed/prompt/size/ảnh…); node còn lại dùng chung với template,
+  vì vậy KHÔNG sửa trực tiếp graph trả về ở các node không patch.
+"""
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List
+
+WORKFLOWS_DIR = Path(__file__).resolve().parent / "workflows"
+DEFAULT_WORKFLOW = "sdxl"
+REQUIRED_PATCH_KEYS = ("seed", "prompt", "width", "height")
+
+
+class WorkflowError(ValueError):
+    """Template workflow không hợp lệ hoặc không tồn tại."""
+
+
+def list_workflows() -> List[str]:
+    return sorted(p.stem for p in WORKFLOWS_DIR.glob("*.json"))
+
+
+def _validate(name: str, tpl: Dict[str, Any]) -> None:
+    graph = tpl.get("graph")
+    if not isinstance(graph, dict) or not graph:
+        raise WorkflowError(f"{name}: thiếu 'graph'")
+    for nid, node in graph.items():
+        if not isinstance(node, dict) or "class_type" not in node or not isinstance(node.get("inputs"), dict):
+            raise WorkflowError(f"{name}: node {nid} thiếu class_type/inputs")
+        for k, v in node["inputs"].items():
+            # link dạng [node_id, output_index] phải trỏ tới node có thật
+            if isinstance(v, list) and len(v) == 2 and isinstance(v[0], str) and isinstance(v[1], int):
+                if v[0] not in graph:
+                    raise WorkflowError(f"{name}: node {nid}.{k} trỏ tới node {v[0]} không tồn tại")
+    patch = tpl.get("patch")
+    if not isinstance(patch, dict):
+        raise WorkflowError(f"{name}: thiếu 'patch'")
+    for key in REQUIRED_PATCH_KEYS:
+        if not patch.get(key):
+            raise WorkflowError(f"{name}: patch thiếu '{key}'")
+    for key, targets in patch.items():
+        for t in targets:
+            if not (isinstance(t, list) and len(t) == 2):
+                raise WorkflowError(f"{name}: patch '{key}' sai định dạng: {t}")
+            nid, inp = t
+            if nid not in graph or inp not in graph[nid]["inputs"]:
+                raise WorkflowError(f"{name}: patch '{key}' trỏ tới {nid}.{inp} không tồn tại")
+    for req in tpl.get("requires") or []:
+        if req not in patch:
+            raise WorkflowError(f"{name}: requires '{req}' nhưng không có trong patch")
+
+
+@lru_cache(maxsize=None)
+def load_workflow(name: str = DEFAULT_WORKFLOW) -> Dict[str, Any]:
+    """Load + validate template (cache theo tên). Không sửa trực tiếp dict trả về."""
+    f = WORKFLOWS_DIR / f"{name}.json"
+    if not f.is_file():
+        raise WorkflowError(f"Không có workflow '{name}' (có: {', '.join(list_workflows())})")
+    try:
+        tpl = json.loads(f.read_text(encoding="utf-8"))
+    except json.JSONDecodeError as e:
+        raise WorkflowError(f"{name}: JSON lỗi: {e}") from e
+    tpl.setdefault("name", name)
+    _validate(name, tpl)
+    return tpl
+
+
+def resolve_workflow(name: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    """Template phù hợp với dữ liệu đang có (thiếu 'requires' → lần theo 'fallback')."""
+    seen = set()
+    tpl = load_workflow(name or DEFAULT_WORKFLOW)
+    while any(not values.get(r) for r in tpl.get("requires") or []):
+        seen.add(tpl["name"])
+        fb = tpl.get("fallback")
+        if not fb or fb in seen:
+            missing = [r for r in tpl.get("requires") or [] if not values.get(r)]
+            raise WorkflowError(f"{tpl['name']}: thiếu {', '.join(missing)}")
+        tpl = load_workflow(fb)
+    return tpl
+
+
+def patch_workflow(tpl: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Graph mới với các giá trị patch (copy-on-write theo node).
+    Giá trị list (VD: ref_images) được rải lần lượt vào các slot, lặp lại nếu ít hơn số slot.
+    """
+    graph = tpl["graph"]
+    out = dict(graph)
+    copied = set()
+    for key, targets in tpl["patch"].items():
+        if key not in values or values[key] is None:
+            continue
+        val = values[key]
+        seq = list(val) if isinstance(val, (list, tuple)) else None
+        if seq is not None and not seq:
+            continue
+        for i, (nid, inp) in enumerate(targets):
+            if nid not in copied:
+                out[nid] = {**graph[nid], "inputs": dict(graph[nid]["inputs"])}
+                copied.add(nid)
+            out[nid]["inputs"][inp] = seq[i % len(seq)] if seq is not None else val
+    return out
+
+
+def build_workflow(name: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    """Chọn template (có fallback) rồi patch. values: seed/prompt/width/height/negative/ref_images/control_image…"""
+    return patch_workflow(resolve_workflow(name, values), values)
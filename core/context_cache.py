@@ -0,0 +1,179 @@
+# core/context_cache.py
+# -*- coding: utf-8 -*-
+"""
+Context caching (Gemini explicit cache) cho phần PREFIX dùng chung của project (cốt truyện + preset):
+outline / episode / character bible chỉ gửi SUFFIX riêng, prefix đọc từ cache phía server.
+
+Vòng đời handle gắn với project (owner = tên project):
+- cached_model(model, prefix, owner): lần đầu tạo CachedContent; prefix không đổi → dùng lại;
+  prefix đổi (sửa cốt truyện/preset) → xoá cache cũ rồi tạo mới; sắp hết TTL → gia hạn.
+- release(owner) khi đóng/đổi project; release_all() khi thoát tiến trình.
+- Model không hỗ trợ (model giả lập, SDK không có caching), prefix ngắn hơn ngưỡng tối thiểu của API,
+  hoặc tạo cache lỗi → None: caller gửi prompt đầy đủ như cũ (prefix đặt đầu prompt nên vẫn hưởng
+  implicit cache theo tiền tố của Gemini). Chỉ lỗi vĩnh viễn được nhớ theo key; lỗi tạm thời
+  (429/5xx/mạng) thử lại sau RETRY_AFTER_SEC.
+- Mỗi owner một khoá: project này đang tạo cache không chặn project khác.
+"""
+import atexit
+import datetime as _dt
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from core.disk_cache import make_key
+from core.gemini_governor import is_transient
+
+CACHE_TTL_SEC = 3600
+RENEW_BEFORE_SEC = 300
+# Tạo cache lỗi tạm thời (429/5xx/mạng) → chỉ nghỉ một lúc rồi thử lại, không khoá cả tiến trình
+RETRY_AFTER_SEC = 60
+# Ngưỡng token tối thiểu của explicit cache theo họ model (ước lượng ~4 byte UTF-8 / token)
+MIN_PREFIX_TOKENS = {"pro": 4096, "flash": 1024}
+DEFAULT_MIN_PREFIX_TOKENS = 4096
+
+# Lỗi vĩnh viễn với (model, prefix) này: prefix dưới ngưỡng / model không hỗ trợ caching
+_PERMANENT_MSG = re.compile(
+    r"too (?:small|short)|minimum|min_total_token|token count|not supported|unsupported|does not support",
+    re.I,
+)
+
+# _LOCK chỉ giữ trong lúc đọc/ghi dict; gọi mạng (create/update/delete) nằm ngoài, dưới khoá riêng của owner
+_LOCK = threading.Lock()
+_OWNER_LOCKS: Dict[str, threading.Lock] = {}
+# owner → {"key", "cache", "model", "expires", "retry_at"};
+# cache None = không dùng được với key này cho tới retry_at (inf = lỗi vĩnh viễn)
+_HANDLES: Dict[str, Dict[str, Any]] = {}
+
+
+def _model_name(model) -> str:
+    return getattr(model, "model_name", "") or ""
+
+
+def _min_tokens(model_name: str) -> int:
+    for family, n in MIN_PREFIX_TOKENS.items():
+        if family in model_name:
+            return n
+    return DEFAULT_MIN_PREFIX_TOKENS
+
+
+def _supports_caching(model) -> bool:
+    try:
+        import google.generativeai as genai
+        from google.generativeai import caching  # noqa: F401
+    except Exception:
+        return False
+    return isinstance(model, genai.GenerativeModel) and not getattr(model, "cached_content", None)
+
+
+def _owner_lock(owner: str) -> threading.Lock:
+    with _LOCK:
+        lock = _OWNER_LOCKS.get(owner)
+        if lock is None:
+            lock = _OWNER_LOCKS[owner] = threading.Lock()
+        return lock
+
+
+def _is_permanent(exc: BaseException) -> bool:
+    return not is_transient(exc) and bool(_PERMANENT_MSG.search(str(exc) or ""))
+
+
+def _failed(key: str, permanent: bool) -> Dict[str, Any]:
+    retry_at = float("inf") if permanent else time.time() + RETRY_AFTER_SEC
+    return {"key": key, "cache": None, "model": None, "expires": 0.0, "retry_at": retry_at}
+
+
+def _delete(handle: Optional[Dict[str, Any]]) -> None:
+    cache = (handle or {}).get("cache")
+    if cache is None:
+        return
+    try:
+        cache.delete()
+    except Exception:
+        pass  # đã hết hạn / bị xoá phía server
+
+
+def _create(model, prefix: str, owner: str, key: str) -> Dict[str, Any]:
+    import google.generativeai as genai
+    from google.generativeai import caching
+    try:
+        cache = caching.CachedContent.create(
+            model=_model_name(model),
+            display_name=f"gss:{owner}"[:120],
+            contents=[prefix],
+            ttl=_dt.timedelta(seconds=CACHE_TTL_SEC),
+        )
+    except Exception as e:
+        return _failed(key, _is_permanent(e))
+    try:
+        derived = genai.GenerativeModel.from_cached_content(cached_content=cache)
+    except Exception:
+        _delete({"cache": cache})
+        return _failed(key, True)  # SDK không dựng được model từ cache → không thử lại
+    return {"key": key, "cache": cache, "model": derived,
+            "expires": time.time() + CACHE_TTL_SEC, "retry_at": 0.0}
+
+
+def cached_model(model, prefix: str, owner: str) -> Optional[Any]:
+    """Model đọc prefix từ cache (gọi generate_content với suffix), hoặc None nếu không dùng được cache."""
+    if not prefix or not owner or not _supports_caching(model):
+        return None
+    name = _model_name(model)
+    key = make_key("ctx-v1", name, prefix)
+    with _owner_lock(owner):
+        with _LOCK:
+            h = _HANDLES.get(owner)
+        if h is not None and h["key"] == key:
+            if h["cache"] is None:
+                if time.time() < h["retry_at"]:
+                    return None
+            elif h["expires"] - time.time() > RENEW_BEFORE_SEC:
+                return h["model"]
+            else:
+                try:
+                    h["cache"].update(ttl=_dt.timedelta(seconds=CACHE_TTL_SEC))
+                    h["expires"] = time.time() + CACHE_TTL_SEC
+                    return h["model"]
+                except Exception:
+                    pass  # hết hạn rồi → tạo lại bên dưới
+        with _LOCK:
+            old = _HANDLES.pop(owner, None)
+        _delete(old)
+        if len(prefix.encode("utf-8")) // 4 < _min_tokens(name):
+            created = _failed(key, True)
+        else:
+            created = _create(model, prefix, owner, key)
+        with _LOCK:
+            _HANDLES[owner] = created
+        return created["model"]
+
+
+def invalidate(owner: str) -> None:
+    """Bỏ handle hiện tại (VD: server báo cache không còn) — lần gọi sau sẽ tạo lại."""
+    with _LOCK:
+        h = _HANDLES.pop(owner, None)
+    _delete(h)
+
+
+def release(owner: Optional[str]) -> None:
+    """Đóng project: xoá cache phía server của owner."""
+    if owner:
+        invalidate(owner)
+
+
+def release_all() -> None:
+    with _LOCK:
+        handles = list(_HANDLES.values())
+        _HANDLES.clear()
+    for h in handles:
+        _delete(h)
+
+
+def active_handles() -> Dict[str, Dict[str, Any]]:
+    """Trạng thái cache theo project (cho UI/debug)."""
+    with _LOCK:
+        return {o: {"name": getattr(h["cache"], "name", None), "expires": h["expires"]}
+                for o, h in _HANDLES.items() if h["cache"] is not None}
+
+
+atexit.register(release_all)
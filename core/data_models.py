@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import List, Dict, Any
 
 class Episode(BaseModel):
@@ -8,12 +8,15 @@ class Episode(BaseModel):
     script_text: str = ""
     assets: Dict[str, Any] = Field(default_factory=lambda: {"scenes": []})
     tts_text: str = ""
+    checkpoints: Dict[str, Any] = Field(default_factory=dict)  # stage -> {"at": ts, ...} (pipeline resume)
 
 class Season(BaseModel):
     season_index: int = 1
     episode_count: int = 10
     outline: List[Dict[str, str]] = []
     episodes: List[Episode] = []
+    # vị trí tập → shard chưa đọc (project mở lazy, xem project_io.ensure_season_loaded)
+    _pending_shards: Dict[int, str] = PrivateAttr(default_factory=dict)
 
 class Project(BaseModel):
     name: str
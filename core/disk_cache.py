@@ -0,0 +1,154 @@
+# core/disk_cache.py
+# -*- coding: utf-8 -*-
+"""
+Cache đĩa dạng content-addressed dùng chung cho app.
+- Mỗi namespace là 1 thư mục con trong .cache/ (VD: "gemini").
+- Key = sha256 của nội dung đầu vào; file lưu theo 2 ký tự đầu của key.
+- mtime = lúc ghi (TTL tính từ đây, đọc không làm entry "trẻ" lại); atime = lần dùng gần nhất (LRU).
+- Dọn LRU khi vượt dung lượng: cache_put ước lượng dung lượng trong RAM, chỉ quét thư mục khi ước lượng
+  vượt giới hạn hoặc sau PRUNE_EVERY lần ghi (đồng bộ lại với tiến trình khác).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+APP_DIR = Path(__file__).resolve().parents[1]
+CACHE_DIR = APP_DIR / ".cache"
+
+PRUNE_EVERY = 200
+PRUNE_LOW_WATER = 0.9  # vượt giới hạn → dọn xuống 90% để các lần ghi sau không phải quét ngay
+
+_PRUNE_LOCK = threading.Lock()
+_EST_LOCK = threading.Lock()
+_EST: Dict[str, List[int]] = {}  # ns → [dung lượng ước lượng, số lần ghi từ lần quét cuối]
+
+
+def make_key(*parts: Any) -> str:
+    """Băm các thành phần (str/dict/list…) thành key ổn định."""
+    h = hashlib.sha256()
+    for p in parts:
+        if not isinstance(p, (str, bytes)):
+            p = json.dumps(p, ensure_ascii=False, sort_keys=True, default=str)
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        h.update(p)
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _ns_dir(ns: str) -> Path:
+    return CACHE_DIR / ns
+
+
+def _path_for(ns: str, key: str, suffix: str = "") -> Path:
+    return _ns_dir(ns) / key[:2] / f"{key}{suffix}"
+
+
+def cache_get(ns: str, key: str, ttl: Optional[float] = None, suffix: str = "") -> Optional[bytes]:
+    """Đọc entry; trả None nếu chưa có hoặc đã quá TTL (tính từ lúc ghi). Chạm atime để phục vụ LRU."""
+    f = _path_for(ns, key, suffix)
+    try:
+        st = f.stat()
+    except OSError:
+        return None
+    if ttl is not None and (time.time() - st.st_mtime) > ttl:
+        try:
+            f.unlink()
+        except OSError:
+            pass
+        return None
+    try:
+        data = f.read_bytes()
+    except OSError:
+        return None
+    try:
+        os.utime(f, (time.time(), st.st_mtime))  # giữ mtime = lúc ghi
+    except OSError:
+        pass
+    return data
+
+
+def cache_path(ns: str, key: str, suffix: str = "") -> Path:
+    """Đường dẫn entry (cho dữ liệu lớn ghi/đọc trực tiếp bằng file thay vì bytes). Tạo sẵn thư mục cha."""
+    f = _path_for(ns, key, suffix)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    return f
+
+
+def cache_put(ns: str, key: str, data: bytes, max_bytes: Optional[int] = None, suffix: str = "") -> Path:
+    """Ghi entry (atomic: file tạm + rename), sau đó dọn LRU khi cần nếu có giới hạn dung lượng."""
+    f = _path_for(ns, key, suffix)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    tmp = f.with_name(f"{f.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, f)
+    if max_bytes and _should_prune(ns, len(data), max_bytes):
+        prune(ns, max_bytes)
+    return f
+
+
+def _should_prune(ns: str, added: int, max_bytes: int) -> bool:
+    with _EST_LOCK:
+        est = _EST.get(ns)
+        if est is None:
+            return True  # chưa biết dung lượng thật → quét 1 lần
+        est[0] += added  # ghi đè cùng key bị tính trùng → chỉ làm quét sớm hơn
+        est[1] += 1
+        return est[0] > max_bytes or est[1] >= PRUNE_EVERY
+
+
+def prune(ns: str, max_bytes: int) -> int:
+    """Vượt max_bytes → xoá các entry ít dùng nhất (atime cũ nhất) tới khi còn <= PRUNE_LOW_WATER * max_bytes."""
+    root = _ns_dir(ns)
+    if not root.exists():
+        return 0
+    with _PRUNE_LOCK:
+        entries = []
+        total = 0
+        for f in root.rglob("*"):
+            if not f.is_file() or f.name.endswith(".tmp"):
+                continue
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size, f))
+            total += st.st_size
+        removed = 0
+        if total > max_bytes:
+            target = int(max_bytes * PRUNE_LOW_WATER)
+            entries.sort(key=lambda e: e[0])
+            for _, size, f in entries:
+                if total <= target:
+                    break
+                try:
+                    f.unlink()
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+        with _EST_LOCK:
+            _EST[ns] = [total, 0]
+        return removed
+
+
+def clear(ns: str) -> int:
+    """Xoá toàn bộ namespace; trả về số file đã xoá."""
+    root = _ns_dir(ns)
+    n = 0
+    if not root.exists():
+        return 0
+    for f in root.rglob("*"):
+        if f.is_file():
+            try:
+                f.unlink()
+                n += 1
+            except OSError:
+                pass
+    with _EST_LOCK:
+        _EST.pop(ns, None)
+    return n
@@ -0,0 +1,621 @@
+# core/episode_pipeline.py
+# -*- coding: utf-8 -*-
+"""
+Các bước sinh nội dung tập chạy được không cần UI (dùng chung cho Streamlit, hàng đợi nền, CLI):
+- Dàn ý mùa → danh sách tập (bước "outline").
+- Chuẩn hoá FULL_SCRIPT, tách ASSETS, seed nhân vật (bước "episode").
+- Keyframe prompts theo cảnh + sinh segments Veo 3.1 (bước "veo").
+- Character Bible (bước "character_bible").
+"""
+import json
+import re
+import threading
+from typing import Callable, Optional
+
+from core.data_models import Project, Season, Episode
+from core.prompt_builders import build_episode_prompt_parts, build_outline_prompt_season_parts
+from core.gemini_helpers import gemini_json
+from core.schemas import OUTLINE_SCHEMA, EPISODE_SCHEMA, VEO_SEGMENTS_SCHEMA
+from core.text_utils import clean_tts_text, extract_characters, capcut_sfx_name
+from core.character_bible import ai_generate_character_bible
+from core.parallel import iter_parallel, DEFAULT_WORKERS
+from core.disk_cache import make_key
+from core.image_jobs import guess_location, pick_seed, compile_prompt_context, render_prompt
+from core.project_io import episode_media_dir
+from core import metrics
+from core.memo import content_memo, copy_rows
+from core.profiling import timed
+
+ProgressFn = Callable[[float, str], None]
+
+
+def _stage_tag_values(proj: Project, sidx: Optional[int], ep_idx: Optional[int], stage: str) -> dict:
+    season = proj.seasons[sidx] if sidx is not None and 0 <= sidx < len(proj.seasons) else None
+    ep = season.episodes[ep_idx] if season is not None and ep_idx is not None else None
+    return {"project": proj.name, "season": season.season_index if season else None,
+            "episode": ep.index if ep else None, "stage": stage}
+
+
+def stage_tags(proj: Project, sidx: Optional[int], ep_idx: Optional[int], stage: str):
+    """Nhãn metrics (project / mùa / tập 1-based / stage) cho mọi lệnh gọi model trong phạm vi with."""
+    return metrics.tags(**_stage_tag_values(proj, sidx, ep_idx, stage))
+
+
+# ===================== Outline =====================
+
+def _season_recap_text(p: Project) -> str:
+    if not p or not p.seasons:
+        return ""
+    parts = []
+    # recap các mùa trước (không gồm mùa hiện tại)
+    for s in p.seasons[:-1]:
+        arcs = "; ".join([o.get("title", "") for o in s.outline[:3]]) if s.outline else ""
+        parts.append(f"Mùa {s.season_index}: {arcs}")
+    return "\n".join(parts)
+
+def _clean_ep_title(raw_title: str, ep_index: int) -> str:
+    """
+    Chuẩn hoá tiêu đề:
+    - Gỡ mọi tiền tố numbering: 'Tập 1', 'tap 01', 'Ep 3', 'Episode 10'
+      + chấp nhận dấu cách đặc biệt \u00A0, zero-width \u200b
+      + chấp nhận colon ASCII ':' và fullwidth '：'
+      + chấp nhận gạch nối/ascii & unicode: - – — · • .
+    - Trả về phần tiêu đề tinh gọn. Nếu rỗng → 'Tập {ep_index}'.
+    """
+    t = (raw_title or "").strip()
+    if not t:
+        return f"Tập {ep_index}"
+
+    # chuẩn hoá khoảng trắng: thay NO-BREAK SPACE/zero-width thành space thường
+    t = t.replace("\u00A0", " ").replace("\u200b", "")
+
+    # 1) Xoá các pattern có dấu câu sau số
+    t = re.sub(
+        r'^\s*(?:t[âa]p|tap|ep(?:isode)?)\s*\d+\s*[:：\-\–\—\.\·•]\s*',
+        '', t, flags=re.IGNORECASE
+    )
+    # 2) Xoá nốt trường hợp chỉ có số mà không dấu câu (ex: "Tập 3  Tiêu đề")
+    t = re.sub(r'^\s*(?:t[âa]p|tap|ep(?:isode)?)\s*\d+\s*', '', t, flags=re.IGNORECASE)
+
+    # dọn đuôi kí tự thừa
+    t = t.strip(" -:：·.•—–").strip()
+    return t or f"Tập {ep_index}"
+
+
+def apply_outline_data(season: Season, data, ep_count: int) -> None:
+    """Ghi dàn ý model trả về vào Mùa và tạo lại danh sách Episode (title đã clean)."""
+    outline_list = []
+    if isinstance(data, list):
+        for idx, item in enumerate(data, 1):
+            raw_title = item.get("title") or ""
+            title = _clean_ep_title(raw_title, idx)     # << dùng hàm mạnh
+            beat = item.get("beat") or ""
+            outline_list.append({"title": title, "beat": beat})
+    else:
+        lines = str(data).splitlines()
+        for i, ln in enumerate(lines, 1):
+            outline_list.append({"title": f"Tập {i}", "beat": ln})
+
+    season.episode_count = int(ep_count)
+    season.outline = outline_list
+    season._pending_shards.clear()  # danh sách tập mới thay thế hoàn toàn shard cũ
+    # tạo Episode list từ outline, title đã clean
+    season.episodes = [
+        Episode(
+            index=i+1,
+            title=_clean_ep_title(o.get("title", f"Tập {i+1}"), i+1),
+            summary=o.get("beat", "")
+        )
+        for i, o in enumerate(outline_list)
+    ]
+
+
+# ===================== FULL_SCRIPT / ASSETS =====================
+
+@timed("episode.normalize_to_table")
+@content_memo(maxsize=64)
+def _normalize_to_table(text: str) -> str:
+    """
+    Chuẩn hoá về bảng 3 cột + tự chèn gợi ý CapCut (FX + BGM) CHO TỪNG HÀNG,
+    kể cả khi input đã là bảng Markdown.
+    Không thêm/xoá hàng; chỉ bổ sung gợi ý vào cột Technical Notes nếu thiếu.
+    """
+    if not text:
+        return ""
+
+    # Gợi ý BGM theo loại
+    CAPCUT_BGM_MAP = {
+        "narration":   "CapCut BGM: Calm Piano, Emotional Strings, Ambient Pad, Soft Wind …",
+        "dialogue":    "CapCut BGM: Soft Piano, Gentle Guitar, Light Ambient, Romantic Background …",
+        "voice system":"CapCut BGM: Digital Drone, Synth Pad, Sci-Fi Ambient, Echo Pulse …",
+        "bgm":         "CapCut BGM: Epic Battle, Dark Ambient, Mystery Drone, Cinematic Rise …",
+    }
+    CAPCUT_FX_FALLBACK = "CapCut FX: Whoosh Short, Flash Transition, Riser Hit …"
+
+    def _bgm_hint(ctype_lc: str) -> str:
+        for k, v in CAPCUT_BGM_MAP.items():
+            if k in ctype_lc:
+                return v
+        return ""
+
+    def _augment_notes(ctype: str, notes: str) -> str:
+        """Ghép thêm CapCut FX/BGM nếu notes chưa có."""
+        c_lc = (ctype or "").strip().lower()
+        notes = notes or ""
+        if "capcut" in notes.lower():
+            return notes  # đã có gợi ý, giữ nguyên
+
+        fx_hint = capcut_sfx_name(ctype) or ""
+        if "transition" in c_lc and not fx_hint:
+            fx_hint = CAPCUT_FX_FALLBACK
+        bgm_hint = _bgm_hint(c_lc)
+
+        # Quy tắc: SFX/Transition → ưu tiên FX; Narration/Dialogue/BGM/Voice → BGM
+        extra = fx_hint if any(k in c_lc for k in ["sound effects", "transition"]) else bgm_hint
+        merged = (notes + (" " + extra if extra else "")).strip()
+        return merged
+
+    header_regex = r'^\|\s*Content Type\s*\|\s*Detailed Content\s*\|\s*Technical Notes\s*\|\s*$'
+    has_header = bool(re.search(header_regex, text, flags=re.I | re.M))
+
+    out = ["| Content Type | Detailed Content | Technical Notes |", "|---|---|---|"]
+
+    if has_header:
+        # Parse lại bảng hiện có -> augment notes cho từng hàng
+        for ln in text.splitlines():
+            line = ln.strip()
+            if not line or line.startswith("|---"):
+                continue
+            if re.search(header_regex, line, flags=re.I):
+                continue
+            if not line.startswith("|"):
+                continue
+
+            cols = [c.strip() for c in line.strip("|").split("|")]
+            if len(cols) < 3:
+                continue
+            ctype, content, notes = cols[:3]
+
+            notes2 = _augment_notes(ctype, notes)
+            # Escape '|' để không vỡ bảng
+            content2 = (content or "").replace("|", r"\|")
+            notes2 = (notes2 or "").replace("|", r"\|")
+            out.append(f"| {ctype} | {content2} | {notes2} |")
+        return "\n".join(out)
+
+    # Input chưa là bảng → chuyển từng dòng + bơm gợi ý
+    rows = []
+    for raw in text.splitlines():
+        s = raw.strip()
+        if not s:
+            continue
+        ctype, content, notes = "Narration", s, ""
+        low = s.lower()
+
+        if low.startswith("narration:"):
+            ctype, content = "Narration", s.split(":", 1)[1].strip()
+        elif low.startswith("dialogue:") or low.startswith("dialog:"):
+            ctype, content = "Dialogue", s.split(":", 1)[1].strip()
+        elif low.startswith("voice system:") or low.startswith("system:"):
+            ctype, content = "Voice System", s.split(":", 1)[1].strip()
+        elif low.startswith("sfx:") or s.startswith("[SFX]"):
+            ctype = "Sound Effects"
+            content = s.split("]", 1)[1].strip() if s.startswith("[SFX]") and "]" in s else s.split(":", 1)[1].strip()
+        elif low.startswith("bgm:"):
+            ctype, content = "BGM", s.split(":", 1)[1].strip()
+        elif low.startswith("transition:"):
+            ctype, content = "Transition", s.split(":", 1)[1].strip()
+
+        notes2 = _augment_notes(ctype, notes)
+        rows.append((ctype, content, notes2))
+
+    for ctype, content, notes in rows:
+        content2 = str(content).replace("|", r"\|")
+        notes2 = str(notes).replace("|", r"\|")
+        out.append(f"| {ctype} | {content2} | {notes2} |")
+
+    return "\n".join(out)
+
+
+def _assets_list_from_json(data: dict) -> list:
+    """
+    Lấy list scene từ JSON trả về của model (FULL/ASSETS/TTS).
+    """
+    scenes = []
+    try:
+        raw = data.get("ASSETS") or data.get("assets") or []
+        if isinstance(raw, list):
+            for it in raw:
+                scenes.append({
+                    "scene": (it.get("scene") or "").strip(),
+                    "image_prompt": (it.get("image_prompt") or "").strip(),
+                    "sfx_prompt": (it.get("sfx_prompt") or "").strip(),
+                    "characters": it.get("characters", []),
+                })
+    except Exception:
+        pass
+    return scenes
+
+
+# ===================== Keyframes & Veo 3.1 =====================
+
+def _gen_veo_for_scene(model, proj: Project, ep: Episode, sc: dict, max_segments: int = 3,
+                       use_cache: bool = True) -> dict:
+    """
+    Gọi Gemini để sinh segments Veo 3.1 từ scene.
+    Mỗi segment tương ứng với 1 frame/keyframe chi tiết, có prompt đồng bộ hình ảnh.
+    """
+    sc_name = sc.get("scene", "Cảnh")
+    scene_text = sc.get("image_prompt", "") or sc.get("sfx_prompt", "") or ep.summary
+    char_in_scene = sc.get("characters", [])
+
+    # 1️⃣ Tách keyframes tương ứng scene
+    try:
+        # chỉ lấy frames thuộc scene hiện tại (index dựng 1 lần cho cả tập)
+        frames = list(_keyframe_index(proj, ep)["by_scene"].get(sc_name, []))
+    except Exception:
+        frames = []
+
+    # 2️⃣ Nếu không có frame riêng, fallback 1 frame duy nhất
+    if not frames:
+        frames = [{
+            "scene": sc_name,
+            "frame": 1,
+            "frame_name": f"{sc_name} — Frame 1",
+            "characters": char_in_scene,
+            "image_prompt": _styleize_image_prompt(
+                base=scene_text,
+                aspect_ratio=proj.aspect_ratio,
+                donghua_style=proj.donghua_style,
+                characters=char_in_scene,
+                character_bible=proj.character_bible or {}
+            )
+        }]
+
+    # 3️⃣ Sinh prompt tổng cho Veo (mô tả cách chia segment theo frame)
+    veo_header_prompt = f"""
+Bạn là đạo diễn tiền kỳ Veo 3.1.
+Phân tích cảnh: **{sc_name}**
+Từ các frame key sau, hãy tạo segments video liền mạch (mỗi frame = 1 segment ~8 giây).
+Mỗi segment phải mô tả:
+- hành động / biểu cảm nhân vật
+- chuyển động camera
+- ánh sáng, âm thanh / ambience
+- continuity giữa frame trước & sau
+- phong cách: donghua, 24fps cinematic
+
+Danh sách keyframe:
+{json.dumps([f["image_prompt"] for f in frames], ensure_ascii=False, indent=2)}
+
+Trả về JSON duy nhất:
+{{
+  "scene": "{sc_name}",
+  "segments": [
+    {{
+      "title": "ngắn gọn 3–7 từ",
+      "duration_sec": 8,
+      "characters": ["Tên A","Tên B"],
+      "veo_prompt": "mô tả shot chi tiết theo frame này, continuity, 24fps, {proj.aspect_ratio}",
+      "sfx": "ambience/SFX gợi ý",
+      "notes": "continuity / camera / ánh sáng"
+    }}
+  ]
+}}
+    """.strip()
+
+    # 4️⃣ Gọi Gemini model
+    try:
+        veo_result = gemini_json(model, veo_header_prompt, use_cache=use_cache, schema=VEO_SEGMENTS_SCHEMA)
+    except Exception as e:
+        sc["veo_error"] = str(e)
+        veo_result = None
+
+    # 5️⃣ Lưu kết quả vào scene
+    sc["veo_prompt"] = veo_header_prompt
+    if isinstance(veo_result, dict) and isinstance(veo_result.get("segments"), list):
+        sc["veo31_segments"] = veo_result["segments"]
+    else:
+        sc["veo31_segments"] = []
+        sc["veo_raw_response"] = veo_result
+
+    return sc
+
+
+# ====== build image prompts per scene (anchor frames) ======
+
+def _styleize_image_prompt(base: str, aspect_ratio: str, donghua_style: bool, characters: list, character_bible: dict) -> str:
+    """Hợp nhất image_prompt + style + nhân vật để render frame/ảnh neo (anchor) cho đồng bộ video."""
+    return render_prompt(compile_prompt_context(character_bible, aspect_ratio, donghua_style), base, characters)
+
+def _script_table_lines(script_text: str):
+    """Tách 1 lần các dòng bảng (bắt đầu bằng '|') của script; dùng chung cho mọi scene."""
+    return [ln for ln in (script_text or "").splitlines() if ln.strip().startswith("|")]
+
+
+@timed("episode.compose_scene_image_prompts")
+@content_memo(maxsize=32, key=lambda proj, ep: _keyframe_index_key(proj, ep),
+              copy=lambda r: (r[0], copy_rows(r[1])))
+def _compose_scene_image_prompts(proj: Project, ep: Episode):
+    """
+    Sinh danh sách prompt ảnh chi tiết (keyframes) từ 1 scene:
+    - Mỗi Narration / Sound Effects → 1 frame riêng.
+    - Bảo toàn characters + phong cách.
+    """
+    scenes = (ep.assets or {}).get("scenes", []) or []
+    out_lines, out_json = [], []
+    # Quét script 1 lần: dòng Narration/Sound Effects thuộc mọi scene, phần còn lại lọc theo tên
+    table_lines = _script_table_lines(ep.script_text)
+    prompt_ctx = compile_prompt_context(proj.character_bible, proj.aspect_ratio, proj.donghua_style)
+    common = {i for i, ln in enumerate(table_lines) if "Narration" in ln or "Sound Effects" in ln}
+    for i, sc in enumerate(scenes, 1):
+        name = sc.get("scene", f"Cảnh {i}")
+        base_text = sc.get("image_prompt", "") or sc.get("sfx_prompt", "") or ep.summary
+        chars = sc.get("characters", [])
+        seed = pick_seed(chars, guess_location(name), name, ep.title)  # seed ổn định → kho ảnh dùng lại được
+
+        # tìm các dòng chứa từ khóa trong tên scene
+        words = name.split()
+        kw = words[0] if words else None
+        sublines = [
+            ln for j, ln in enumerate(table_lines)
+            if j in common or (kw is not None and kw in ln)
+        ]
+        # nếu không có -> 1 frame
+        if not sublines:
+            sublines = [base_text]
+
+        for j, ln in enumerate(sublines, 1):
+            desc = ln
+            if "|" in ln:
+                parts = [p.strip() for p in ln.strip("|").split("|")]
+                if len(parts) >= 2:
+                    desc = parts[1]
+            # hợp nhất style + char (Bible/style đã compile 1 lần cho cả tập)
+            full_prompt = render_prompt(prompt_ctx, desc, chars)
+            frame_name = f"{name} — Frame {j}"
+            out_lines.append(
+                f"### Scene {i}: {frame_name}\n"
+                f"- Characters: {', '.join(chars) if chars else '(none)'}\n"
+                f"- Image Prompt:\n{full_prompt}\n"
+            )
+            out_json.append({
+                "scene_index": i,
+                "scene": name,
+                "frame": j,
+                "frame_name": frame_name,
+                "characters": chars,
+                "seed": seed,
+                "image_prompt": full_prompt
+            })
+    return ("\n".join(out_lines)).strip(), out_json
+
+
+# ====== Keyframe index theo tập (build 1 lần / mỗi phiên bản script) ======
+
+def _keyframe_index_key(proj: Project, ep: Episode) -> str:
+    scenes = (ep.assets or {}).get("scenes", []) or []
+    sig = [
+        [sc.get("scene"), sc.get("image_prompt"), sc.get("sfx_prompt"), sc.get("characters")]
+        for sc in scenes
+    ]
+    return make_key(
+        ep.script_text or "", ep.summary or "", ep.title or "", sig,
+        proj.aspect_ratio, proj.donghua_style, proj.character_bible or {},
+    )
+
+
+@content_memo(maxsize=32, key=_keyframe_index_key)
+def _keyframe_index(proj: Project, ep: Episode) -> dict:
+    """
+    Index keyframes của tập: {"text", "frames", "by_scene": {scene_name: [frames]}}.
+    Cache theo hash nội dung (script + scenes + style + bible) nên tự vô hiệu khi chỉnh sửa;
+    tra cứu 1 scene là O(1) thay vì dựng lại toàn bộ keyframes cho mỗi scene.
+    """
+    txt_block, frames = _compose_scene_image_prompts(proj, ep)
+    by_scene = {}
+    for f in frames:
+        by_scene.setdefault(f["scene"], []).append(f)
+    return {"text": txt_block, "frames": frames, "by_scene": by_scene}
+
+
+# ===================== Stages (headless) =====================
+
+_BIBLE_LOCK = threading.Lock()
+
+
+def apply_episode_data(proj: Project, ep: Episode, data) -> bool:
+    """
+    Ghi kết quả JSON FULL/ASSETS/TTS của model vào tập + seed nhân vật vào Character Bible.
+    Trả về False nếu dữ liệu không đúng định dạng.
+    """
+    if not isinstance(data, dict):
+        return False
+    full_script = data.get("FULL_SCRIPT") or data.get("full_script") or ""
+    assets_list = _assets_list_from_json(data)
+    tts_text = data.get("TTS") or data.get("tts") or ""
+
+    full_script = _normalize_to_table(full_script)
+    ep.script_text = full_script
+    ep.assets = {"scenes": assets_list}
+    ep.tts_text = clean_tts_text(tts_text)
+
+    # Seed nhân vật vào Character Bible
+    try:
+        char_from_script = extract_characters(ep.script_text)
+        char_from_tts = extract_characters(ep.tts_text or "")
+        char_names_all = sorted(set(char_from_script) | set(char_from_tts))
+        if char_names_all:
+            # nhiều tập chạy song song (CLI/worker) → đọc-sửa-ghi Bible dưới khoá; thay list mới thay vì
+            # append tại chỗ để luồng đang đọc (dựng prompt ảnh, save_project) không thấy list đang đổi
+            with _BIBLE_LOCK:
+                cb = proj.character_bible or {}
+                chars = list(cb.get("characters") or [])
+                existing = {c.get("name") for c in chars}
+                for n in char_names_all:
+                    if n and n not in existing:
+                        existing.add(n)
+                        chars.append({
+                            "name": n, "role": "", "age": "",
+                            "look": "gương mặt Á Đông; tránh nét siêu thực Tây phương",
+                            "hair": "", "outfit": "", "color_theme": "", "notes": "donghua/cel-shaded"
+                        })
+                proj.character_bible = {**cb, "characters": chars}
+    except Exception:
+        pass
+    return True
+
+
+def run_outline_stage(model, proj: Project, sidx: int, ep_count: int, use_cache: bool = True) -> None:
+    """Sinh dàn ý cho Mùa sidx (ghi đè outline + danh sách tập)."""
+    season = proj.seasons[sidx]
+    recap = _season_recap_text(proj) if sidx > 0 else ""
+    prefix, prompt = build_outline_prompt_season_parts(proj.chosen_storyline, int(ep_count), recap, preset_name=proj.preset)
+    with stage_tags(proj, sidx, None, "outline"):
+        data = gemini_json(model, prompt, use_cache=use_cache, prefix=prefix, cache_owner=proj.name,
+                           schema=OUTLINE_SCHEMA)
+    apply_outline_data(season, data, ep_count)
+
+
+def run_episode_stage(model, proj: Project, sidx: int, ep_idx: int, use_cache: bool = True) -> bool:
+    """Sinh FULL/ASSETS/TTS cho 1 tập (không streaming)."""
+    ep = proj.seasons[sidx].episodes[ep_idx]
+    prefix, prompt = build_episode_prompt_parts(proj.chosen_storyline, ep.title, ep.summary, preset_name=proj.preset)
+    with stage_tags(proj, sidx, ep_idx, "episode"):
+        data = gemini_json(model, prompt, use_cache=use_cache, prefix=prefix, cache_owner=proj.name,
+                           schema=EPISODE_SCHEMA)
+    return apply_episode_data(proj, ep, data)
+
+
+def run_veo_stage(
+    model, proj: Project, sidx: int, ep_idx: int,
+    max_workers: int = DEFAULT_WORKERS, use_cache: bool = True,
+    progress: Optional[ProgressFn] = None,
+) -> int:
+    """Sinh Veo 3.1 cho mọi cảnh của tập (song song, giữ thứ tự cảnh). Trả về số cảnh lỗi."""
+    ep = proj.seasons[sidx].episodes[ep_idx]
+    scenes = list((ep.assets or {}).get("scenes", []) or [])
+    if not scenes:
+        return 0
+    _keyframe_index(proj, ep)  # dựng index 1 lần trước khi fan-out
+
+    def _one(sc):
+        # làm trên bản sao: project có thể đang được lưu từ luồng khác
+        return _gen_veo_for_scene(model, proj, ep, dict(sc), max_segments=3, use_cache=use_cache)
+
+    n_err = 0
+    tagged = metrics.iter_tagged(iter_parallel(_one, scenes, max_workers=max_workers),
+                                 **_stage_tag_values(proj, sidx, ep_idx, "veo"))
+    for k, (i_sc, res, err) in enumerate(tagged, 1):
+        if err is not None:
+            scenes[i_sc]["veo_error"] = str(err)
+            n_err += 1
+        else:
+            scenes[i_sc] = res
+        if progress:
+            progress(k / len(scenes), f"Veo {k}/{len(scenes)}: {scenes[i_sc].get('scene', '')}")
+    ep.assets = {"scenes": scenes}
+    return n_err
+
+
+def run_character_bible_stage(model, proj: Project, sidx: int, use_cache: bool = True, max_chars: int = 8) -> bool:
+    """Sinh Character Bible bằng AI cho project (dựa trên dàn ý mùa sidx)."""
+    with stage_tags(proj, sidx, None, "character_bible"):
+        cb = ai_generate_character_bible(
+            model,
+            project_name=proj.name,
+            idea=proj.idea,
+            chosen_storyline=proj.chosen_storyline,
+            outline=proj.seasons[sidx].outline if proj.seasons else None,
+            max_chars=max_chars,
+            use_cache=use_cache,
+            preset_name=proj.preset,
+            cache_owner=proj.name,
+        )
+    if cb and isinstance(cb, dict) and cb.get("characters"):
+        proj.character_bible = cb
+        return True
+    return False
+
+
+# ===================== Ảnh keyframe (Gemini 2.5) =====================
+
+def iter_keyframe_images(
+    proj: Project, sidx: int, ep_idx: int,
+    model_name: str = "gemini-2.5-flash-image", size_hint: str = "1024x576",
+    max_workers: int = DEFAULT_WORKERS, timeout_sec: Optional[float] = None,
+    use_cache: bool = True,
+):
+    """
+    Sinh ảnh cho mọi keyframe của tập, ghi file vào media dir và gắn đường dẫn vào scene (sc["images"]).
+    Yield (k, tổng, frame, entry|None, msg) theo thứ tự hoàn thành — không giữ ảnh trong RAM sau khi ghi.
+    """
+    from core.gemini_image import gemini25_images_generate_iter
+    from core.media_files import save_keyframe_image, attach_scene_image
+
+    season = proj.seasons[sidx]
+    ep = season.episodes[ep_idx]
+    frames = _keyframe_index(proj, ep)["frames"]
+    if not frames:
+        return
+    out_dir = episode_media_dir(proj, season.season_index, ep.index)
+    gen = metrics.iter_tagged(gemini25_images_generate_iter(
+        [fr["image_prompt"] for fr in frames],
+        model_name=model_name, size_hint=size_hint,
+        max_workers=max_workers, timeout_sec=timeout_sec,
+        seeds=[fr.get("seed") for fr in frames], use_cache=use_cache,
+    ), **_stage_tag_values(proj, sidx, ep_idx, "images"))
+    for k, (i_fr, img, msg) in enumerate(gen, 1):
+        fr = frames[i_fr]
+        entry = None
+        if img is not None:
+            entry = save_keyframe_image(out_dir, fr, img, {"model": model_name, "size": size_hint, "source": msg})
+            attach_scene_image(ep, fr, entry)
+            img.close()
+        yield k, len(frames), fr, entry, msg
+
+
+def run_image_stage(
+    proj: Project, sidx: int, ep_idx: int,
+    model_name: str = "gemini-2.5-flash-image", size_hint: str = "1024x576",
+    max_workers: int = DEFAULT_WORKERS, timeout_sec: Optional[float] = None,
+    use_cache: bool = True, progress: Optional[ProgressFn] = None,
+) -> int:
+    """Bản headless của iter_keyframe_images; trả về số ảnh lỗi."""
+    n_err = 0
+    for k, total, fr, entry, msg in iter_keyframe_images(
+        proj, sidx, ep_idx, model_name=model_name, size_hint=size_hint,
+        max_workers=max_workers, timeout_sec=timeout_sec, use_cache=use_cache,
+    ):
+        if entry is None:
+            n_err += 1
+        if progress:
+            progress(k / total, f"Ảnh {k}/{total}: {fr['frame_name']}")
+    return n_err
+
+
+# ===================== TTS =====================
+
+def tts_output_base(proj: Project, sidx: int, ep_idx: int):
+    season = proj.seasons[sidx]
+    return episode_media_dir(proj, season.season_index, season.episodes[ep_idx].index) / "tts" / "episode"
+
+
+def find_tts_audio(proj: Project, sidx: int, ep_idx: int):
+    """File audio đã render của tập (mới nhất giữa .mp3/.wav) hoặc None."""
+    base = tts_output_base(proj, sidx, ep_idx)
+    files = [f for f in (base.with_suffix(".mp3"), base.with_suffix(".wav")) if f.is_file()]
+    return max(files, key=lambda f: f.stat().st_mtime) if files else None
+
+
+def run_tts_stage(
+    proj: Project, sidx: int, ep_idx: int, backend: str = "gtts",
+    max_workers: int = DEFAULT_WORKERS, use_cache: bool = True,
+    progress: Optional[ProgressFn] = None,
+) -> dict:
+    """Render ep.tts_text thành 1 file audio trong media dir (chỉ tổng hợp chunk đã đổi)."""
+    from core.tts_engine import render_tts
+    ep = proj.seasons[sidx].episodes[ep_idx]
+    return render_tts(
+        ep.tts_text or "", tts_output_base(proj, sidx, ep_idx), backend=backend,
+        max_workers=max_workers, use_cache=use_cache, progress=progress,
+    )
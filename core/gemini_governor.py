@@ -0,0 +1,199 @@
+# core/gemini_governor.py
+# -*- coding: utf-8 -*-
+"""
+Bộ điều phối dùng chung cho mọi lệnh gọi Gemini (text/JSON/ảnh):
+- Token bucket theo từng model (giới hạn request/phút, dùng chung giữa các luồng).
+- Retry lỗi tạm thời (429/5xx/timeout) với exponential backoff + jitter.
+- Circuit breaker: lỗi liên tiếp quá ngưỡng → tạm ngắt model đó một lúc.
+Lỗi vĩnh viễn (400/401/403/…) được ném ra ngay, không retry.
+"""
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_RPM = float(os.getenv("GEMINI_RPM", "60"))
+DEFAULT_BURST = int(os.getenv("GEMINI_BURST", "5"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BASE_DELAY_SEC = 1.0
+MAX_DELAY_SEC = 30.0
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN_SEC = 60.0
+
+_TRANSIENT_CODES = {408, 429, 500, 502, 503, 504}
+_TRANSIENT_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "ServerError",
+    "Timeout", "TimeoutError", "ConnectTimeout", "ReadTimeout", "ConnectError",
+    "ConnectionError", "RemoteDisconnected",
+}
+_TRANSIENT_MSG = re.compile(
+    r"\b(?:429|500|502|503|504)\b|quota|rate.?limit|resource.?exhausted|unavailable|"
+    r"deadline|timed? ?out|overloaded|connection (?:reset|aborted|refused)",
+    re.I,
+)
+
+
+class GeminiTransportError(RuntimeError):
+    """Lỗi gọi API (mạng/quota/server) sau khi đã retry hết, hoặc circuit đang mở."""
+
+
+class CircuitOpenError(GeminiTransportError):
+    """Model đang bị tạm ngắt do lỗi liên tiếp."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("code", "status_code", "http_status"):
+        v = getattr(exc, attr, None)
+        if callable(v):
+            try:
+                v = v()
+            except Exception:
+                v = None
+        v = getattr(v, "value", v)  # grpc StatusCode enum
+        if isinstance(v, tuple):
+            v = v[0]
+        if isinstance(v, int):
+            return v
+    resp = getattr(exc, "response", None)
+    v = getattr(resp, "status_code", None)
+    return v if isinstance(v, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Lỗi tạm thời (đáng retry) hay vĩnh viễn."""
+    code = _status_code(exc)
+    if code is not None and code in _TRANSIENT_CODES:
+        return True
+    if code is not None and 400 <= code < 500:
+        return False
+    for cls in type(exc).__mro__:
+        if cls.__name__ in _TRANSIENT_NAMES:
+            return True
+    return bool(_TRANSIENT_MSG.search(str(exc) or ""))
+
+
+# ====== Token bucket ======
+
+class TokenBucket:
+    def __init__(self, rate_per_min: float = DEFAULT_RPM, burst: int = DEFAULT_BURST):
+        self.rate = max(float(rate_per_min), 0.001) / 60.0
+        self.capacity = max(int(burst), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Chờ tới khi có 1 token."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# ====== Circuit breaker ======
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown_sec: float = BREAKER_COOLDOWN_SEC):
+        self.threshold = threshold
+        self.cooldown = cooldown_sec
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def check(self, name: str) -> None:
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remain = self.cooldown - (time.monotonic() - self.opened_at)
+            if remain > 0:
+                raise CircuitOpenError(f"{name}: tạm ngắt do lỗi liên tiếp, thử lại sau {remain:.0f}s")
+            # half-open: cho 1 lần thử
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def record(self, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_BUCKETS: Dict[str, TokenBucket] = {}
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _bucket(name: str) -> TokenBucket:
+    with _REGISTRY_LOCK:
+        if name not in _BUCKETS:
+            _BUCKETS[name] = TokenBucket()
+        return _BUCKETS[name]
+
+
+def _breaker(name: str) -> CircuitBreaker:
+    with _REGISTRY_LOCK:
+        if name not in _BREAKERS:
+            _BREAKERS[name] = CircuitBreaker()
+        return _BREAKERS[name]
+
+
+def configure_model(name: str, rate_per_min: float, burst: int = DEFAULT_BURST) -> None:
+    """Đặt giới hạn request/phút riêng cho 1 model."""
+    with _REGISTRY_LOCK:
+        _BUCKETS[name] = TokenBucket(rate_per_min, burst)
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter: random trong [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(MAX_DELAY_SEC, BASE_DELAY_SEC * (2 ** attempt)))
+
+
+_CALL_STATE = threading.local()
+
+
+def last_retries() -> int:
+    """Số lần retry của governed_call gần nhất trong luồng hiện tại (cho metrics)."""
+    return getattr(_CALL_STATE, "retries", 0)
+
+
+def governed_call(model_name: str, fn: Callable[..., Any], *args, max_retries: int = MAX_RETRIES, **kwargs) -> Any:
+    """
+    Gọi fn(*args, **kwargs) qua rate limit + retry + circuit breaker của model_name.
+    - Lỗi tạm thời: retry tối đa max_retries lần; hết lượt → GeminiTransportError.
+    - Lỗi vĩnh viễn: ném nguyên lỗi gốc.
+    """
+    name = model_name or "default"
+    breaker = _breaker(name)
+    bucket = _bucket(name)
+    attempt = 0
+    _CALL_STATE.retries = 0
+    while True:
+        breaker.check(name)
+        bucket.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            breaker.record(False)
+            if attempt >= max_retries:
+                raise GeminiTransportError(f"{name}: lỗi sau {attempt + 1} lần thử: {e}") from e
+            time.sleep(_backoff(attempt))
+            attempt += 1
+            _CALL_STATE.retries = attempt
+            continue
+        breaker.record(True)
+        return result
@@ -1,26 +1,179 @@
-import re, json
+import json, re, time
+from typing import Iterator, Optional
 
-def gemini_json(model, prompt: str):
-    if model is None:
-        raise RuntimeError("Model chưa được khởi tạo")
+from core.disk_cache import make_key, cache_get, cache_put
+from core.gemini_governor import governed_call, last_retries, GeminiTransportError, _status_code
+from core.prompt_builders import join_prompt
+from core.json_repair import repair_json
+from core import context_cache, metrics
+
+# Cache phản hồi text theo (model + generation_config + prompt)
+CACHE_NS = "gemini"
+CACHE_TTL_SEC = 7 * 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+_CONFIG_REJECT_MSG = re.compile(r"response_schema|response_mime_type|mime.?type|schema|GenerationConfig", re.I)
+_CACHE_ERROR_MSG = re.compile(r"cached.?content|context.?cach", re.I)
+
+def _is_config_rejection(exc: BaseException) -> bool:
+    """SDK/API từ chối chính generation_config (schema / mime type) — lỗi xảy ra trước khi sinh, gọi lại không mất tiền."""
+    code = _status_code(exc)
+    bad_request = (code == 400 or isinstance(exc, (TypeError, ValueError))
+                   or any(c.__name__ in ("InvalidArgument", "BadRequest") for c in type(exc).__mro__))
+    return bad_request and bool(_CONFIG_REJECT_MSG.search(str(exc) or ""))
+
+def _is_cache_error(exc: BaseException) -> bool:
+    """Lỗi do context cache phía server (hết hạn/bị xoá/không truy cập được)."""
+    code = _status_code(exc)
+    if code == 404 or any(c.__name__ == "NotFound" for c in type(exc).__mro__):
+        return True
+    return bool(_CACHE_ERROR_MSG.search(str(exc) or ""))
+
+def _model_name(model) -> str:
+    return getattr(model, "model_name", "") or type(model).__name__
+
+def _call_target(model, prompt: str, prefix: str, cache_owner: Optional[str]):
+    """(model gọi, prompt gửi): prefix nằm trong context cache → chỉ gửi suffix; ngược lại gửi prompt đầy đủ."""
+    if prefix:
+        cm = context_cache.cached_model(model, prefix, cache_owner) if cache_owner else None
+        if cm is not None:
+            return cm, prompt
+        return model, join_prompt(prefix, prompt)
+    return model, prompt
+
+def _generate_content(model, prompt: str, generation_config: Optional[dict], prefix: str,
+                      cache_owner: Optional[str], **kw):
+    target, text = _call_target(model, prompt, prefix, cache_owner)
+    args = {"generation_config": generation_config} if generation_config else {}
+    try:
+        return governed_call(_model_name(model), target.generate_content, text, **args, **kw)
+    except GeminiTransportError:
+        raise
+    except Exception as e:
+        if target is model or not _is_cache_error(e):
+            raise
+        # cache phía server hết hạn/bị xoá → bỏ handle, gửi prompt đầy đủ
+        context_cache.invalidate(cache_owner)
+        return governed_call(_model_name(model), model.generate_content, join_prompt(prefix, prompt), **args, **kw)
+
+def _generate_text(model, prompt: str, generation_config: Optional[dict] = None, use_cache: bool = True,
+                   prefix: str = "", cache_owner: Optional[str] = None) -> str:
+    """
+    Gọi model.generate_content và trả về resp.text; dùng cache đĩa nếu use_cache.
+    prefix: phần đầu prompt dùng chung (context cache theo cache_owner); key cache đĩa tính trên prompt đầy đủ.
+    Chỉ cache phản hồi không rỗng.
+    """
+    key = make_key(_model_name(model), generation_config or {}, join_prompt(prefix, prompt))
+    if use_cache:
+        hit = cache_get(CACHE_NS, key, ttl=CACHE_TTL_SEC)
+        if hit is not None:
+            metrics.record("text", _model_name(model), cache_hit=True)
+            return hit.decode("utf-8")
+    t0 = time.perf_counter()
     try:
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-        return json.loads(resp.text or "{}")
+        resp = _generate_content(model, prompt, generation_config, prefix, cache_owner)
+    except Exception as e:
+        metrics.record("text", _model_name(model), latency_ms=(time.perf_counter() - t0) * 1000,
+                       retries=last_retries(), error=str(e))
+        raise
+    metrics.record("text", _model_name(model), resp, latency_ms=(time.perf_counter() - t0) * 1000,
+                   retries=last_retries())
+    txt = resp.text or ""
+    if txt:
+        cache_put(CACHE_NS, key, txt.encode("utf-8"), max_bytes=CACHE_MAX_BYTES)
+    return txt
+
+def _parse_json_text(txt: str):
+    """Parse JSON từ text đã có (không gọi lại model): json.loads → repair_json 1 lượt; thất bại → {"raw": txt}."""
+    try:
+        return json.loads(txt or "{}")
     except Exception:
-        resp = model.generate_content(prompt)
-        txt = resp.text or ""
-        m = re.search(r"```json\s*(\{.*?\}|\[.*?\])\s*```", txt, flags=re.S|re.I)
-        if m:
-            try: return json.loads(m.group(1))
-            except Exception: pass
-        m2 = re.search(r"(\{.*\}|\[.*\])", txt, flags=re.S)
-        if m2:
-            try: return json.loads(m2.group(1))
-            except Exception: pass
+        pass
+    try:
+        return repair_json(txt)
+    except ValueError:
         return {"raw": txt}
 
-def gemini_text(model, prompt: str) -> str:
+def _json_configs(schema: Optional[dict]) -> list:
+    """Thứ tự generation_config thử: schema có kiểu → JSON mode → không config."""
+    cfgs = [{"response_mime_type": "application/json"}, None]
+    if schema:
+        cfgs.insert(0, {"response_mime_type": "application/json", "response_schema": schema})
+    return cfgs
+
+def gemini_json(model, prompt: str, use_cache: bool = True, prefix: str = "", cache_owner: Optional[str] = None,
+                schema: Optional[dict] = None):
+    """
+    Sinh JSON: gọi 1 lần với response_mime_type=application/json (+ response_schema nếu có) rồi parse tại chỗ.
+    - schema: response_schema từ core.schemas (structured output, model trả đúng khoá/kiểu).
+    - prefix/cache_owner: xem _generate_text (prompt builders *_parts trả về (prefix, suffix)).
+    - Lỗi parse: sửa từ chính text đã nhận (repair_json), KHÔNG sinh lại.
+    - Lỗi mạng/quota (GeminiTransportError): ném ra cho caller.
+    - Chỉ gọi lại với config đơn giản hơn khi SDK/API từ chối chính generation_config
+      (schema → JSON mode → không config); mọi lỗi khác (safety block, key sai…) ném ra ngay lần đầu.
+    """
+    if model is None:
+        raise RuntimeError("Model chưa được khởi tạo")
+    cfgs = _json_configs(schema)
+    for k, cfg in enumerate(cfgs):
+        try:
+            txt = _generate_text(model, prompt, cfg, use_cache=use_cache, prefix=prefix, cache_owner=cache_owner)
+            break
+        except GeminiTransportError:
+            raise
+        except Exception as e:
+            if k == len(cfgs) - 1 or not _is_config_rejection(e):
+                raise
+    return _parse_json_text(txt)
+
+def gemini_stream(model, prompt: str, json_mode: bool = False, use_cache: bool = True,
+                  prefix: str = "", cache_owner: Optional[str] = None, schema: Optional[dict] = None) -> Iterator[str]:
+    """
+    Sinh dạng streaming: yield từng đoạn text (delta) ngay khi model trả về.
+    Cache chung với gemini_json/gemini_text (cache hit → yield toàn bộ text 1 lần).
+    schema: response_schema khi json_mode (xem gemini_json).
+    """
+    if model is None:
+        raise RuntimeError("Model chưa được khởi tạo")
+    cfg = _json_configs(schema)[0] if json_mode else None
+    key = make_key(_model_name(model), cfg or {}, join_prompt(prefix, prompt))
+    if use_cache:
+        hit = cache_get(CACHE_NS, key, ttl=CACHE_TTL_SEC)
+        if hit is not None:
+            metrics.record("stream", _model_name(model), cache_hit=True)
+            yield hit.decode("utf-8")
+            return
+    t0 = time.perf_counter()
+    try:
+        stream = _generate_content(model, prompt, cfg, prefix, cache_owner, stream=True)
+    except GeminiTransportError:
+        raise
+    except Exception as e:
+        if not (json_mode and schema and _is_config_rejection(e)):
+            raise
+        # model/SDK từ chối response_schema → JSON mode thường
+        cfg = _json_configs(None)[0]
+        key = make_key(_model_name(model), cfg, join_prompt(prefix, prompt))
+        stream = _generate_content(model, prompt, cfg, prefix, cache_owner, stream=True)
+    retries = last_retries()
+    parts = []
+    last = None
+    for chunk in stream:
+        if getattr(chunk, "usage_metadata", None) is not None:
+            last = chunk  # usage đầy đủ nằm ở chunk cuối có usage_metadata
+        try:
+            piece = chunk.text or ""
+        except Exception:
+            piece = ""  # chunk không có text (VD: chỉ có safety/finish info)
+        if piece:
+            parts.append(piece)
+            yield piece
+    metrics.record("stream", _model_name(model), last, latency_ms=(time.perf_counter() - t0) * 1000, retries=retries)
+    txt = "".join(parts)
+    if txt:
+        cache_put(CACHE_NS, key, txt.encode("utf-8"), max_bytes=CACHE_MAX_BYTES)
+
+def gemini_text(model, prompt: str, use_cache: bool = True, prefix: str = "", cache_owner: Optional[str] = None) -> str:
     if model is None:
         raise RuntimeError("Model chưa được khởi tạo")
-    resp = model.generate_content(prompt)
-    return resp.text or ""
+    return _generate_text(model, prompt, use_cache=use_cache, prefix=prefix, cache_owner=cache_owner)
@@ -1,76 +1,193 @@
 # core/gemini_image.py
 # -*- coding: utf-8 -*-
+import contextvars
 import io
 import os
-from typing import List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple
 
 from PIL import Image
 from google import genai
-# from google.genai import types as gai_types 
+from google.genai import types as gai_types
 
+from core.gemini_governor import governed_call, last_retries
+from core import metrics
+from core.image_store import image_key, store_get, store_put, generation_lock
 
-def _first_image_from_parts(parts) -> Optional[Image.Image]:
-    """Lấy ảnh đầu tiên từ response.candidates[0].content.parts (inline_data)."""
-    if not parts:
+DEFAULT_IMAGE_WORKERS = 4
+DEFAULT_IMAGE_TIMEOUT_SEC = 120
+
+# Client dùng chung (giữ connection pool); tách theo API key + timeout để đổi key lúc chạy vẫn đúng
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_client(timeout_sec: Optional[float] = None) -> "genai.Client":
+    """Trả về genai.Client dùng lại giữa các lần gọi (thread-safe)."""
+    api_key = os.getenv("GEMINI_API_KEY", "") or os.getenv("GOOGLE_API_KEY", "")
+    key = (api_key, timeout_sec)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            http_options = gai_types.HttpOptions(timeout=int(timeout_sec * 1000)) if timeout_sec else None
+            # Client tự đọc API key từ env: GEMINI_API_KEY hoặc GOOGLE_API_KEY
+            client = genai.Client(http_options=http_options) if http_options else genai.Client()
+            _CLIENTS[key] = client
+        return client
+
+
+def _open_image(data: bytes) -> Optional[Image.Image]:
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+    except Exception:
         return None
+
+
+def _first_image_from_parts(parts) -> Tuple[Optional[Image.Image], Optional[bytes]]:
+    """Lấy ảnh đầu tiên (kèm bytes gốc) từ response.candidates[0].content.parts (inline_data)."""
+    if not parts:
+        return None, None
     for p in parts:
         inline = getattr(p, "inline_data", None)
         if inline and getattr(inline, "data", None):
-            try:
-                return Image.open(io.BytesIO(inline.data))
-            except Exception:
-                pass
-    return None
+            img = _open_image(inline.data)
+            if img is not None:
+                return img, inline.data
+    return None, None
 
 
 def gemini25_image_generate(
     prompt: str,
     model_name: str = "gemini-2.5-flash-image",
     size_hint: str = "1024x576",
+    timeout_sec: Optional[float] = None,
+    seed: Optional[int] = None,
+    use_cache: bool = True,
 ) -> Tuple[Optional[Image.Image], str]:
     """
     Sinh ảnh bằng Gemini 2.5 Flash Image (Nano Banana) qua SDK google-genai.
-    Trả về: (Pillow Image hoặc None, log_msg)
+    Trả về: (Pillow Image hoặc None, log_msg) — log_msg = "cache" nếu lấy từ kho ảnh.
     - Yêu cầu biến môi trường: GEMINI_API_KEY hoặc GOOGLE_API_KEY
+    - timeout_sec: giới hạn thời gian cho mỗi request (None = mặc định của SDK)
+    - seed: cố định seed (cùng prompt + seed + size → dùng lại ảnh trong kho nếu use_cache)
     """
-    # Client tự đọc API key từ env: GEMINI_API_KEY hoặc GOOGLE_API_KEY
-    client = genai.Client()
+    key = image_key(model_name, prompt, seed, size_hint)
+    if use_cache:
+        data = store_get(key)
+        img = _open_image(data) if data else None
+        if img is not None:
+            metrics.record("image", model_name, cache_hit=True)
+            return img, "cache"
+
+    with generation_lock(key):
+        if use_cache:
+            # luồng khác có thể vừa sinh xong đúng ảnh này
+            data = store_get(key)
+            img = _open_image(data) if data else None
+            if img is not None:
+                metrics.record("image", model_name, cache_hit=True)
+                return img, "cache"
+        return _generate_uncached(prompt, model_name, size_hint, timeout_sec, seed, key)
+
+
+def _generate_uncached(prompt: str, model_name: str, size_hint: str, timeout_sec: Optional[float],
+                       seed: Optional[int], key: str) -> Tuple[Optional[Image.Image], str]:
+    client = _get_client(timeout_sec)
 
     # Khuyến nghị: ghi kích thước mong muốn vào prompt (model hiện nhận theo ngôn ngữ tự nhiên)
     full_prompt = f"Generate an image ~{size_hint}. {prompt}".strip()
 
+    t0 = time.perf_counter()
+    resp = None
     try:
-        resp = client.models.generate_content(
+        kwargs = {}
+        if seed is not None:
+            kwargs["config"] = gai_types.GenerateContentConfig(seed=int(seed))
+        resp = governed_call(
+            model_name,
+            client.models.generate_content,
             model=model_name,
             contents=[full_prompt],
-            # Nếu cần có thể thêm generation_config hoặc safety_settings
-            # generation_config=gai_types.GenerateContentConfig(temperature=0.4),
+            **kwargs,
         )
+        metrics.record("image", model_name, resp, latency_ms=(time.perf_counter() - t0) * 1000,
+                       retries=last_retries())
         if not resp or not resp.candidates:
             return None, "No candidates from model."
 
         parts = resp.candidates[0].content.parts
-        img = _first_image_from_parts(parts)
+        img, data = _first_image_from_parts(parts)
         if img is None:
             return None, (
                 "No image data in response. Check model name is 'gemini-2.5-flash-image' "
                 "and your API key has image-generation access."
             )
+        try:
+            store_put(key, data)
+        except OSError:
+            pass  # kho đầy/không ghi được → vẫn trả ảnh
         return img, "ok"
 
     except Exception as e:
         # gRPC cảnh báo kiểu 'ALTS creds ignored...' là bình thường, có thể bỏ qua
+        if resp is None:
+            metrics.record("image", model_name, latency_ms=(time.perf_counter() - t0) * 1000,
+                           retries=last_retries(), error=str(e))
         return None, f"Gemini 2.5 image error: {e}"
 
 
+def gemini25_images_generate_iter(
+    prompts: List[str],
+    model_name: str = "gemini-2.5-flash-image",
+    size_hint: str = "1024x576",
+    max_workers: int = DEFAULT_IMAGE_WORKERS,
+    timeout_sec: Optional[float] = DEFAULT_IMAGE_TIMEOUT_SEC,
+    seeds: Optional[List[Optional[int]]] = None,
+    use_cache: bool = True,
+) -> Iterator[Tuple[int, Optional[Image.Image], str]]:
+    """
+    Sinh nhiều ảnh song song (tối đa max_workers request cùng lúc, dùng chung 1 client).
+    Yield (index, PIL.Image|None, msg) theo thứ tự HOÀN THÀNH để UI hiển thị ngay khi có ảnh.
+    Prompt + seed trùng nhau chỉ sinh 1 lần (kho ảnh + khoá theo key).
+    """
+    if not prompts:
+        return
+    _get_client(timeout_sec)  # khởi tạo client trước khi fan-out
+    workers = max(1, min(int(max_workers or 1), len(prompts)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futs = {
+            pool.submit(contextvars.copy_context().run, gemini25_image_generate, p, model_name, size_hint, timeout_sec,
+                        seeds[i] if seeds else None, use_cache): i
+            for i, p in enumerate(prompts)
+        }
+        for fut in as_completed(futs):
+            i = futs[fut]
+            try:
+                img, msg = fut.result()
+            except Exception as e:
+                img, msg = None, f"Gemini 2.5 image error: {e}"
+            yield i, img, msg
+
+
 def gemini25_images_generate_batch(
     prompts: List[str],
     model_name: str = "gemini-2.5-flash-image",
     size_hint: str = "1024x576",
+    max_workers: int = DEFAULT_IMAGE_WORKERS,
+    timeout_sec: Optional[float] = DEFAULT_IMAGE_TIMEOUT_SEC,
+    seeds: Optional[List[Optional[int]]] = None,
+    use_cache: bool = True,
 ) -> List[Tuple[Optional[Image.Image], str]]:
-    """Sinh nhiều ảnh theo danh sách prompt; trả về list (PIL.Image|None, msg)."""
-    out = []
-    for p in prompts:
-        img, msg = gemini25_image_generate(p, model_name=model_name, size_hint=size_hint)
-        out.append((img, msg))
+    """Sinh nhiều ảnh theo danh sách prompt; trả về list (PIL.Image|None, msg) đúng thứ tự prompt."""
+    out: List[Tuple[Optional[Image.Image], str]] = [(None, "not run")] * len(prompts)
+    for i, img, msg in gemini25_images_generate_iter(
+        prompts, model_name=model_name, size_hint=size_hint,
+        max_workers=max_workers, timeout_sec=timeout_sec,
+        seeds=seeds, use_cache=use_cache,
+    ):
+        out[i] = (img, msg)
     return out
@@ -23,7 +23,75 @@ def make_seed_for_scene(scene_name: str, ep_title: str) -> int:
     """Seed mặc định theo cảnh (fallback nếu không có char/location)."""
     return _hash_to_int(f"SCN::{ep_title}::{scene_name}")
 
+_LOCATION_KEYS = ["Tông", "Trường", "Điện", "Thành", "Sơn", "Cốc", "Phủ"]
+
+def guess_location(scene_name: str) -> Optional[str]:
+    """Heuristic: tên cảnh chứa từ chỉ địa điểm → coi cả tên cảnh là địa điểm."""
+    for key in _LOCATION_KEYS:
+        if key in (scene_name or ""):
+            return scene_name
+    return None
+
+def pick_seed(characters: List[str], location: Optional[str], scene_name: str, ep_title: str) -> int:
+    """Chọn seed: ưu tiên nhân vật → địa điểm → cảnh (cùng đầu vào → cùng seed, phục vụ kho ảnh)."""
+    if characters:
+        # nếu có nhiều nhân vật, mix seeds bằng hash
+        return sum(make_seed_for_character(n) for n in characters) % (2**31 - 1)
+    if location:
+        return make_seed_for_location(location)
+    return make_seed_for_scene(scene_name, ep_title)
+
 # ====== 2) Lock style & compose prompt ======
+# Prompt compiler: phần dùng chung cho cả Mùa (tra nhân vật từ Bible, khối Style/Shot/Negative, ref images)
+# dựng 1 lần → mỗi frame/job chỉ còn ghép chuỗi. Định dạng prompt giữ nguyên như bản dựng từng lần.
+
+_STYLE_DONGHUA = (
+    "cel-shaded, clean lineart, Chinese donghua stylization, Asian facial features, "
+    "natural black/dark hair unless specified, soft skin rendering, rich fabric texture, "
+    "avoid photorealism, avoid western/European facial structure"
+)
+_STYLE_CINEMATIC = "cinematic stylized look, avoid hyper-realistic faces"
+_NEGATIVE = "low quality, blurry, extra fingers, deformed hands, photorealistic, western/European facial structure"
+
+def compile_prompt_context(
+    character_bible: Optional[Dict[str, Any]],
+    aspect_ratio: str,
+    donghua_style: bool,
+) -> Dict[str, Any]:
+    """
+    Dựng 1 lần cho cả Mùa:
+      {"chars": {tên: mô tả}, "refs": {tên: [ảnh tham chiếu]}, "tail": "Style … Negative …", "aspect_ratio": "16:9"}
+    """
+    chars: Dict[str, str] = {}
+    refs: Dict[str, List[str]] = {}
+    for c in (character_bible or {}).get("characters") or []:
+        nm = c.get("name")
+        if not nm:
+            continue
+        chars[nm] = f"{nm}: {c.get('look','')}; hair {c.get('hair','')}; outfit {c.get('outfit','')}; colors {c.get('color_theme','')}"
+        if c.get("ref_images"):  # danh sách đường dẫn ảnh local/URL
+            refs[nm] = c["ref_images"]
+    ar = aspect_ratio or "16:9"
+    style = _STYLE_DONGHUA if donghua_style else _STYLE_CINEMATIC
+    return {
+        "chars": chars,
+        "refs": refs,
+        "aspect_ratio": ar,
+        "tail": (
+            f"Style: {style}. "
+            f"Shot: keyframe still for video sync; aspect ratio {ar}; 24fps context. "
+            f"Negative: {_NEGATIVE}."
+        ),
+    }
+
+def render_prompt(ctx: Dict[str, Any], base: str, characters: List[str], location_name: Optional[str] = None) -> str:
+    """base + mô tả nhân vật (tra sẵn) + địa điểm + khối style/negative của ctx."""
+    lut = ctx["chars"]
+    char_block = " | ".join(lut[n] for n in characters or [] if n in lut).strip()
+    if char_block:
+        char_block = f"Characters: {char_block}. "
+    loc_block = f"Location: {location_name}. " if location_name else ""
+    return f"{char_block}{loc_block}{(base or '').strip()}. {ctx['tail']}"
 
 def compose_consistent_image_prompt(
     base: str,
@@ -33,47 +101,17 @@ def compose_consistent_image_prompt(
     character_bible: Optional[Dict[str, Any]] = None,
     location_name: Optional[str] = None
 ) -> str:
-    """Hợp nhất prompt: base + mô tả nhân vật từ Bible + style + negative."""
-    base = (base or "").strip()
-
-    # rút miêu tả nhân vật ngắn gọn từ bible
-    char_descs = []
-    if character_bible and character_bible.get("characters"):
-        lut = {c.get("name"): c for c in character_bible["characters"] if c.get("name")}
-        for n in characters or []:
-            c = lut.get(n)
-            if not c: 
-                continue
-            char_descs.append(
-                f"{c.get('name')}: {c.get('look','')}; hair {c.get('hair','')}; outfit {c.get('outfit','')}; colors {c.get('color_theme','')}"
-            )
-
-    style = (
-        "cel-shaded, clean lineart, Chinese donghua stylization, Asian facial features, "
-        "natural black/dark hair unless specified, soft skin rendering, rich fabric texture, "
-        "avoid photorealism, avoid western/European facial structure"
-        if donghua_style else
-        "cinematic stylized look, avoid hyper-realistic faces"
-    )
-    neg = "low quality, blurry, extra fingers, deformed hands, photorealistic, western/European facial structure"
-
-    char_block = (" | ".join(char_descs)).strip()
-    if char_block:
-        char_block = f"Characters: {char_block}. "
-    loc_block = f"Location: {location_name}. " if location_name else ""
-
-    return (
-        f"{char_block}{loc_block}{base}. "
-        f"Style: {style}. "
-        f"Shot: keyframe still for video sync; aspect ratio {aspect_ratio or '16:9'}; 24fps context. "
-        f"Negative: {neg}."
-    )
+    """Hợp nhất prompt: base + mô tả nhân vật từ Bible + style + negative (gọi lẻ; hàng loạt dùng compile_prompt_context)."""
+    ctx = compile_prompt_context(character_bible, aspect_ratio, donghua_style)
+    return render_prompt(ctx, base, characters, location_name)
 
 # ====== 3) Build jobs ======
 
-def build_image_jobs_for_episode(project: Any, episode: Any) -> List[Dict[str, Any]]:
+def build_image_jobs_for_episode(project: Any, episode: Any,
+                                 ctx: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Từ ep.assets['scenes'] → sinh danh sách 'image jobs' với prompt + seed + ref_images (nếu có).
+    ctx: kết quả compile_prompt_context (truyền vào khi dựng nhiều tập để không dựng lại).
     Trả về list job dict:
       {
         "index": 1,
@@ -86,153 +124,119 @@ def build_image_jobs_for_episode(project: Any, episode: Any) -> List[Dict[str, A
         "char_ref_images": {"Diệp Minh": ["path/to/ref1.png", "path/to/ref2.jpg"]}  # optional
       }
     """
+    if ctx is None:
+        ctx = compile_prompt_context(project.character_bible, project.aspect_ratio, project.donghua_style)
+    char_refs = ctx["refs"]
     scenes = (episode.assets or {}).get("scenes", []) or []
     jobs = []
 
-    # optional: lấy ref images từ Character Bible (bạn có thể thêm field 'ref_images' trong bible)
-    char_refs = {}
-    if project.character_bible and project.character_bible.get("characters"):
-        for c in project.character_bible["characters"]:
-            nm = c.get("name")
-            if not nm:
-                continue
-            refs = c.get("ref_images") or []  # danh sách đường dẫn ảnh local/URL
-            if refs:
-                char_refs[nm] = refs
-
     for i, sc in enumerate(scenes, 1):
         name = sc.get("scene", f"Cảnh {i}")
         base = sc.get("image_prompt") or sc.get("sfx_prompt") or episode.summary
         chars = sc.get("characters", []) or []
 
         # heuristic: đoán 'địa điểm' từ tên cảnh
-        location = None
-        for key in ["Tông", "Trường", "Điện", "Thành", "Sơn", "Cốc", "Phủ"]:
-            if key in name:
-                location = name
-                break
-
-        prompt = compose_consistent_image_prompt(
-            base=base,
-            aspect_ratio=project.aspect_ratio,
-            donghua_style=project.donghua_style,
-            characters=chars,
-            character_bible=project.character_bible,
-            location_name=location
-        )
-
-        # Chọn seed: ưu tiên nhân vật → địa điểm → cảnh
-        seed = None
-        if chars:
-            # nếu có nhiều nhân vật, mix seeds bằng hash
-            mix = sum(make_seed_for_character(n) for n in chars)
-            seed = mix % (2**31 - 1)
-        elif location:
-            seed = make_seed_for_location(location)
-        else:
-            seed = make_seed_for_scene(name, episode.title)
-
-        job = {
+        location = guess_location(name)
+        seed = pick_seed(chars, location, name, episode.title)
+
+        jobs.append({
             "index": i,
             "scene": name,
-            "prompt": prompt,
+            "prompt": render_prompt(ctx, base, chars, location),
             "seed": int(seed),
-            "aspect_ratio": project.aspect_ratio or "16:9",
+            "aspect_ratio": ctx["aspect_ratio"],
             "characters": chars,
             "location": location,
-            "char_ref_images": {n: char_refs.get(n, []) for n in chars if n in char_refs}
-        }
-        jobs.append(job)
+            "char_ref_images": {n: char_refs[n] for n in chars if n in char_refs}
+        })
     return jobs
 
+def build_image_jobs_for_season(project: Any, season: Any,
+                                episodes: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Dựng image jobs cho cả Mùa trong 1 lần gọi (Bible/style compile 1 lần).
+    Trả về [{"season": 1, "episode": 3, "title": "...", "jobs": [...]}] theo thứ tự tập.
+    """
+    ctx = compile_prompt_context(project.character_bible, project.aspect_ratio, project.donghua_style)
+    return [
+        {"season": season.season_index, "episode": ep.index, "title": ep.title,
+         "jobs": build_image_jobs_for_episode(project, ep, ctx)}
+        for ep in (season.episodes if episodes is None else episodes)
+    ]
+
 # ====== 4) Export / Save ======
 
 def jobs_to_json(jobs: List[Dict[str, Any]]) -> str:
     return json.dumps({"image_jobs": jobs, "created_at": int(time.time())}, ensure_ascii=False, indent=2)
 
+def season_jobs_to_json(batches: List[Dict[str, Any]]) -> str:
+    """Kết quả build_image_jobs_for_season → JSON (mỗi tập 1 mục, thứ tự tập giữ nguyên)."""
+    return json.dumps({"episodes": batches, "created_at": int(time.time())}, ensure_ascii=False, indent=2)
+
 def save_jobs_json(path: str, jobs: List[Dict[str, Any]]) -> None:
     with open(path, "w", encoding="utf-8") as f:
         f.write(jobs_to_json(jobs))
 
 # ====== 5) (Tuỳ chọn) Gửi sang ComfyUI cục bộ ======
 # Yêu cầu: ComfyUI đang chạy ở http://127.0.0.1:8188
-# Bạn có thể chuẩn bị 1 workflow JSON có nút IP-Adapter, ControlNet pose/depth tuỳ nhu cầu
-# Ở đây mình gửi prompt + seed theo 1 workflow tối giản (text-to-image).
-
-import requests
-
-def send_job_to_comfyui(server_url: str, prompt: str, seed: int, width: int, height: int) -> str:
+# Workflow lấy từ registry core/workflows/*.json (SDXL, FLUX, IP-Adapter, ControlNet) — chỉ patch seed/prompt/size/ảnh.
+# Gửi + chờ kết quả + tải ảnh về nhiều job cùng lúc: core.comfyui_client.run_jobs
+
+from core.comfyui_client import submit_prompt, upload_ref_images
+from core.comfyui_workflows import DEFAULT_WORKFLOW, build_workflow
+
+def ar_to_wh(ar: str):
+    """Map aspect ratio → kích thước latent."""
+    ar = (ar or "16:9").strip()
+    if ar in ("16:9", "1.78"):
+        return (1280, 720)
+    if ar in ("9:16",):
+        return (720, 1280)
+    if ar in ("1:1",):
+        return (1024, 1024)
+    return (1024, 576)
+
+def job_ref_images(job: Dict[str, Any]) -> List[str]:
+    """Ảnh tham chiếu của job theo thứ tự nhân vật (bỏ trùng) — dùng cho node LoadImage của IP-Adapter."""
+    out: List[str] = []
+    for n in job.get("characters") or []:
+        out.extend((job.get("char_ref_images") or {}).get(n) or [])
+    return list(dict.fromkeys(out))
+
+def job_to_workflow(job: Dict[str, Any], workflow_name: str = DEFAULT_WORKFLOW) -> Dict[str, Any]:
     """
-    Gửi 1 job đơn giản lên ComfyUI: trả về prompt_id để theo dõi.
-    Bạn có thể thay 'workflow' tuỳ preset của bạn (SDXL/FLUX).
+    Image job (build_image_jobs_for_episode) → workflow ComfyUI từ registry (core/workflows/*.json).
+    Template cần ảnh tham chiếu/control mà job không có → tự dùng template fallback (VD: ipadapter → sdxl).
     """
-    # Workflow siêu gọn (txt2img) — bạn thay bằng workflow của bạn để dùng IP-Adapter/ControlNet
-    workflow = {
-        "3": {  # KSampler
-            "inputs": {
-                "seed": seed,
-                "steps": 30,
-                "cfg": 6.5,
-                "sampler_name": "euler",
-                "scheduler": "normal",
-                "denoise": 1.0,
-                "model": ["4", 0],
-                "positive": ["5", 0],
-                "negative": ["6", 0],
-                "latent_image": ["7", 0]
-            },
-            "class_type": "KSampler",
-            "_meta": {"title": "KSampler"}
-        },
-        "4": {  # CheckpointLoader (bạn đổi sang model SDXL/Flux đã cài)
-            "inputs": {"ckpt_name": "sdxl_base_1.0.safetensors"},
-            "class_type": "CheckpointLoaderSimple",
-            "_meta": {"title": "CheckpointLoaderSimple"}
-        },
-        "5": {  # CLIPTextEncode (prompt)
-            "inputs": {"text": prompt, "clip": ["4", 1]},
-            "class_type": "CLIPTextEncode",
-            "_meta": {"title": "CLIPTextEncode"}
-        },
-        "6": {  # Negative
-            "inputs": {"text": "blurry, low quality, deformed hands", "clip": ["4", 1]},
-            "class_type": "CLIPTextEncode",
-            "_meta": {"title": "CLIPTextEncode (Negative)"}
-        },
-        "7": {  # Empty Latent Image
-            "inputs": {"width": width, "height": height, "batch_size": 1},
-            "class_type": "EmptyLatentImage",
-            "_meta": {"title": "EmptyLatentImage"}
-        },
-        "8": {  # VAE Decode
-            "inputs": {"samples": ["3", 0], "vae": ["4", 2]},
-            "class_type": "VAEDecode",
-            "_meta": {"title": "VAEDecode"}
-        },
-        "9": {  # Save Image
-            "inputs": {"images": ["8", 0]},
-            "class_type": "SaveImage",
-            "_meta": {"title": "SaveImage"}
-        }
+    w, h = ar_to_wh(job.get("aspect_ratio"))
+    values = {
+        "seed": int(job["seed"]),
+        "prompt": job["prompt"],
+        "width": w,
+        "height": h,
+        "ref_images": job_ref_images(job),
+        "control_image": job.get("control_image"),
     }
-    resp = requests.post(f"{server_url.rstrip('/')}/prompt", json={"prompt": workflow})
-    resp.raise_for_status()
-    return resp.json().get("prompt_id", "")
+    return build_workflow(workflow_name, values)
+
+def send_job_to_comfyui(server_url: str, prompt: str, seed: int, width: int, height: int,
+                        workflow_name: str = DEFAULT_WORKFLOW, ref_images: Optional[List[str]] = None) -> str:
+    """
+    Gửi 1 job lên ComfyUI: trả về prompt_id để theo dõi.
+    workflow_name: template trong core/workflows (sdxl / flux / ipadapter / controlnet …).
+    """
+    refs = upload_ref_images(server_url, ref_images or [])
+    values = {"seed": int(seed), "prompt": prompt, "width": width, "height": height, "ref_images": refs}
+    return submit_prompt(server_url, build_workflow(workflow_name, values))
 
-def batch_send_jobs_to_comfyui(server_url: str, jobs: List[Dict[str, Any]]) -> List[str]:
+def batch_send_jobs_to_comfyui(server_url: str, jobs: List[Dict[str, Any]],
+                               workflow_name: str = DEFAULT_WORKFLOW) -> List[str]:
+    """Chỉ gửi (không chờ kết quả); dùng chung session có pool kết nối."""
     ids = []
-    # map AR → kích thước
-    def ar_to_wh(ar: str):
-        ar = (ar or "16:9").strip()
-        if ar in ("16:9", "1.78"):
-            return (1280, 720)
-        if ar in ("9:16",):
-            return (720, 1280)
-        if ar in ("1:1",):
-            return (1024, 1024)
-        return (1024, 576)
+    uploaded: Dict[str, str] = {}
     for job in jobs:
-        w, h = ar_to_wh(job.get("aspect_ratio"))
-        pid = send_job_to_comfyui(server_url, job["prompt"], job["seed"], w, h)
-        ids.append(pid)
+        job = {**job, "char_ref_images": {
+            n: upload_ref_images(server_url, refs, uploaded) for n, refs in (job.get("char_ref_images") or {}).items()
+        }}
+        ids.append(submit_prompt(server_url, job_to_workflow(job, workflow_name)))
     return ids
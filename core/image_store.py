@@ -0,0 +1,56 @@
+# core/image_store.py
+# -*- coding: utf-8 -*-
+"""
+Kho ảnh content-addressed: key = (model, prompt đã compose, seed, kích thước).
+- Cùng prompt + seed (cảnh lặp lại giữa các frame/tập, establishing shot…) → trả ảnh đã sinh ngay, không gọi model.
+- Lưu bytes gốc model trả về trong .cache/images; giới hạn dung lượng, dọn theo LRU (core.disk_cache).
+- generation_lock(key): các luồng cùng xin 1 key chỉ sinh 1 lần, luồng sau đợi rồi đọc kho.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from core.disk_cache import make_key, cache_get, cache_put, cache_path
+
+STORE_NS = "images"
+STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", "2048")) * 1024 * 1024
+
+_KEY_LOCKS: Dict[str, list] = {}   # key → [Lock, số luồng đang giữ/chờ]
+_KEY_LOCKS_GUARD = threading.Lock()
+
+
+def image_key(model_name: str, prompt: str, seed: Optional[int], size: str) -> str:
+    return make_key("img-v1", model_name or "", (prompt or "").strip(), seed, size or "")
+
+
+def store_get(key: str) -> Optional[bytes]:
+    """Bytes ảnh đã lưu (chạm atime cho LRU; mtime giữ lúc ghi) hoặc None."""
+    return cache_get(STORE_NS, key)
+
+
+def store_put(key: str, data: bytes) -> Path:
+    return cache_put(STORE_NS, key, data, max_bytes=STORE_MAX_BYTES)
+
+
+def store_path(key: str) -> Optional[Path]:
+    """Đường dẫn file trong kho nếu đã có."""
+    f = cache_path(STORE_NS, key)
+    return f if f.exists() else None
+
+
+@contextmanager
+def generation_lock(key: str) -> Iterator[None]:
+    """Khoá theo key (chỉ trong process) để không sinh trùng 1 ảnh khi chạy song song."""
+    with _KEY_LOCKS_GUARD:
+        entry = _KEY_LOCKS.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _KEY_LOCKS_GUARD:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _KEY_LOCKS.pop(key, None)
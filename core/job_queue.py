@@ -0,0 +1,439 @@
+# core/job_queue.py
+# -*- coding: utf-8 -*-
+"""
+Hàng đợi job cục bộ (SQLite) cho các bước sinh nội dung chạy lâu, tách khỏi vòng rerun của Streamlit.
+- Job key idempotent: "{project}::s{season}::e{episode}::{stage}"
+  (season/episode là chỉ số 0-based trong proj.seasons / season.episodes, giống sidx/ep_idx ở UI).
+- Worker là process riêng:  python -m core.job_queue --workers 2 --model gemini-2.5-pro
+- UI chỉ enqueue / xem tiến độ / huỷ; worker tự load project từ đĩa, chạy bước, lưu lại.
+- Lease: worker đang chạy job ghi heartbeat_at (mỗi HEARTBEAT_SEC + mỗi lần báo tiến độ). Job running có
+  heartbeat cũ hơn LEASE_SEC (hoặc process worker cùng máy đã chết) được đưa lại hàng đợi ở lần claim/enqueue
+  kế tiếp; quá MAX_ATTEMPTS lần → failed.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from core.project_io import DATA_DIR, load_project, save_project
+from core.text_utils import _safe_name
+
+DB_PATH = DATA_DIR / "_jobs.sqlite3"
+POLL_SEC = 2.0
+HEARTBEAT_SEC = 30.0
+LEASE_SEC = 120.0
+MAX_ATTEMPTS = 3
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT UNIQUE NOT NULL,
+    project TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    episode INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL DEFAULT '{}',
+    worker TEXT NOT NULL DEFAULT '',
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    heartbeat_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_project ON jobs(project, id);
+"""
+
+
+class JobCancelled(Exception):
+    """Job bị huỷ trong lúc chạy (worker dừng ở điểm báo tiến độ kế tiếp)."""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(DB_PATH), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+    for col in ("attempts INTEGER NOT NULL DEFAULT 0", "heartbeat_at REAL NOT NULL DEFAULT 0"):
+        if col.split()[0] not in cols:  # DB tạo từ bản cũ
+            try:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {col}")
+            except sqlite3.OperationalError:
+                pass  # process khác vừa thêm
+    return conn
+
+
+def _worker_dead(worker: str, heartbeat_at: float, now: float) -> bool:
+    """Worker mất heartbeat quá LEASE_SEC, hoặc là process cùng máy không còn tồn tại."""
+    if now - float(heartbeat_at or 0) > LEASE_SEC:
+        return True
+    host, _, pid = (worker or "").rpartition(":")
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass  # không có quyền → coi như còn sống
+    return False
+
+
+def _reap_stale(conn: sqlite3.Connection, now: float) -> None:
+    """Job running của worker đã chết → queued (hoặc cancelled/failed); gọi trong transaction."""
+    rows = conn.execute(
+        "SELECT id, worker, heartbeat_at, attempts, cancel_requested FROM jobs WHERE status=?", (STATUS_RUNNING,)
+    ).fetchall()
+    for r in rows:
+        if not _worker_dead(r["worker"], r["heartbeat_at"], now):
+            continue
+        if r["cancel_requested"]:
+            status, msg = STATUS_CANCELLED, "Đã huỷ (worker đã dừng)."
+        elif r["attempts"] >= MAX_ATTEMPTS:
+            status, msg = STATUS_FAILED, f"Worker {r['worker']} dừng giữa chừng {r['attempts']} lần."
+        else:
+            status, msg = STATUS_QUEUED, f"Worker {r['worker']} mất kết nối — chạy lại."
+        conn.execute(
+            "UPDATE jobs SET status=?, message=?, worker='', updated_at=? WHERE id=? AND status=?",
+            (status, msg, now, r["id"], STATUS_RUNNING),
+        )
+
+
+def make_job_key(project: str, season: int, episode: int, stage: str) -> str:
+    return f"{project}::s{int(season)}::e{int(episode)}::{stage}"
+
+
+def enqueue(project: str, season: int, episode: int, stage: str,
+            params: Optional[Dict[str, Any]] = None, force: bool = False) -> int:
+    """
+    Thêm job (idempotent theo job key).
+    - Job cùng key đang queued/running → trả về id cũ.
+    - Job cùng key đã done → giữ nguyên, trừ khi force=True.
+    - Job failed/cancelled → đưa lại vào hàng đợi.
+    """
+    key = make_job_key(project, season, episode, stage)
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _reap_stale(conn, now)
+        row = conn.execute("SELECT id, status FROM jobs WHERE job_key=?", (key,)).fetchone()
+        if row is None:
+            cur = conn.execute(
+                "INSERT INTO jobs(job_key, project, season, episode, stage, status, params, created_at, updated_at) "
+                "VALUES (?,?,?,?,?,?,?,?,?)",
+                (key, project, int(season), int(episode), stage, STATUS_QUEUED,
+                 json.dumps(params or {}, ensure_ascii=False), now, now),
+            )
+            job_id = cur.lastrowid
+        else:
+            job_id = row["id"]
+            if row["status"] not in ACTIVE_STATUSES and (force or row["status"] != STATUS_DONE):
+                conn.execute(
+                    "UPDATE jobs SET status=?, progress=0, message='', params=?, worker='', "
+                    "cancel_requested=0, attempts=0, updated_at=? WHERE id=?",
+                    (STATUS_QUEUED, json.dumps(params or {}, ensure_ascii=False), now, job_id),
+                )
+        conn.execute("COMMIT")
+        return int(job_id)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def claim_next(worker: str) -> Optional[Dict[str, Any]]:
+    """
+    Lấy job queued cũ nhất và đánh dấu running (atomic giữa các worker).
+    Mỗi project chỉ chạy 1 job tại một thời điểm để các worker không ghi đè file project của nhau.
+    Job running của worker đã chết được đưa lại hàng đợi trước (xem _reap_stale).
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _reap_stale(conn, now)
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status=? AND project NOT IN "
+            "(SELECT project FROM jobs WHERE status=?) ORDER BY id LIMIT 1",
+            (STATUS_QUEUED, STATUS_RUNNING),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status=?, worker=?, attempts=attempts+1, heartbeat_at=?, updated_at=? WHERE id=?",
+            (STATUS_RUNNING, worker, now, now, row["id"]),
+        )
+        conn.execute("COMMIT")
+        job = dict(row)
+        job["status"] = STATUS_RUNNING
+        job["worker"] = worker
+        job["params"] = json.loads(job.get("params") or "{}")
+        return job
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def report_progress(job_id: int, progress: float, message: str = "", worker: Optional[str] = None) -> None:
+    """
+    Cập nhật tiến độ + heartbeat; ném JobCancelled nếu UI đã yêu cầu huỷ
+    hoặc job đã bị đưa lại hàng đợi cho worker khác (worker này mất lease).
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET progress=?, message=?, heartbeat_at=?, updated_at=? WHERE id=? AND status=?"
+            + (" AND worker=?" if worker else ""),
+            (float(progress), message, now, now, job_id, STATUS_RUNNING) + ((worker,) if worker else ()),
+        )
+        row = conn.execute("SELECT status, worker, cancel_requested FROM jobs WHERE id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row and row["cancel_requested"]:
+        raise JobCancelled(f"job {job_id} cancelled")
+    if row and worker and (row["status"] != STATUS_RUNNING or row["worker"] != worker):
+        raise JobCancelled(f"job {job_id}: mất lease")
+
+
+def heartbeat(job_id: int) -> None:
+    """Gia hạn lease của job đang chạy (không đổi tiến độ)."""
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET heartbeat_at=? WHERE id=? AND status=?", (time.time(), job_id, STATUS_RUNNING))
+    finally:
+        conn.close()
+
+
+def finish(job_id: int, status: str, message: str = "", worker: Optional[str] = None) -> None:
+    """Kết thúc job; worker (nếu truyền) phải còn giữ job — job đã bị giao lại thì bỏ qua."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status=?, message=?, progress=CASE WHEN ?='done' THEN 1 ELSE progress END, "
+            "updated_at=? WHERE id=?" + (" AND worker=?" if worker else ""),
+            (status, message, status, time.time(), job_id) + ((worker,) if worker else ()),
+        )
+    finally:
+        conn.close()
+
+
+def cancel(job_id: int) -> None:
+    """Huỷ job: queued (hoặc running mà worker đã chết) → cancelled ngay; running → gắn cờ để worker dừng."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE jobs SET status=?, updated_at=? WHERE id=? AND status=?",
+            (STATUS_CANCELLED, now, job_id, STATUS_QUEUED),
+        )
+        conn.execute(
+            "UPDATE jobs SET cancel_requested=1, updated_at=? WHERE id=? AND status=?",
+            (now, job_id, STATUS_RUNNING),
+        )
+        _reap_stale(conn, now)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def list_jobs(project: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    conn = _connect()
+    try:
+        if project:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE project=? ORDER BY id DESC LIMIT ?", (project, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+# ===================== Worker =====================
+
+def _stage_episode(model, proj, job, report) -> str:
+    from core.episode_pipeline import run_episode_stage
+    report(0.1, "Đang sinh FULL/ASSETS/TTS…")
+    ok = run_episode_stage(model, proj, job["season"], job["episode"], use_cache=job["params"].get("use_cache", True))
+    if not ok:
+        raise RuntimeError("AI trả về dữ liệu không đúng định dạng JSON.")
+    return "Đã sinh kịch bản tập."
+
+
+def _stage_veo(model, proj, job, report) -> str:
+    from core.episode_pipeline import run_veo_stage
+    n_err = run_veo_stage(
+        model, proj, job["season"], job["episode"],
+        max_workers=int(job["params"].get("max_workers", 4)),
+        use_cache=job["params"].get("use_cache", True),
+        progress=report,
+    )
+    return f"Đã sinh Veo 3.1 ({n_err} cảnh lỗi)." if n_err else "Đã sinh Veo 3.1."
+
+
+def _stage_character_bible(model, proj, job, report) -> str:
+    from core.episode_pipeline import run_character_bible_stage
+    report(0.1, "Đang tạo Character Bible…")
+    ok = run_character_bible_stage(model, proj, job["season"], use_cache=job["params"].get("use_cache", True))
+    return "Đã tạo Character Bible." if ok else "Model không trả về nhân vật nào."
+
+
+def _stage_images(model, proj, job, report) -> str:
+    from core.episode_pipeline import run_image_stage
+    p = job["params"]
+    n_err = run_image_stage(
+        proj, job["season"], job["episode"],
+        model_name=p.get("image_model") or "gemini-2.5-flash-image",
+        size_hint=p.get("image_size") or "1024x576",
+        max_workers=int(p.get("max_workers", 4)),
+        timeout_sec=p.get("timeout_sec"),
+        use_cache=p.get("use_cache", True),
+        progress=report,
+    )
+    return f"Đã sinh ảnh keyframe ({n_err} ảnh lỗi)." if n_err else "Đã sinh ảnh keyframe."
+
+
+def _stage_tts(model, proj, job, report) -> str:
+    from core.episode_pipeline import run_tts_stage
+    p = job["params"]
+    res = run_tts_stage(
+        proj, job["season"], job["episode"],
+        backend=p.get("tts_backend") or "gtts",
+        max_workers=int(p.get("max_workers", 4)),
+        use_cache=p.get("use_tts_cache", True),
+        progress=report,
+    )
+    if res["errors"]:
+        raise RuntimeError(f"TTS lỗi {len(res['errors'])} chunk: {res['errors'][0][1]}")
+    return f"Đã render TTS ({res['chunks']} chunk, {res['cached']} từ cache)."
+
+
+# stage → handler(model, project, job, report) -> message
+STAGE_HANDLERS: Dict[str, Callable[..., str]] = {
+    "episode": _stage_episode,
+    "veo": _stage_veo,
+    "character_bible": _stage_character_bible,
+    "images": _stage_images,
+    "tts": _stage_tts,
+}
+
+
+def _init_model(model_name: str):
+    from core.env_loader import load_env
+    api_key = load_env()
+    if not api_key:
+        raise RuntimeError("Chưa có GEMINI_API_KEY cho worker.")
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+def run_job(job: Dict[str, Any], model) -> None:
+    """Chạy 1 job đã claim: load project mới nhất từ đĩa → chạy stage → lưu."""
+    job_id = job["id"]
+    worker = job.get("worker") or None
+
+    def report(progress: float, message: str = "") -> None:
+        report_progress(job_id, progress, message, worker)
+
+    handler = STAGE_HANDLERS.get(job["stage"])
+    if handler is None:
+        finish(job_id, STATUS_FAILED, f"Stage không hỗ trợ: {job['stage']}", worker)
+        return
+
+    # giữ lease cả khi stage đang chờ 1 lệnh gọi dài (không có report giữa chừng)
+    stop = threading.Event()
+
+    def _beat() -> None:
+        while not stop.wait(HEARTBEAT_SEC):
+            try:
+                heartbeat(job_id)
+            except sqlite3.Error:
+                pass
+
+    threading.Thread(target=_beat, name=f"job-{job_id}-heartbeat", daemon=True).start()
+    try:
+        proj = load_project(DATA_DIR / f"{_safe_name(job['project'])}.json")
+        msg = handler(model, proj, job, report)
+        report(1.0, msg)
+        save_project(proj)
+        finish(job_id, STATUS_DONE, msg, worker)
+    except JobCancelled:
+        finish(job_id, STATUS_CANCELLED, "Đã huỷ.", worker)
+    except Exception as e:
+        finish(job_id, STATUS_FAILED, f"{e}\n{traceback.format_exc(limit=3)}", worker)
+    finally:
+        stop.set()
+
+
+def run_worker(model_name: str, poll_sec: float = POLL_SEC, once: bool = False) -> None:
+    """Vòng lặp worker: claim job → chạy → lặp lại. once=True: dừng khi hàng đợi rỗng."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    models: Dict[str, Any] = {}  # tên model → GenerativeModel (mỗi job chạy đúng model nó chỉ định)
+    while True:
+        job = claim_next(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_sec)
+            continue
+        name = job["params"].get("model_name") or model_name
+        if name not in models:
+            try:
+                models[name] = _init_model(name)
+            except Exception as e:
+                finish(job["id"], STATUS_FAILED, str(e), worker)
+                continue
+        run_job(job, models[name])
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Worker hàng đợi Gemini Story Studio")
+    ap.add_argument("--workers", type=int, default=1, help="Số process worker")
+    ap.add_argument("--model", default="gemini-2.5-pro", help="Model mặc định nếu job không chỉ định")
+    ap.add_argument("--poll", type=float, default=POLL_SEC, help="Chu kỳ kiểm tra hàng đợi (giây)")
+    ap.add_argument("--once", action="store_true", help="Thoát khi hàng đợi rỗng")
+    args = ap.parse_args(argv)
+
+    if args.workers <= 1:
+        run_worker(args.model, args.poll, args.once)
+        return
+    procs = [
+        mp.Process(target=run_worker, args=(args.model, args.poll, args.once), daemon=False)
+        for _ in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# core/json_repair.py
+# -*- coding: utf-8 -*-
+"""
+Sửa JSON "gần đúng" từ phản hồi model trong 1 lượt quét (tuyến tính theo độ dài, không regex tham lam):
+- bỏ lời dẫn / ```json fence trước JSON và mọi thứ sau khi JSON cấp 1 đóng;
+- ký tự điều khiển (xuống dòng, tab…) trong chuỗi → escape;
+- dấu " không escape giữa chuỗi (lời thoại) → escape, nếu sau nó không phải , : } ];
+- dấu phẩy thừa trước } / ], comment // và /* */, True/False/None kiểu Python;
+- phản hồi bị cắt ngang (hết token): đóng chuỗi đang dở, bỏ cặp key/value dở, đóng các ngoặc còn mở.
+Không sửa được → ValueError (caller giữ {"raw": text}); không bao giờ gọi lại model.
+"""
+import json
+from typing import Any, List
+
+_CTRL = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_BAREWORDS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_CLOSE = {"{": "}", "[": "]"}
+
+
+def _start_index(text: str) -> int:
+    fence = text.find("```json")
+    if fence < 0:
+        fence = text.find("```JSON")
+    base = fence + 7 if fence >= 0 else 0
+    cands = [i for i in (text.find("{", base), text.find("[", base)) if i >= 0]
+    if not cands:
+        raise ValueError("Không tìm thấy JSON")
+    return min(cands)
+
+
+def _next_significant(text: str, i: int) -> str:
+    n = len(text)
+    while i < n and text[i] in " \t\r\n":
+        i += 1
+    return text[i] if i < n else ""
+
+
+def _rstrip_comma(out: List[str]) -> None:
+    while out and out[-1] in " \t\r\n":
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def repair_json(text: str) -> Any:
+    """Parse text theo kiểu khoan dung; trả về object/list hoặc ném ValueError."""
+    text = text or ""
+    i = _start_index(text)
+    n = len(text)
+    out: List[str] = []
+    stack: List[str] = []          # "{" / "["
+    expect_key: List[bool] = []    # song song với stack: object đang chờ key?
+    safe = (0, 0)                  # (len(out), len(stack)) tại điểm cắt an toàn gần nhất
+    in_str = False
+    str_is_key = False
+    esc_at = -1                    # vị trí trong out của '\' đang chờ ký tự escape
+    uni_at = -1                    # vị trí '\' của escape \uXXXX gần nhất
+
+    def mark_safe() -> None:
+        nonlocal safe
+        safe = (len(out), len(stack))
+
+    while i < n:
+        c = text[i]
+        if in_str:
+            if esc_at >= 0:
+                out.append(c)
+                if c == "u":
+                    uni_at = esc_at
+                esc_at = -1
+            elif c == "\\":
+                esc_at = len(out)
+                out.append(c)
+            elif c == '"':
+                nxt = _next_significant(text, i + 1)
+                if nxt in ("", ",", "}", "]", ":"):
+                    out.append(c)
+                    in_str = False
+                    if not str_is_key:
+                        mark_safe()
+                else:
+                    out.append('\\"')  # dấu " trong lời thoại
+            elif c in _CTRL:
+                out.append(_CTRL[c])
+            elif c < " ":
+                out.append(f"\\u{ord(c):04x}")
+            else:
+                out.append(c)
+            i += 1
+            continue
+
+        if c == '"':
+            in_str = True
+            str_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+            out.append(c)
+        elif c in "{[":
+            stack.append(c)
+            expect_key.append(c == "{")
+            out.append(c)
+            mark_safe()
+        elif c in "}]":
+            if not stack:
+                break
+            _rstrip_comma(out)
+            out.append(_CLOSE[stack.pop()])
+            expect_key.pop()
+            mark_safe()
+            if not stack:
+                break
+        elif c == ":":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = False
+            out.append(c)
+        elif c == ",":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+            out.append(c)
+        elif c == "/" and i + 1 < n and text[i + 1] in "/*":
+            end = text.find("\n", i) if text[i + 1] == "/" else text.find("*/", i + 2)
+            i = n if end < 0 else (end if text[i + 1] == "/" else end + 2)
+            continue
+        elif c.isalpha() or c in "-+.0123456789":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] in "-+._"):
+                j += 1
+            word = text[i:j]
+            if j == n:
+                break  # primitive bị cắt giữa chừng → bỏ
+            out.append(_BAREWORDS.get(word, word))
+            mark_safe()
+            i = j
+            continue
+        elif c in " \t\r\n":
+            out.append(c)
+        i += 1
+
+    if stack:
+        # bị cắt ngang: giữ phần chuỗi value đang dở, bỏ key/value chưa hoàn tất rồi đóng ngoặc
+        if in_str and not str_is_key:
+            if esc_at >= 0:
+                del out[esc_at:]
+            if uni_at >= 0 and len(out) - uni_at < 6:
+                del out[uni_at:]  # \uXXXX chưa đủ 4 ký tự
+            out.append('"')
+            mark_safe()
+        del out[safe[0]:]
+        del stack[safe[1]:]
+        _rstrip_comma(out)
+        while stack:
+            out.append(_CLOSE[stack.pop()])
+    try:
+        return json.loads("".join(out))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Không sửa được JSON: {e}") from e
@@ -0,0 +1,204 @@
+# core/json_stream.py
+# -*- coding: utf-8 -*-
+"""
+Parser JSON tăng dần cho phản hồi streaming dạng object cấp 1:
+  {"FULL_SCRIPT": "...", "ASSETS": [{...}, {...}], "TTS": "..."}
+- feed(chunk) quét mỗi ký tự đúng 1 lần (tuyến tính theo độ dài phản hồi); các đoạn giữ trong list,
+  chỉ ghép đúng khoảng cần parse (key, phần tử, giá trị) — không nối dồn cả buffer mỗi lần feed.
+- Giá trị chuỗi cấp 1 được giải mã dần (xem được FULL_SCRIPT khi đang sinh).
+- Phần tử object trong mảng cấp 1 được parse ngay khi đóng ngoặc (ASSETS có dần từng scene).
+"""
+import bisect
+import json
+from typing import Any, Dict, List, Optional
+
+
+class StreamingJsonObject:
+    def __init__(self):
+        self._chunks: List[str] = []  # các đoạn đã nhận (không nối dồn → không chép lại cả buffer mỗi lần)
+        self._starts: List[int] = []  # vị trí bắt đầu (tuyệt đối) của từng đoạn
+        self._text: Optional[str] = None  # cache cho thuộc tính text
+        self._pos = 0                 # số ký tự đã quét
+        self._obj_start: Optional[int] = None
+        self._started = False
+        self._depth = 0
+        self._in_str = False
+        self._esc_at: Optional[int] = None   # vị trí '\' đang chờ đủ escape
+        self._esc_need = 0
+        self._esc_first = False              # ký tự kế tiếp là ký tự đầu sau '\' (u → chờ thêm 4)
+        self._key: Optional[str] = None
+        self._expect_key = True
+        self._key_start: Optional[int] = None
+        self._val_start: Optional[int] = None
+        self._str_cut: Optional[int] = None  # vị trí raw đã giải mã tới
+        self._elem_start: Optional[int] = None
+        self.values: Dict[str, Any] = {}     # giá trị cấp 1 đã hoàn tất
+        self._partial: Dict[str, List[str]] = {}  # chuỗi cấp 1 đang sinh dở (các đoạn đã giải mã)
+        self.items: Dict[str, List[Any]] = {}  # phần tử mảng cấp 1 đã hoàn tất
+        self.done = False
+
+    # ---------- public ----------
+
+    @property
+    def text(self) -> str:
+        """Toàn bộ text đã nhận (nối khi cần, không nối ở mỗi feed)."""
+        if self._text is None:
+            self._text = "".join(self._chunks)
+        return self._text
+
+    def feed(self, chunk: str) -> None:
+        if not chunk or self.done:
+            return
+        base = self._pos
+        self._starts.append(base)
+        self._chunks.append(chunk)
+        self._text = None
+        i = base
+        for c in chunk:
+            if not self._started:
+                if c == "{":
+                    self._started = True
+                    self._obj_start = i
+                    self._depth = 1
+                    self._expect_key = True
+                i += 1
+                continue
+
+            if self._in_str:
+                if self._esc_need:
+                    self._esc_need -= 1
+                    if self._esc_first and c == "u":
+                        self._esc_need = 4
+                    self._esc_first = False
+                    if self._esc_need == 0:
+                        self._esc_at = None
+                elif c == "\\":
+                    self._esc_at = i
+                    self._esc_need = 1
+                    self._esc_first = True
+                elif c == '"':
+                    self._in_str = False
+                    self._close_string(i)
+                i += 1
+                continue
+
+            if c == '"':
+                self._in_str = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+                elif self._depth == 1:
+                    self._val_start = i
+                    self._partial[self._key] = []
+                    self._str_cut = i + 1
+            elif c in "{[":
+                if self._depth == 1 and not self._expect_key:
+                    self._val_start = i
+                    if c == "[":
+                        self.items.setdefault(self._key, [])
+                elif self._depth == 2 and c == "{" and self._key in self.items:
+                    self._elem_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._elem_start is not None and c == "}":
+                    self._add_item(self._slice(self._elem_start, i + 1))
+                    self._elem_start = None
+                elif self._depth == 1 and self._val_start is not None:
+                    self._set_value(self._slice(self._val_start, i + 1))
+                elif self._depth == 0:
+                    self._finish_primitive(i)
+                    self.done = True
+                    i += 1
+                    break
+            elif self._depth == 1:
+                if c == ":":
+                    self._expect_key = False
+                elif c == ",":
+                    self._finish_primitive(i)
+                    self._expect_key = True
+                elif not c.isspace() and not self._expect_key and self._val_start is None:
+                    self._val_start = i  # number/true/false/null
+            i += 1
+        self._pos = i
+        self._flush_partial()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Giá trị hoàn tất nếu có, nếu chưa thì phần đang sinh dở (chuỗi) hoặc các phần tử đã xong (mảng)."""
+        if key in self.values:
+            return self.values[key]
+        if key in self._partial:
+            return "".join(self._partial[key])
+        if key in self.items:
+            return list(self.items[key])
+        return default
+
+    def result(self) -> Dict[str, Any]:
+        """Object cuối cùng (parse toàn bộ nếu được, nếu không thì ghép từ các phần đã có)."""
+        if self.done:
+            try:
+                return json.loads(self._slice(self._obj_start, self._pos))
+            except Exception:
+                pass
+        out: Dict[str, Any] = {k: "".join(v) for k, v in self._partial.items()}
+        for k, v in self.items.items():
+            out[k] = list(v)
+        out.update(self.values)
+        return out
+
+    # ---------- internal ----------
+
+    def _slice(self, a: int, b: int) -> str:
+        """text[a:b] chỉ ghép các đoạn chứa khoảng đó (chi phí theo độ dài khoảng, không theo cả buffer)."""
+        k = bisect.bisect_right(self._starts, a) - 1
+        parts = []
+        while k < len(self._chunks) and self._starts[k] < b:
+            s0 = self._starts[k]
+            parts.append(self._chunks[k][max(a - s0, 0):b - s0])
+            k += 1
+        return "".join(parts)
+
+    def _close_string(self, i: int) -> None:
+        if self._depth != 1:
+            return
+        if self._expect_key and self._key_start is not None:
+            try:
+                self._key = json.loads(self._slice(self._key_start, i + 1))
+            except Exception:
+                self._key = self._slice(self._key_start + 1, i)
+            self._key_start = None
+        elif self._val_start is not None:
+            self._set_value(self.text[self._val_start:i + 1])
+
+    def _set_value(self, raw: str) -> None:
+        try:
+            self.values[self._key] = json.loads(raw)
+        except Exception:
+            self.values[self._key] = raw
+        self._partial.pop(self._key, None)
+        self._val_start = None
+        self._str_cut = None
+
+    def _add_item(self, raw: str) -> None:
+        try:
+            self.items[self._key].append(json.loads(raw))
+        except Exception:
+            pass
+
+    def _finish_primitive(self, i: int) -> None:
+        if self._val_start is not None and self._key is not None and self._key not in self.values:
+            self._set_value(self._slice(self._val_start, i).strip())
+
+    def _flush_partial(self) -> None:
+        """Giải mã phần chuỗi cấp 1 mới nhận (bỏ qua escape chưa đủ ký tự)."""
+        if not self._in_str or self._depth != 1 or self._expect_key or self._str_cut is None:
+            return
+        end = self._esc_at if self._esc_at is not None else self._pos
+        if end <= self._str_cut:
+            return
+        raw = self._slice(self._str_cut, end)
+        try:
+            piece = json.loads(f'"{raw}"')
+        except Exception:
+            piece = raw
+        self._partial.setdefault(self._key, []).append(piece)
+        self._str_cut = end
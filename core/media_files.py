@@ -0,0 +1,81 @@
+# core/media_files.py
+# -*- coding: utf-8 -*-
+"""
+File ảnh keyframe của tập, lưu trong thư mục media của project:
+  projects/<tên>_media/season_XX/episode_YY/images/s01_f02.png        (PNG + metadata prompt/seed/model)
+  projects/<tên>_media/season_XX/episode_YY/images/thumbs/s01_f02.webp (thumbnail, tạo 1 lần khi lưu)
+Scene trong ep.assets chỉ giữ đường dẫn (tương đối DATA_DIR):
+  sc["images"] = [{"frame": 2, "path": "...png", "thumb": "...webp", "seed": 123, "model": "...", "size": "1024x576"}]
+"""
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from core.project_io import DATA_DIR
+from core.thumbnails import write_thumbnail
+
+
+def media_rel(path: Path) -> str:
+    return Path(path).resolve().relative_to(DATA_DIR.resolve()).as_posix()
+
+
+def media_abs(rel: str) -> Path:
+    return DATA_DIR / rel
+
+
+def _atomic_save(img: Image.Image, dst: Path, fmt: str, **kw) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    img.save(tmp, fmt, **kw)
+    os.replace(tmp, dst)
+
+
+def save_keyframe_image(out_dir: Path, frame: Dict[str, Any], img: Image.Image,
+                        meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Ghi ảnh của 1 keyframe (PNG kèm metadata) + thumbnail; trả về entry để gắn vào scene.
+    frame: phần tử của _keyframe_index(...)["frames"].
+    """
+    meta = dict(meta or {})
+    stem = f"s{int(frame.get('scene_index', 0)):02d}_f{int(frame.get('frame', 1)):02d}"
+    img_dir = Path(out_dir) / "images"
+    path = img_dir / f"{stem}.png"
+    thumb = img_dir / "thumbs" / f"{stem}.webp"
+
+    info = PngInfo()
+    info.add_itxt("prompt", frame.get("image_prompt", ""))
+    info.add_itxt("scene", frame.get("scene", ""))
+    info.add_text("frame", str(frame.get("frame", "")))
+    if frame.get("seed") is not None:
+        info.add_text("seed", str(frame["seed"]))
+    for k, v in meta.items():
+        info.add_itxt(k, str(v))
+    _atomic_save(img, path, "PNG", pnginfo=info)
+    write_thumbnail(img, thumb)
+
+    entry = {
+        "frame": frame.get("frame"),
+        "frame_name": frame.get("frame_name", ""),
+        "path": media_rel(path),
+        "thumb": media_rel(thumb),
+        "seed": frame.get("seed"),
+    }
+    entry.update({k: v for k, v in meta.items() if k in ("model", "size")})
+    return entry
+
+
+def attach_scene_image(ep: Any, frame: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    """Gắn/ghi đè entry ảnh vào scene tương ứng trong ep.assets (theo scene_index, khớp tên cảnh)."""
+    scenes = (ep.assets or {}).get("scenes", []) or []
+    i = int(frame.get("scene_index", 0)) - 1
+    if not (0 <= i < len(scenes)) or scenes[i].get("scene", f"Cảnh {i + 1}") != frame.get("scene"):
+        i = next((k for k, sc in enumerate(scenes) if sc.get("scene") == frame.get("scene")), -1)
+    if i < 0:
+        return
+    imgs = [e for e in scenes[i].get("images") or [] if e.get("frame") != entry.get("frame")]
+    imgs.append(entry)
+    imgs.sort(key=lambda e: e.get("frame") or 0)
+    scenes[i]["images"] = imgs
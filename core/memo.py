@@ -0,0 +1,87 @@
+# core/memo.py
+# -*- coding: utf-8 -*-
+"""
+Memo trong RAM cho các hàm thuần (pure) chạy lại ở mỗi rerun Streamlit (parse bảng, chuẩn hoá script,
+dựng prompt keyframe, preset…):
+- Key = hash nội dung đầu vào (make_key) → sửa script/scenes/bible là tự ra key mới, bản cũ bị đẩy ra dần.
+- LRU giới hạn số mục mỗi hàm (maxsize) + khoá luồng; tính toán chạy ngoài khoá.
+- copy: hàm sao chép kết quả trả ra khi kết quả là list/dict mà caller có thể sửa (VD: copy_rows).
+"""
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from core.disk_cache import make_key
+
+_REGISTRY: Dict[str, "OrderedDict[str, Any]"] = {}
+_COUNTS: Dict[str, List[int]] = {}  # name → [hits, misses]
+_LOCK = threading.Lock()
+
+
+def copy_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sao chép list dict (kèm list con, VD: characters) — rẻ hơn deepcopy."""
+    return [{k: (list(v) if isinstance(v, list) else v) for k, v in r.items()} for r in rows]
+
+
+def content_memo(
+    maxsize: int = 64,
+    key: Optional[Callable[..., str]] = None,
+    copy: Optional[Callable[[Any], Any]] = None,
+    name: Optional[str] = None,
+) -> Callable:
+    """
+    Decorator LRU theo hash nội dung.
+    key(*args, **kwargs) -> str: mặc định băm toàn bộ tham số (chỉ dùng khi tham số là str/dict/list…).
+    """
+    def deco(fn: Callable) -> Callable:
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        store: "OrderedDict[str, Any]" = OrderedDict()
+        counts = [0, 0]
+        with _LOCK:
+            _REGISTRY[label] = store
+            _COUNTS[label] = counts
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs) if key else make_key(label, *args, kwargs)
+            with _LOCK:
+                found = k in store
+                if found:
+                    store.move_to_end(k)
+                    counts[0] += 1
+                    val = store[k]
+                else:
+                    counts[1] += 1
+            if found:
+                return copy(val) if copy else val
+            val = fn(*args, **kwargs)
+            with _LOCK:
+                store[k] = val
+                while len(store) > maxsize:
+                    store.popitem(last=False)
+            return copy(val) if copy else val
+
+        wrapper.cache_clear = lambda: _clear_one(label)
+        return wrapper
+    return deco
+
+
+def _clear_one(label: str) -> None:
+    with _LOCK:
+        _REGISTRY[label].clear()
+        _COUNTS[label][:] = [0, 0]
+
+
+def clear_all() -> None:
+    with _LOCK:
+        for label in _REGISTRY:
+            _REGISTRY[label].clear()
+            _COUNTS[label][:] = [0, 0]
+
+
+def stats() -> List[Dict[str, Any]]:
+    """[{name, entries, hits, misses}] cho panel debug."""
+    with _LOCK:
+        return [{"name": n, "entries": len(_REGISTRY[n]), "hits": c[0], "misses": c[1]}
+                for n, c in _COUNTS.items()]
@@ -0,0 +1,206 @@
+# core/metrics.py
+# -*- coding: utf-8 -*-
+"""
+Đo token / thời gian / chi phí của từng lệnh gọi model (text, JSON, stream, ảnh), lưu SQLite cục bộ.
+- Mỗi bản ghi: model, loại gọi, token prompt/output/cached (từ response.usage_metadata), latency,
+  số lần retry (governor), cache hit (cache đĩa / kho ảnh), lỗi.
+- Gắn nhãn project / season / episode / stage qua ContextVar:
+      with metrics.tags(project=proj.name, season=1, episode=3, stage="episode"):
+          gemini_json(...)
+  (season/episode là số thứ tự hiển thị, 1-based; core.parallel chuyển nhãn sang các luồng con.)
+- Chi phí ước tính theo bảng giá PRICES_PER_1M (USD / 1 triệu token) — chỉnh khi bảng giá đổi.
+- Tắt ghi bằng biến môi trường GSS_METRICS=0.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from core.project_io import DATA_DIR
+
+DB_PATH = DATA_DIR / "_metrics.sqlite3"
+ENABLED = os.getenv("GSS_METRICS", "1") != "0"
+
+# model (khớp chuỗi con dài nhất) → (input, output, cached input) USD / 1M token
+PRICES_PER_1M: Dict[str, tuple] = {
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.5-flash-image": (0.30, 30.00, 0.075),
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    project TEXT NOT NULL DEFAULT '',
+    season INTEGER NOT NULL DEFAULT 0,
+    episode INTEGER NOT NULL DEFAULT 0,
+    stage TEXT NOT NULL DEFAULT '',
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL DEFAULT '',
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    cache_hit INTEGER NOT NULL DEFAULT 0,
+    ok INTEGER NOT NULL DEFAULT 1,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_calls_project ON calls(project, season, episode);
+"""
+
+_TAGS: ContextVar[Dict[str, Any]] = ContextVar("gss_metrics_tags", default={})
+_local = threading.local()
+
+
+# ====== Nhãn ======
+
+@contextmanager
+def tags(**kw) -> Iterator[Dict[str, Any]]:
+    """Gộp nhãn mới vào nhãn hiện tại (giá trị None bị bỏ qua) trong phạm vi with."""
+    merged = {**_TAGS.get(), **{k: v for k, v in kw.items() if v is not None}}
+    token = _TAGS.set(merged)
+    try:
+        yield merged
+    finally:
+        _TAGS.reset(token)
+
+
+def current_tags() -> Dict[str, Any]:
+    return dict(_TAGS.get())
+
+
+def iter_tagged(gen: Iterator[Any], **kw) -> Iterator[Any]:
+    """Chạy generator trong context có nhãn (with tags() không bao quanh được các lần yield)."""
+    ctx = contextvars.copy_context()
+    ctx.run(_TAGS.set, {**_TAGS.get(), **{k: v for k, v in kw.items() if v is not None}})
+    while True:
+        try:
+            item = ctx.run(next, gen)
+        except StopIteration:
+            return
+        yield item
+
+
+# ====== Ghi ======
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(DB_PATH), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def usage_counts(resp: Any) -> Dict[str, int]:
+    """Token từ resp.usage_metadata (google-generativeai / google-genai dùng cùng tên trường)."""
+    um = getattr(resp, "usage_metadata", None)
+
+    def _n(name: str) -> int:
+        try:
+            return int(getattr(um, name, 0) or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    return {
+        "prompt_tokens": _n("prompt_token_count"),
+        # token "thinking" của 2.5 tính tiền như output
+        "output_tokens": _n("candidates_token_count") + _n("thoughts_token_count"),
+        "cached_tokens": _n("cached_content_token_count"),
+    }
+
+
+def record(kind: str, model: str, resp: Any = None, latency_ms: float = 0.0, retries: int = 0,
+           cache_hit: bool = False, error: str = "", usage: Optional[Dict[str, int]] = None) -> None:
+    """Ghi 1 lệnh gọi; không bao giờ làm hỏng lệnh gọi gốc (lỗi ghi bị bỏ qua)."""
+    if not ENABLED:
+        return
+    u = usage or (usage_counts(resp) if resp is not None else {})
+    t = _TAGS.get()
+    try:
+        _connect().execute(
+            "INSERT INTO calls (ts, project, season, episode, stage, kind, model, prompt_tokens, output_tokens,"
+            " cached_tokens, latency_ms, retries, cache_hit, ok, error) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            (time.time(), str(t.get("project", "")), int(t.get("season", 0) or 0), int(t.get("episode", 0) or 0),
+             str(t.get("stage", "")), kind, model or "",
+             u.get("prompt_tokens", 0), u.get("output_tokens", 0), u.get("cached_tokens", 0),
+             round(float(latency_ms), 1), int(retries), int(bool(cache_hit)), int(not error), error[:500]),
+        )
+    except sqlite3.Error:
+        pass
+
+
+# ====== Chi phí & tổng hợp ======
+
+def _price(model: str) -> tuple:
+    best = ""
+    for k in PRICES_PER_1M:
+        if k in (model or "") and len(k) > len(best):
+            best = k
+    return PRICES_PER_1M.get(best, (0.0, 0.0, 0.0))
+
+
+def cost_usd(model: str, prompt_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    p_in, p_out, p_cached = _price(model)
+    fresh = max(0, prompt_tokens - cached_tokens)
+    return (fresh * p_in + cached_tokens * p_cached + output_tokens * p_out) / 1e6
+
+
+def _rollup(project: str, keys: List[str]) -> List[Dict[str, Any]]:
+    cols = ", ".join(keys)
+    try:
+        rows = _connect().execute(
+            f"SELECT {cols}, model, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,"
+            " SUM(output_tokens) AS output_tokens, SUM(cached_tokens) AS cached_tokens,"
+            " SUM(latency_ms) AS latency_ms, SUM(retries) AS retries, SUM(cache_hit) AS cache_hits,"
+            " SUM(1 - ok) AS errors"
+            f" FROM calls WHERE project = ? GROUP BY {cols}, model ORDER BY {cols}",
+            (project,),
+        ).fetchall()
+    except sqlite3.Error:
+        return []
+    out: Dict[tuple, Dict[str, Any]] = {}
+    for r in rows:
+        k = tuple(r[c] for c in keys)
+        agg = out.setdefault(k, {**{c: r[c] for c in keys}, "calls": 0, "prompt_tokens": 0, "output_tokens": 0,
+                                 "cached_tokens": 0, "latency_s": 0.0, "retries": 0, "cache_hits": 0,
+                                 "errors": 0, "cost_usd": 0.0})
+        for c in ("calls", "prompt_tokens", "output_tokens", "cached_tokens", "retries", "cache_hits", "errors"):
+            agg[c] += int(r[c] or 0)
+        agg["latency_s"] += (r["latency_ms"] or 0) / 1000.0
+        agg["cost_usd"] += cost_usd(r["model"], int(r["prompt_tokens"] or 0), int(r["output_tokens"] or 0),
+                                    int(r["cached_tokens"] or 0))
+    for agg in out.values():
+        agg["latency_s"] = round(agg["latency_s"], 1)
+        agg["cost_usd"] = round(agg["cost_usd"], 4)
+    return list(out.values())
+
+
+def stage_rollup(project: str) -> List[Dict[str, Any]]:
+    """Tổng theo stage của project."""
+    return _rollup(project, ["stage"])
+
+
+def episode_rollup(project: str) -> List[Dict[str, Any]]:
+    """Tổng theo (season, episode) của project — episode 0 = lệnh gọi cấp mùa/project."""
+    return _rollup(project, ["season", "episode"])
+
+
+def clear(project: Optional[str] = None) -> int:
+    try:
+        conn = _connect()
+        if project is None:
+            return conn.execute("DELETE FROM calls").rowcount
+        return conn.execute("DELETE FROM calls WHERE project = ?", (project,)).rowcount
+    except sqlite3.Error:
+        return 0
@@ -0,0 +1,36 @@
+# core/parallel.py
+# -*- coding: utf-8 -*-
+"""
+Chạy song song có giới hạn số worker (ThreadPoolExecutor) cho các lệnh gọi I/O
+(Gemini, HTTP…). Kết quả trả về theo thứ tự HOÀN THÀNH kèm chỉ số gốc,
+để UI hiển thị dần mà vẫn ghép lại đúng thứ tự ban đầu.
+Mỗi item chạy trong bản sao context của luồng gọi (nhãn metrics… theo sang luồng con).
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+DEFAULT_WORKERS = 4
+
+
+def iter_parallel(
+    fn: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = DEFAULT_WORKERS,
+) -> Iterator[Tuple[int, Any, Optional[BaseException]]]:
+    """
+    Gọi fn(item) cho từng item với tối đa max_workers luồng.
+    Yield (index, result, error) ngay khi mỗi item xong; error=None nếu thành công.
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = max(1, min(int(max_workers or 1), len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futs = {pool.submit(contextvars.copy_context().run, fn, it): i for i, it in enumerate(items)}
+        for fut in as_completed(futs):
+            i = futs[fut]
+            try:
+                yield i, fut.result(), None
+            except Exception as e:
+                yield i, None, e
@@ -5,6 +5,9 @@ Centralized preset registry for Gemini Story Studio.
 Each preset defines tone/style/world/tropes and audio-first hints
 that will be injected into prompt builders.
 """
+from core.disk_cache import make_key
+from core.memo import content_memo
+
 #    "Trung Quốc · Xuyên Không · Ngôn Tình · Hệ Thống": {
 #         "tagline": "Xuyên không – báo thù – cặp đôi định mệnh – giọng Trung Hoa audio-first.",
 #         "tone": "kịch tính, giàu nội tâm, cao trào dồn dập; tiết tấu cảnh rõ ràng",
@@ -122,6 +125,7 @@ PRESETS = {
     }
 }
 
+@content_memo(maxsize=32, key=lambda name: make_key(name, PRESETS.get(name)))
 def preset_block(name: str) -> str:
     p = PRESETS.get(name, {})
     if not p: 
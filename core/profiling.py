@@ -0,0 +1,215 @@
+# core/profiling.py
+# -*- coding: utf-8 -*-
+"""
+Đo thời gian hot-path (tuỳ chọn bật) — Streamlit chạy lại app.py + 3 section mỗi lần tương tác,
+nên các bước cục bộ (chuẩn hoá bảng, dựng prompt ảnh, lưu project…) cộng dồn thành độ trễ rerun.
+- timer(name) / @timed(name): đo 1 khối / 1 hàm; tắt → gần như không tốn gì (chỉ kiểm tra cờ).
+- Mẫu giữ trong cửa sổ WINDOW lần gần nhất mỗi tên → stats() trả p50/p90/p99/max qua nhiều rerun.
+- rerun(): bọc cả lượt chạy script; request_trace("cprofile" | "pyinstrument") → lượt rerun kế tiếp
+  được ghi trace ra .cache/profiles/ (.prof mở bằng snakeviz/pstats, .html của pyinstrument).
+- Bật bằng biến môi trường GSS_PROFILE=1 hoặc set_enabled(True) (panel debug ở sidebar).
+"""
+import functools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from core.disk_cache import CACHE_DIR
+
+PROFILE_DIR = CACHE_DIR / "profiles"
+WINDOW = 500
+MAX_TRACES = 20
+
+ENABLED = os.getenv("GSS_PROFILE", "0") == "1"
+
+_LOCK = threading.Lock()
+_SAMPLES: Dict[str, Deque[float]] = {}
+_TOTALS: Dict[str, List[float]] = {}  # name → [số lần, tổng giây] (không giới hạn cửa sổ)
+_TRACE_NEXT: Optional[str] = None
+
+
+def set_enabled(on: bool) -> None:
+    global ENABLED
+    ENABLED = bool(on)
+
+
+def is_enabled() -> bool:
+    return ENABLED
+
+
+# ====== Đo ======
+
+def add_sample(name: str, sec: float) -> None:
+    with _LOCK:
+        dq = _SAMPLES.get(name)
+        if dq is None:
+            dq = _SAMPLES[name] = deque(maxlen=WINDOW)
+            _TOTALS[name] = [0, 0.0]
+        dq.append(sec)
+        _TOTALS[name][0] += 1
+        _TOTALS[name][1] += sec
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    if not ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_sample(name, time.perf_counter() - t0)
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator: @timed("episode.normalize_table") — mặc định dùng module.tên_hàm."""
+    def deco(fn: Callable) -> Callable:
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add_sample(label, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+# ====== Tổng hợp ======
+
+def _pct(vals: List[float], q: float) -> float:
+    """Percentile kiểu nearest-rank trên danh sách đã sắp xếp."""
+    if not vals:
+        return 0.0
+    k = max(0, min(len(vals) - 1, math.ceil(q / 100.0 * len(vals)) - 1))
+    return vals[k]
+
+
+def stats() -> List[Dict[str, Any]]:
+    """[{name, calls, total_s, p50_ms, p90_ms, p99_ms, max_ms, last_ms}] sắp theo tổng thời gian giảm dần."""
+    with _LOCK:
+        snap = {k: (list(v), _TOTALS[k][0], _TOTALS[k][1]) for k, v in _SAMPLES.items()}
+    out = []
+    for name, (window, calls, total) in snap.items():
+        vals = sorted(window)
+        out.append({
+            "name": name,
+            "calls": int(calls),
+            "total_s": round(total, 3),
+            "p50_ms": round(_pct(vals, 50) * 1000, 2),
+            "p90_ms": round(_pct(vals, 90) * 1000, 2),
+            "p99_ms": round(_pct(vals, 99) * 1000, 2),
+            "max_ms": round((vals[-1] if vals else 0.0) * 1000, 2),
+            "last_ms": round((window[-1] if window else 0.0) * 1000, 2),
+        })
+    out.sort(key=lambda r: r["total_s"], reverse=True)
+    return out
+
+
+def reset() -> None:
+    with _LOCK:
+        _SAMPLES.clear()
+        _TOTALS.clear()
+
+
+# ====== Trace (cProfile / pyinstrument) ======
+
+def available_tracers() -> List[str]:
+    out = ["cprofile"]
+    try:
+        import pyinstrument  # noqa: F401
+        out.append("pyinstrument")
+    except Exception:
+        pass
+    return out
+
+
+def request_trace(kind: str = "cprofile") -> None:
+    """Ghi trace cho lượt rerun() kế tiếp (1 lần)."""
+    global _TRACE_NEXT
+    if kind not in available_tracers():
+        raise ValueError(f"Trình profile không có sẵn: {kind}")
+    _TRACE_NEXT = kind
+
+
+def pending_trace() -> Optional[str]:
+    return _TRACE_NEXT
+
+
+def _take_trace() -> Optional[str]:
+    global _TRACE_NEXT
+    with _LOCK:
+        kind, _TRACE_NEXT = _TRACE_NEXT, None
+    return kind
+
+
+def list_traces() -> List[Path]:
+    """File trace đã ghi, mới nhất trước."""
+    if not PROFILE_DIR.exists():
+        return []
+    files = [p for p in PROFILE_DIR.iterdir() if p.suffix in (".prof", ".html")]
+    return sorted(files, key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def _trim_traces() -> None:
+    for p in list_traces()[MAX_TRACES:]:
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+def _start_tracer(kind: str) -> Any:
+    try:
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+            prof = Profiler()
+            prof.start()
+            return prof
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        return prof
+    except Exception:
+        return None  # VD: đã có profiler khác đang chạy
+
+
+def _stop_tracer(kind: str, prof: Any, name: str) -> Optional[Path]:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    try:
+        if kind == "pyinstrument":
+            prof.stop()
+            path = PROFILE_DIR / f"{name}_{stamp}.html"
+            path.write_text(prof.output_html(), encoding="utf-8")
+        else:
+            prof.disable()
+            path = PROFILE_DIR / f"{name}_{stamp}.prof"
+            prof.dump_stats(str(path))
+    except Exception:
+        return None
+    _trim_traces()
+    return path
+
+
+@contextmanager
+def rerun(name: str = "rerun") -> Iterator[None]:
+    """Bọc 1 lượt chạy script: đo tổng thời gian + ghi trace nếu đã request_trace()."""
+    kind = _take_trace() if ENABLED else None
+    prof = _start_tracer(kind) if kind else None
+    try:
+        with timer(name):
+            yield
+    finally:
+        if prof is not None:
+            _stop_tracer(kind, prof, name)
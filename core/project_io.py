@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import json
 import io
+import os
+import tempfile
+import threading
 import zipfile
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 from core.data_models import Project, Season, Episode
 from core.text_utils import _safe_name
+from core.disk_cache import make_key, cache_path, prune
+from core.timeline import build_timeline, timeline_to_edl
+from core.profiling import timed
 
 APP_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = APP_DIR / "projects"
@@ -47,6 +54,7 @@ def _migrate_project_dict(data: Dict[str, Any]) -> Dict[str, Any]:
             e.setdefault("summary", e.get("summary", ""))
             e.setdefault("script_text", e.get("script_text", ""))
             e.setdefault("tts_text", e.get("tts_text", ""))
+            e["checkpoints"] = e.get("checkpoints") or {}
             e["assets"] = _normalize_assets(e.get("assets"))
             eps_norm.append(e)
 
@@ -56,62 +64,361 @@ def _migrate_project_dict(data: Dict[str, Any]) -> Dict[str, Any]:
     data["seasons"] = seasons
     return data
 
+def project_media_dir(proj: Project) -> Path:
+    """Thư mục chứa file sinh ra (ảnh, image jobs, audio…) của project."""
+    return DATA_DIR / f"{_safe_name(proj.name)}_media"
+
+def episode_media_dir(proj: Project, season_index: int, ep_index: int) -> Path:
+    d = project_media_dir(proj) / f"season_{season_index:02d}" / f"episode_{ep_index:02d}"
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+# ====== Lưu trữ: file index + shard theo tập (ghi atomic, chỉ ghi phần thay đổi) ======
+# projects/<tên>.json                          → project (tập chỉ còn stub: index/title/summary/… + "shard")
+# projects/<tên>.shards/season_XX/episode_YY.json → {"script_text", "assets", "tts_text"} của từng tập
+
+SHARD_FIELDS = ("script_text", "assets", "tts_text")
+
+_WRITTEN_HASHES: Dict[str, str] = {}   # path → sha256 nội dung đã ghi/đọc gần nhất (dirty tracking)
+_WRITTEN_LOCK = threading.Lock()
+
+def _shard_dir(project_file: Path) -> Path:
+    return project_file.parent / f"{project_file.stem}.shards"
+
+def _shard_rel(season_pos: int, ep_pos: int) -> str:
+    return f"season_{season_pos:02d}/episode_{ep_pos:02d}.json"
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Ghi file tạm cùng thư mục rồi os.replace → không bao giờ để lại file ghi dở."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            fp.write(text)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _write_if_changed(path: Path, text: str) -> bool:
+    h = _text_hash(text)
+    key = str(path)
+    with _WRITTEN_LOCK:
+        if _WRITTEN_HASHES.get(key) == h and path.exists():
+            return False
+    _atomic_write_text(path, text)
+    with _WRITTEN_LOCK:
+        _WRITTEN_HASHES[key] = h
+    return True
+
+def _read_tracked(path: Path) -> str:
+    text = path.read_text(encoding="utf-8")
+    with _WRITTEN_LOCK:
+        _WRITTEN_HASHES[str(path)] = _text_hash(text)
+    return text
+
+def _load_shard_into(ep: Episode, shard_file: Path) -> None:
+    try:
+        shard = json.loads(_read_tracked(shard_file))
+    except (OSError, ValueError):
+        return
+    ep.script_text = shard.get("script_text") or ""
+    ep.tts_text = shard.get("tts_text") or ""
+    ep.assets = _normalize_assets(shard.get("assets"))
+
+def ensure_season_loaded(proj: Project, sidx: int) -> None:
+    """Đọc các shard chưa nạp của Mùa sidx (project mở ở chế độ lazy)."""
+    if not proj or not (0 <= sidx < len(proj.seasons)):
+        return
+    season = proj.seasons[sidx]
+    pending = season._pending_shards
+    if not pending:
+        return
+    sdir = _shard_dir(DATA_DIR / f"{_safe_name(proj.name)}.json")
+    for ei, rel in list(pending.items()):
+        if ei < len(season.episodes):
+            _load_shard_into(season.episodes[ei], sdir / rel)
+    pending.clear()
+
+def ensure_all_loaded(proj: Project) -> None:
+    for sidx in range(len(proj.seasons or [])):
+        ensure_season_loaded(proj, sidx)
+
+@timed("project_io.save_project")
 def save_project(proj: Project) -> Path:
+    """
+    Lưu project: file index nhỏ + 1 shard/tập. Chỉ ghi file có nội dung thay đổi, mỗi file ghi atomic.
+    Shard chưa nạp (lazy) được giữ nguyên trên đĩa.
+    """
     f = DATA_DIR / f"{_safe_name(proj.name)}.json"
-    with f.open("w", encoding="utf-8") as fp:
-        json.dump(proj.model_dump(), fp, ensure_ascii=False, indent=2)
+    sdir = _shard_dir(f)
+    # shard lazy lệch vị trí (VD: vừa xoá 1 Mùa phía trước) → nạp trước để ghi lại đúng chỗ
+    for si, season in enumerate(proj.seasons, 1):
+        if any(rel != _shard_rel(si, ei + 1) for ei, rel in season._pending_shards.items()):
+            ensure_season_loaded(proj, si - 1)
+
+    data = proj.model_dump()
+    keep = set()
+    for si, (season, s_data) in enumerate(zip(proj.seasons, data.get("seasons", [])), 1):
+        pending = season._pending_shards
+        for ei, e_data in enumerate(s_data.get("episodes", []), 1):
+            rel = _shard_rel(si, ei)
+            if (ei - 1) not in pending:
+                shard = {k: e_data.get(k) for k in SHARD_FIELDS}
+                _write_if_changed(sdir / rel, json.dumps(shard, ensure_ascii=False))
+            for k in SHARD_FIELDS:
+                e_data.pop(k, None)
+            e_data["shard"] = rel
+            keep.add(rel)
+    data["storage"] = "shards"
+    _write_if_changed(f, json.dumps(data, ensure_ascii=False, indent=2))
+
+    # dọn shard mồ côi (tập/mùa đã xoá)
+    if sdir.exists():
+        for old in sdir.rglob("episode_*.json"):
+            if old.relative_to(sdir).as_posix() not in keep:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
     return f
 
-def load_project(path: Path) -> Project:
+@timed("project_io.load_project")
+def load_project(path: Path, lazy: bool = False) -> Project:
+    """
+    Mở project (định dạng cũ 1 file hoặc index + shard).
+    lazy=True: chỉ đọc file index; shard từng Mùa đọc khi gọi ensure_season_loaded().
+    """
     p = Path(path)
     if not p.is_absolute():
-        p = DATA_DIR | p  # nếu Python <3.9 dùng p = DATA_DIR / p
-    with p.open("r", encoding="utf-8") as fp:
-        raw = json.load(fp)
-    data = _migrate_project_dict(raw)
-    return Project(**data)
+        p = DATA_DIR / p
+    raw = json.loads(_read_tracked(p))
+    proj = Project(**_migrate_project_dict(raw))
 
-def export_zip(proj: Project) -> bytes:
-    mem = io.BytesIO()
-    with zipfile.ZipFile(mem, "w", zipfile.ZIP_DEFLATED) as z:
-        z.writestr("project.json", json.dumps(proj.model_dump(), ensure_ascii=False, indent=2))
+    sdir = _shard_dir(p)
+    for si, s_raw in enumerate(raw.get("seasons") or []):
+        if si >= len(proj.seasons):
+            break
+        season = proj.seasons[si]
+        for ei, e_raw in enumerate((s_raw or {}).get("episodes") or []):
+            rel = (e_raw or {}).get("shard")
+            if not rel or ei >= len(season.episodes):
+                continue
+            if lazy:
+                season._pending_shards[ei] = rel
+            else:
+                _load_shard_into(season.episodes[ei], sdir / rel)
+    return proj
+
+# ====== Project index cho sidebar (cache theo mtime/size, chỉ parse lại file đã đổi) ======
+
+_INDEX_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+_INDEX_LOCK = threading.Lock()
+
+def project_file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) của file project; None nếu không tồn tại."""
+    try:
+        st = Path(path).stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def project_signature(path: Path) -> Optional[Tuple[Any, ...]]:
+    """
+    Chữ ký index + mọi shard (mtime_ns, size): worker chỉ ghi shard (assets/tts của veo/images/tts)
+    thì index không đổi nhưng chữ ký vẫn đổi → UI biết để nạp lại.
+    """
+    base = project_file_signature(path)
+    if base is None:
+        return None
+    shards = []
+    sdir = _shard_dir(Path(path))
+    try:
+        for sd in sorted(os.scandir(sdir), key=lambda e: e.name):
+            if not sd.is_dir():
+                continue
+            for e in sorted(os.scandir(sd.path), key=lambda e: e.name):
+                if e.name.endswith(".json") and not e.name.startswith("."):
+                    st = e.stat()
+                    shards.append((sd.name, e.name, st.st_mtime_ns, st.st_size))
+    except OSError:
+        pass
+    return (base, tuple(shards))
+
+def reload_episode(proj: Project, sidx: int, ep_idx: int) -> bool:
+    """Đọc lại shard của 1 tập từ đĩa (VD: worker vừa ghi xong). Trả về False nếu không có shard."""
+    if not (0 <= sidx < len(proj.seasons)) or not (0 <= ep_idx < len(proj.seasons[sidx].episodes)):
+        return False
+    season = proj.seasons[sidx]
+    if ep_idx in season._pending_shards:
+        return True  # chưa nạp → lần nạp lazy sẽ đọc bản mới nhất
+    shard = _shard_dir(DATA_DIR / f"{_safe_name(proj.name)}.json") / _shard_rel(sidx + 1, ep_idx + 1)
+    if not shard.is_file():
+        return False
+    _load_shard_into(season.episodes[ep_idx], shard)
+    return True
+
+def _index_entry(f: Path) -> Dict[str, Any]:
+    try:
+        raw = json.loads(f.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raw = {}
+    seasons = raw.get("seasons") or []
+    return {
+        "file": f.name,
+        "name": raw.get("name") or f.stem,
+        "seasons": len(seasons),
+        "episodes": sum(len((s or {}).get("episodes") or []) for s in seasons),
+    }
+
+def list_projects() -> List[Dict[str, Any]]:
+    """
+    Danh sách project: {file, name, seasons, episodes, mtime, size}, mới sửa trước.
+    File không đổi mtime/size thì dùng lại thông tin đã parse.
+    """
+    out = []
+    seen = set()
+    for f in DATA_DIR.glob("*.json"):
+        sig = project_file_signature(f)
+        if sig is None:
+            continue
+        key = str(f)
+        seen.add(key)
+        with _INDEX_LOCK:
+            hit = _INDEX_CACHE.get(key)
+        if hit is None or hit[0] != sig:
+            info = _index_entry(f)
+            with _INDEX_LOCK:
+                _INDEX_CACHE[key] = (sig, info)
+        else:
+            info = hit[1]
+        out.append({**info, "mtime": sig[0] / 1e9, "size": sig[1]})
+    with _INDEX_LOCK:
+        for key in [k for k in _INDEX_CACHE if k not in seen]:
+            del _INDEX_CACHE[key]
+    out.sort(key=lambda it: it["mtime"], reverse=True)
+    return out
+
+# ====== Export ZIP: ghi thẳng ra file (không giữ cả archive trong RAM), cache theo nội dung ======
+EXPORT_NS = "exports"
+EXPORT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Media đã nén sẵn → ZIP_STORED (deflate lại chỉ tốn CPU, không giảm dung lượng)
+_STORED_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp3", ".mp4", ".m4a", ".ogg", ".wav", ".zip"}
+
+def _iter_media_files(proj: Project):
+    root = project_media_dir(proj)
+    if not root.is_dir():
+        return
+    for f in sorted(root.rglob("*")):
+        if f.is_file() and not f.name.endswith(".tmp"):
+            yield f, f.relative_to(root).as_posix()
+
+def _veo_segments_text(assets: Dict[str, Any]) -> str:
+    lines: List[str] = []
+    for j, sc in enumerate(assets.get("scenes", []), 1):
+        segs = sc.get("veo31_segments") or sc.get("segments") or []
+        if not segs:
+            continue
+        lines.append(f"## {sc.get('scene', f'Cảnh {j}')}")
+        for si, seg in enumerate(segs, 1):
+            title = seg.get("title", "")
+            dur = seg.get("duration_sec", 8)
+            veo = seg.get("veo_prompt", "")
+            sfx = seg.get("sfx", "")
+            chars = seg.get("characters", [])
+            lines.append(
+                f"\n# Clip {si} — {dur}s: {title}\n"
+                f"[Characters] {', '.join(chars)}\n"
+                f"{veo}\n"
+                f"[SFX] {sfx}\n"
+            )
+    return "\n".join(lines)
+
+def _write_json_entry(z: zipfile.ZipFile, name: str, obj: Any) -> None:
+    """json.dump thẳng vào entry (ghi theo từng đoạn, không dựng chuỗi JSON lớn trong RAM)."""
+    with z.open(name, "w", force_zip64=True) as raw, io.TextIOWrapper(raw, encoding="utf-8") as w:
+        json.dump(obj, w, ensure_ascii=False, indent=2)
+
+def _write_export(proj: Project, dst: Path, include_media: bool) -> None:
+    with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+        _write_json_entry(z, "project.json", proj.model_dump())
 
         for s in proj.seasons or []:
-            s_idx = s.season_index
-            s_prefix = f"seasons/season_{s_idx:02d}"
-            z.writestr(f"{s_prefix}/outline.json", json.dumps(s.outline or [], ensure_ascii=False, indent=2))
+            s_prefix = f"seasons/season_{s.season_index:02d}"
+            _write_json_entry(z, f"{s_prefix}/outline.json", s.outline or [])
 
             for ep in s.episodes or []:
                 base = f"{s_prefix}/episode_{ep.index:02d}_{_safe_name(ep.title)}"
                 z.writestr(f"{base}/script.md", ep.script_text or "")
                 assets = _normalize_assets(ep.assets or {"scenes": []})
-                z.writestr(f"{base}/assets.json", json.dumps(assets, ensure_ascii=False, indent=2))
+                _write_json_entry(z, f"{base}/assets.json", assets)
                 z.writestr(f"{base}/tts.txt", ep.tts_text or "")
-
+                veo_txt = ""
                 try:
-                    scenes = assets.get("scenes", [])
-                    lines: List[str] = []
-                    for j, sc in enumerate(scenes, 1):
-                        segs = sc.get("veo31_segments") or sc.get("segments") or []
-                        if not segs:
-                            continue
-                        lines.append(f"## {sc.get('scene', f'Cảnh {j}')}")
-                        for si, seg in enumerate(segs, 1):
-                            title = seg.get("title", "")
-                            dur = seg.get("duration_sec", 8)
-                            veo = seg.get("veo_prompt", "")
-                            sfx = seg.get("sfx", "")
-                            chars = seg.get("characters", [])
-                            lines.append(
-                                f"\n# Clip {si} — {dur}s: {title}\n"
-                                f"[Characters] {', '.join(chars)}\n"
-                                f"{veo}\n"
-                                f"[SFX] {sfx}\n"
-                            )
-                    if lines:
-                        z.writestr(f"{base}/veo31_segments.txt", "\n".join(lines))
+                    veo_txt = _veo_segments_text(assets)
+                    if veo_txt:
+                        z.writestr(f"{base}/veo31_segments.txt", veo_txt)
                 except Exception:
                     pass
+                if ep.script_text or veo_txt:
+                    tl = build_timeline(ep.script_text or "", assets.get("scenes", []))
+                    _write_json_entry(z, f"{base}/timeline.json", tl)
+                    z.writestr(f"{base}/timeline.edl", timeline_to_edl(tl, f"S{s.season_index:02d}E{ep.index:02d}"))
 
-    mem.seek(0)
-    return mem.read()
+        if include_media:
+            # z.write đọc/ghi file theo từng khối, không nạp cả file media vào RAM
+            for f, rel in _iter_media_files(proj):
+                ctype = zipfile.ZIP_STORED if f.suffix.lower() in _STORED_EXTS else zipfile.ZIP_DEFLATED
+                z.write(f, f"media/{rel}", compress_type=ctype)
+
+def _export_key(proj: Project, include_media: bool) -> str:
+    media_sig = []
+    if include_media:
+        for f, rel in _iter_media_files(proj):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            media_sig.append((rel, st.st_size, st.st_mtime_ns))
+    return make_key("export-v1", proj.model_dump(), include_media, media_sig)
+
+def export_zip_file(proj: Project, include_media: bool = True) -> Path:
+    """
+    Xuất project ra file .zip trong .cache/exports và trả về đường dẫn.
+    - Key theo nội dung project (+ danh sách file media); bấm Export lại khi chưa sửa gì → dùng lại file cũ.
+    - Archive ghi trực tiếp ra file tạm rồi os.replace (không có bản sao bytes toàn bộ trong RAM).
+    """
+    ensure_all_loaded(proj)
+    key = _export_key(proj, include_media)
+    out = cache_path(EXPORT_NS, key, suffix=".zip")
+    if out.exists():
+        try:
+            os.utime(out, None)  # LRU
+        except OSError:
+            pass
+        return out
+    fd, tmp = tempfile.mkstemp(prefix=out.name + ".", suffix=".tmp", dir=str(out.parent))
+    os.close(fd)
+    try:
+        _write_export(proj, Path(tmp), include_media)
+        os.replace(tmp, out)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    prune(EXPORT_NS, EXPORT_MAX_BYTES)
+    return out
+
+def export_zip(proj: Project) -> bytes:
+    """Giữ tương thích: trả bytes (nên dùng export_zip_file cho project lớn)."""
+    return export_zip_file(proj).read_bytes()
@@ -1,7 +1,28 @@
 # -*- coding: utf-8 -*-
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from core.presets import PRESETS, preset_block
 
+# Prompt dài (outline / episode / character bible) = PREFIX dùng chung + SUFFIX riêng từng lần gọi.
+# PREFIX (cốt truyện + preset) giống hệt nhau giữa các lần gọi của 1 project → cache được
+# (context caching tường minh qua core.context_cache, hoặc implicit cache theo tiền tố của Gemini).
+PROMPT_SEPARATOR = "\n\n"
+
+def build_story_prefix(chosen: str, preset_name: Optional[str] = None) -> str:
+    """Phần đầu prompt dùng chung cho mọi lời gọi của project (không chứa gì riêng theo tập/mùa)."""
+    preset_info = preset_block(preset_name) if preset_name else ""
+    return f"""
+BỐI CẢNH DỰ ÁN (dùng chung cho mọi yêu cầu bên dưới)
+Cốt truyện đã chọn:
+---
+{chosen}
+---
+
+{preset_info}
+""".strip()
+
+def join_prompt(prefix: str, suffix: str) -> str:
+    return f"{prefix}{PROMPT_SEPARATOR}{suffix}" if prefix else suffix
+
 def build_storyline_prompt(idea: str, preset_name: str) -> str:
     """
     Gợi ý 5 phương án cốt truyện từ ý tưởng + preset.
@@ -26,22 +47,16 @@ KHÔNG thêm lời dẫn, KHÔNG markdown, chỉ in JSON hợp lệ.
 """.strip()
 
 
-def build_outline_prompt_season(
+def build_outline_prompt_season_parts(
     chosen: str,
     episode_count: int,
     recap: str = "",
     preset_name: Optional[str] = None
-) -> str:
-    """
-    Sinh dàn ý mùa (episode_count tập) từ cốt truyện đã chọn + preset (nếu có).
-    """
-    preset_info = preset_block(preset_name) if preset_name else ""
-    recap_part = f"\nRecap các mùa trước:\n{recap}\n" if recap else ""
-    return f"""
-Từ cốt truyện đã chọn:\n---\n{chosen}\n---{recap_part}
-{preset_info}
-
-Hãy tạo DÀN Ý MÙA gồm {episode_count} tập.
+) -> Tuple[str, str]:
+    """(prefix, suffix) cho dàn ý mùa (episode_count tập) từ cốt truyện đã chọn + preset (nếu có)."""
+    recap_part = f"Recap các mùa trước:\n{recap}\n\n" if recap else ""
+    suffix = f"""
+{recap_part}Từ cốt truyện đã chọn ở trên, hãy tạo DÀN Ý MÙA gồm {episode_count} tập.
 YÊU CẦU:
 - Mỗi tập mô tả 1–2 câu: bối cảnh, mâu thuẫn, tiến độ xung đột, hook nối tập sau.
 - Liên kết continuity (nhân vật, nợ cốt truyện, đồ vật/điểm mốc).
@@ -50,24 +65,34 @@ YÊU CẦU:
 Trả về JSON list: [{{"title":"...", "beat":"..."}}].
 KHÔNG thêm lời dẫn, KHÔNG markdown.
 """.strip()
+    return build_story_prefix(chosen, preset_name), suffix
 
 
-def build_episode_prompt(
+def build_outline_prompt_season(
+    chosen: str,
+    episode_count: int,
+    recap: str = "",
+    preset_name: Optional[str] = None
+) -> str:
+    """
+    Sinh dàn ý mùa (episode_count tập) từ cốt truyện đã chọn + preset (nếu có).
+    """
+    return join_prompt(*build_outline_prompt_season_parts(chosen, episode_count, recap, preset_name))
+
+
+def build_episode_prompt_parts(
     chosen: str,
     ep_title: str,
     ep_beat: str,
     preset_name: Optional[str] = None
-) -> str:
+) -> Tuple[str, str]:
     """
-    Sinh kịch bản một tập theo format audio-first 3 cột.
+    (prefix, suffix) cho kịch bản một tập theo format audio-first 3 cột.
     FULL_SCRIPT phải là Markdown table 3 cột đúng header, không có chữ thừa ngoài bảng.
     """
-    preset_info = preset_block(preset_name) if preset_name else ""
-    return f"""
-Viết kịch bản AUDIO-FIRST cho tập: "{ep_title}" dựa trên dàn ý: "{ep_beat}" và tổng cốt truyện:
-{chosen}
+    suffix = f"""
+Viết kịch bản AUDIO-FIRST cho tập: "{ep_title}" dựa trên dàn ý: "{ep_beat}" và cốt truyện đã chọn ở trên.
 
-{preset_info}
 YÊU CẦU CHI TIẾT CHO FULL_SCRIPT:
 - Viết kịch bản **audio-first**, trong đó mỗi hành động, chuyển động hay phản ứng đều được diễn tả bằng **micro-actions** ngắn và có **âm thanh gợi tả** đi kèm.
 - Khi nhân vật làm gì, hãy mô tả cả **cảm giác – tiếng động – không gian** (VD: tiếng gió, tiếng chân, tiếng áo lụa, hơi thở, tiếng va chạm…).
@@ -97,22 +122,31 @@ TRẢ VỀ JSON DUY NHẤT (định dạng chính xác):
   "TTS": "…"
 }}
 """.strip()
+    return build_story_prefix(chosen, preset_name), suffix
 
 
-def build_character_bible_prompt(
+def build_episode_prompt(
+    chosen: str,
+    ep_title: str,
+    ep_beat: str,
+    preset_name: Optional[str] = None
+) -> str:
+    """Sinh kịch bản một tập theo format audio-first 3 cột (prefix + suffix ghép sẵn)."""
+    return join_prompt(*build_episode_prompt_parts(chosen, ep_title, ep_beat, preset_name))
+
+
+def build_character_bible_prompt_parts(
     project_name: str,
     idea: str,
     chosen: str,
     outline: Optional[List[Dict[str, str]]],
     max_chars: int = 6,
     preset_name: Optional[str] = None
-) -> str:
+) -> Tuple[str, str]:
     """
-    Sinh Character Bible (tối đa max_chars nhân vật).
+    (prefix, suffix) cho Character Bible (tối đa max_chars nhân vật).
     Hỗ trợ preset và tham chiếu dàn ý mùa nếu có.
     """
-    preset_info = preset_block(preset_name) if preset_name else ""
-
     outline_text = ""
     if outline:
         try:
@@ -121,12 +155,10 @@ def build_character_bible_prompt(
         except Exception:
             outline_text = ""
 
-    return f"""
+    suffix = f"""
 Bạn là biên tập xây dựng 'Character Bible' cho dự án: "{project_name}".
 Ý tưởng gốc: {idea}
-Cốt truyện đã chọn: {chosen}
-
-{preset_info}
+Cốt truyện: như phần đã chọn ở trên.
 
 Nhiệm vụ: Tạo danh sách tối đa {max_chars} nhân vật cốt lõi phục vụ dựng kịch bản audio-first.
 YÊU CẦU mỗi nhân vật có các thuộc tính:
@@ -140,3 +172,19 @@ Nếu có dàn ý mùa, tham chiếu nhịp câu chuyện sau:
 Trả về JSON: {{"characters":[{{"name":"...","role":"...","age":"...","look":"...","hair":"...","outfit":"...","color_theme":"...","notes":"..."}}]}}.
 KHÔNG kèm lời dẫn hay markdown, chỉ in JSON hợp lệ.
 """.strip()
+    return build_story_prefix(chosen, preset_name), suffix
+
+
+def build_character_bible_prompt(
+    project_name: str,
+    idea: str,
+    chosen: str,
+    outline: Optional[List[Dict[str, str]]],
+    max_chars: int = 6,
+    preset_name: Optional[str] = None
+) -> str:
+    """
+    Sinh Character Bible (tối đa max_chars nhân vật).
+    Hỗ trợ preset và tham chiếu dàn ý mùa nếu có.
+    """
+    return join_prompt(*build_character_bible_prompt_parts(project_name, idea, chosen, outline, max_chars, preset_name))
@@ -0,0 +1,103 @@
+# core/schemas.py
+# -*- coding: utf-8 -*-
+"""
+Schema đầu ra có kiểu cho các lệnh gọi JSON (structured output của Gemini):
+model pydantic → response_schema (tập con OpenAPI mà API nhận) truyền qua gemini_json(schema=...).
+- Tên khoá giữ đúng định dạng prompt đang yêu cầu (FULL_SCRIPT/ASSETS/TTS, segments…) → code đọc kết quả không đổi.
+- Model/SDK từ chối schema → gemini_helpers tự lùi về JSON mode thường.
+"""
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, Field, TypeAdapter
+
+
+# ====== Model đầu ra ======
+
+class StorylineItem(BaseModel):
+    title: str = Field(description="10–16 từ mô tả ngắn")
+    summary: str = Field(description="120–180 từ")
+
+
+class OutlineItem(BaseModel):
+    title: str
+    beat: str
+
+
+class SceneAsset(BaseModel):
+    scene: str
+    image_prompt: str
+    sfx_prompt: str
+    characters: List[str]
+
+
+class EpisodeOutput(BaseModel):
+    FULL_SCRIPT: str = Field(description="Bảng Markdown 3 cột: Content Type | Detailed Content | Technical Notes")
+    ASSETS: List[SceneAsset]
+    TTS: str = Field(description="Bản đọc liền mạch, không Markdown")
+
+
+class CharacterEntry(BaseModel):
+    name: str
+    role: str
+    age: str
+    look: str
+    hair: str
+    outfit: str
+    color_theme: str
+    notes: str
+
+
+class CharacterBibleOutput(BaseModel):
+    characters: List[CharacterEntry]
+
+
+class VeoSegment(BaseModel):
+    title: str
+    duration_sec: int
+    characters: List[str]
+    veo_prompt: str
+    sfx: str
+    notes: str
+
+
+class VeoSceneOutput(BaseModel):
+    scene: str
+    segments: List[VeoSegment]
+
+
+# ====== pydantic JSON Schema → response_schema ======
+
+_TYPES = {"object": "OBJECT", "array": "ARRAY", "string": "STRING", "integer": "INTEGER",
+          "number": "NUMBER", "boolean": "BOOLEAN"}
+
+
+def _convert(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    """Inline $ref, đổi type sang enum của API, chỉ giữ các trường API hỗ trợ."""
+    if "$ref" in node:
+        node = defs[node["$ref"].rsplit("/", 1)[-1]]
+    out: Dict[str, Any] = {"type": _TYPES[node.get("type", "string")]}
+    if node.get("description"):
+        out["description"] = node["description"]
+    if node.get("enum"):
+        out["enum"] = list(node["enum"])
+    if out["type"] == "ARRAY":
+        out["items"] = _convert(node.get("items") or {}, defs)
+    if out["type"] == "OBJECT":
+        props = node.get("properties") or {}
+        out["properties"] = {k: _convert(v, defs) for k, v in props.items()}
+        if node.get("required"):
+            out["required"] = list(node["required"])
+    return out
+
+
+def response_schema(tp: Any) -> Dict[str, Any]:
+    """Model pydantic hoặc kiểu List[Model] → dict response_schema."""
+    js = TypeAdapter(tp).json_schema()
+    return _convert(js, js.get("$defs") or {})
+
+
+STORYLINE_SCHEMA = response_schema(List[StorylineItem])
+OUTLINE_SCHEMA = response_schema(List[OutlineItem])
+EPISODE_SCHEMA = response_schema(EpisodeOutput)
+CHARACTER_BIBLE_SCHEMA = response_schema(CharacterBibleOutput)
+VEO_SEGMENTS_SCHEMA = response_schema(VeoSceneOutput)
@@ -0,0 +1,80 @@
+# core/stub_model.py
+# -*- coding: utf-8 -*-
+"""
+Model giả lập (offline) có cùng giao diện generate_content với google.generativeai.GenerativeModel.
+Dùng cho dry-run pipeline / worker: trả JSON hợp lệ theo loại prompt, không gọi API.
+"""
+import json
+import re
+from typing import Any, Iterator, List
+
+
+class _Resp:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+def _stub_payload(prompt: str) -> Any:
+    p = prompt or ""
+    if "FULL_SCRIPT" in p:
+        m = re.search(r'tập: "([^"]*)"', p)
+        title = m.group(1) if m else "Tập"
+        return {
+            "FULL_SCRIPT": (
+                "| Content Type | Detailed Content | Technical Notes |\n|---|---|---|\n"
+                f"| Narration | Đêm xuống trên Thái Hư Tông, Diệp Minh luyện kiếm ({title}). | |\n"
+                "| Sound Effects | Tiếng kiếm xé gió. | |\n"
+                "| Dialogue | Diệp Minh: Ta sẽ không lùi bước. | [giọng thấp] |\n"
+                "| Transition | Chuyển cảnh sang bình minh. | |"
+            ),
+            "ASSETS": [
+                {"scene": "Thái Hư Tông — đêm", "image_prompt": "Toàn cảnh Thái Hư Tông dưới ánh trăng",
+                 "sfx_prompt": "gió đêm, côn trùng", "characters": []},
+                {"scene": "Diệp Minh luyện kiếm", "image_prompt": "Diệp Minh vung kiếm, kiếm khí lóe sáng",
+                 "sfx_prompt": "Sword Whoosh", "characters": ["Diệp Minh"]},
+            ],
+            "TTS": "Đêm xuống trên Thái Hư Tông.\nDiệp Minh: Ta sẽ không lùi bước.",
+        }
+    if '"segments"' in p:
+        m = re.search(r'"scene":\s*"([^"]*)"', p)
+        return {
+            "scene": m.group(1) if m else "Cảnh",
+            "segments": [{
+                "title": "Kiếm khí rạch đêm", "duration_sec": 8, "characters": [],
+                "veo_prompt": "Medium shot, slow dolly-in, moonlight rim light, 24fps.",
+                "sfx": "Sword Whoosh", "notes": "stub",
+            }],
+        }
+    if '"characters"' in p and "Character Bible" in p:
+        return {"characters": [{
+            "name": "Diệp Minh", "role": "nam chính", "age": "18", "look": "gương mặt Á Đông",
+            "hair": "đen dài", "outfit": "y phục trắng", "color_theme": "trắng, lam", "notes": "donghua",
+        }]}
+    m = re.search(r"DÀN Ý MÙA gồm (\d+) tập", p)
+    if m:
+        n = int(m.group(1))
+        return [{"title": f"Tập {i}: Bước ngoặt {i}", "beat": f"Diễn biến chính của tập {i}."} for i in range(1, n + 1)]
+    if "PHƯƠNG ÁN CỐT TRUYỆN" in p:
+        return [{"title": f"Phương án {i}", "summary": f"Tóm tắt phương án {i}."} for i in range(1, 6)]
+    return {"text": "stub"}
+
+
+class StubModel:
+    """Thay thế GenerativeModel khi chạy thử (dry-run)."""
+
+    def __init__(self, model_name: str = "stub"):
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream: bool = False, **kwargs):
+        self.calls += 1
+        text = json.dumps(_stub_payload(str(prompt)), ensure_ascii=False)
+        if stream:
+            return self._stream(text)
+        return _Resp(text)
+
+    @staticmethod
+    def _stream(text: str, size: int = 64) -> Iterator[_Resp]:
+        chunks: List[str] = [text[i:i + size] for i in range(0, len(text), size)]
+        return iter([_Resp(c) for c in chunks])
@@ -1,6 +1,11 @@
 import re, unicodedata
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Union
 
+from core.memo import content_memo, copy_rows
+from core.profiling import timed
+
+@lru_cache(maxsize=4096)
 def _fold(s: str) -> str:
     s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
     return s.lower().strip()
@@ -36,41 +41,91 @@ def capcut_sfx_name(effect_type: str) -> str:
     return ""
 
 
+# ===================== Bảng FULL_SCRIPT 3 cột =====================
+
+@timed("text_utils.parse_script_table")
+@content_memo(maxsize=64, copy=copy_rows)
+def parse_script_table(md: str) -> List[Dict[str, str]]:
+    """Trả về list hàng: [{'ctype','content','notes'}] từ bảng 3 cột (1 lượt qua văn bản)."""
+    if not md:
+        return []
+    rows = []
+    for line in md.splitlines():
+        line = line.strip()
+        if not line.startswith("|") or "|---" in line:
+            continue
+        parts = [p.strip() for p in line.strip("|").split("|")]
+        if len(parts) < 3:
+            continue
+        c0, c1, c2 = parts[:3]
+        # bỏ header
+        if "content type" in c0.lower():
+            continue
+        rows.append({"ctype": c0, "content": c1, "notes": c2})
+    return rows
+
+
+# ===================== TTS: làm sạch + tách người nói =====================
+# Pattern biên dịch sẵn, xử lý từng dòng 1 lượt (giữ đúng thứ tự lọc của bản cũ):
+#   markdown → dòng tiêu đề cảnh → [SFX …]/(BGM …) → dòng ASSETS|TTS|FULL_SCRIPT: → gộp khoảng trắng
+# Các regex "rải rác" đều bắt đầu bằng 1 tập ký tự để engine nhảy thẳng tới vị trí ứng viên.
+_FX_TAGS = r"(?:SFX|FX|Ambience|Âm nền|BGM|Nhạc nền|Transition|Chuyển cảnh)"
+_MD_NOISE = re.compile(r"[*`](?:(?<=\*)\**|(?<=`)`*)|__")
+_FX_NOISE = re.compile(rf"[\[(](?:(?<=\[){_FX_TAGS}[^\]]*\]|(?<=\(){_FX_TAGS}[^\)]*\))", re.IGNORECASE)
+_HEADER_LINE = re.compile(r"\s*(?:SCN|Cảnh|Scene)\s*\d", re.IGNORECASE)
+_SECTION_LINE = re.compile(r"\s*(?:ASSETS|TTS|FULL_SCRIPT)\s*:")
+
+def _clean_line(line: str) -> str:
+    if "*" in line or "_" in line or "`" in line:
+        line = _MD_NOISE.sub("", line)
+    if _HEADER_LINE.match(line):
+        return ""
+    if "[" in line or "(" in line:
+        line = _FX_NOISE.sub("", line)
+    if _SECTION_LINE.match(line):
+        return ""
+    return " ".join(line.split())
+
 def clean_tts_text(text: str) -> str:
     if not text: return ""
-    s = re.sub(r"\*\*|\*|__|`+", "", text)
-    s = re.sub(r"^\s*(SCN|Cảnh|Scene)\s*\d+\s*[:\-]?.*$", "", s, flags=re.MULTILINE|re.IGNORECASE)
-    s = re.sub(r"\[(?:SFX|FX|Ambience|Âm nền|BGM|Nhạc nền|Transition|Chuyển cảnh)[^\]]*\]", "", s, flags=re.IGNORECASE)
-    s = re.sub(r"\((?:SFX|FX|Ambience|Âm nền|BGM|Nhạc nền|Transition|Chuyển cảnh)[^\)]*\)", "", s, flags=re.IGNORECASE)
-    s = re.sub(r"^\s*(ASSETS|TTS|FULL_SCRIPT)\s*:.*$", "", s, flags=re.MULTILINE)
-    s = re.sub(r"\s+", " ", s)
-    return s.strip()
+    return " ".join(filter(None, map(_clean_line, text.split("\n"))))
 
 SPEAKER_PAT = re.compile(
     r"^(?:\s*[-–—]\s*)?(?:\*\s*)?(?P<name>[A-ZÀ-Ỵa-zà-ỹ0-9 _\[\]\(\)HỆ THỐNGSystem]+?)\s*[:：]\s*(?P<line>.+)$"
 )
+_NAME_BRACKETS = re.compile(r'^[\[\(]\s*|\s*[\]\)]$')
+_SYSTEM_NAMES = {"he thong", "system", "voice system"}
+NARRATOR = "Người Dẫn Chuyện"
+
+def _parse_line(t: str) -> Dict[str, str]:
+    m = SPEAKER_PAT.match(t) if (":" in t or "：" in t) else None
+    if not m:
+        return {"speaker": NARRATOR, "text": t}
+    name = _NAME_BRACKETS.sub('', m.group('name').strip()).strip()
+    if _fold(name) in _SYSTEM_NAMES:
+        name = "HỆ THỐNG"
+    return {"speaker": name, "text": m.group('line').strip()}
+
+def iter_tts_lines(text: Union[str, Iterable[str]], clean: bool = True) -> Iterator[Dict[str, str]]:
+    """
+    Duyệt từng dòng TTS → {"speaker", "text"} (generator, không dựng list trung gian).
+    text: chuỗi hoặc iterable các dòng (VD: file mở ở chế độ text).
+    clean=True: làm sạch từng dòng như clean_tts_text nhưng giữ ranh giới dòng.
+    """
+    lines = text.split('\n') if isinstance(text, str) else text
+    for raw in lines:
+        t = _clean_line(raw) if clean else raw.strip()
+        if t:
+            yield _parse_line(t)
 
 def parse_tts_lines(text: str):
-    lines = []
-    for raw in text.split('\n'):
-        t = raw.strip()
-        if not t: continue
-        m = SPEAKER_PAT.match(t)
-        if m:
-            name = m.group('name').strip()
-            name = re.sub(r'^[\[\(]\s*|\s*[\]\)]$', '', name).strip()
-            if _fold(name) in {"he thong", "system", "voice system"}:
-                name = "HỆ THỐNG"
-            lines.append({"speaker": name, "text": m.group('line').strip()})
-        else:
-            lines.append({"speaker": "Người Dẫn Chuyện", "text": t})
-    return lines
+    return list(iter_tts_lines(text, clean=False))
 
 def extract_characters(parsed: List[Dict[str, str]]) -> List[str]:
     chars = []
     for it in parsed:
         sp = it["speaker"]
-        if sp not in ("Người Dẫn Chuyện",) and sp not in chars:
+        if sp not in (NARRATOR,) and sp not in chars:
             chars.append(sp)
     if any(it["speaker"] == "HỆ THỐNG" for it in parsed) and "HỆ THỐNG" not in chars:
         chars.append("HỆ THỐNG")
@@ -90,11 +145,12 @@ def suggest_styles(char_names: List[str]) -> Dict[str, str]:
             out[n] = "Trung tính, giàu cảm xúc theo ngữ cảnh"
     return out
 
-def seed_char_names_from_tts(tts_text: str) -> list[str]:
-    parsed = parse_tts_lines(clean_tts_text(tts_text or ""))
+def seed_char_names_from_tts(tts_text: str, limit: int = 10) -> list[str]:
     names = []
-    for ln in parsed:
+    for ln in iter_tts_lines(tts_text or ""):
         sp = ln.get("speaker", "")
-        if sp and sp not in ("Người Dẫn Chuyện", "HỆ THỐNG") and sp not in names:
+        if sp and sp not in (NARRATOR, "HỆ THỐNG") and sp not in names:
             names.append(sp)
-    return names[:10]
+            if len(names) >= limit:
+                break
+    return names
@@ -0,0 +1,79 @@
+# core/thumbnails.py
+# -*- coding: utf-8 -*-
+"""
+Thumbnail cho gallery ảnh cảnh: ảnh nhỏ (WebP) tạo 1 lần, UI chỉ gửi thumbnail qua websocket mỗi rerun;
+ảnh gốc chỉ gửi khi người dùng bấm xem.
+- write_thumbnail: ghi thumbnail cạnh ảnh gốc (dùng khi vừa sinh ảnh).
+- thumbnail_for(src): thumbnail của file bất kỳ, cache trong .cache/thumbs theo (đường dẫn, mtime, size, kích thước).
+- ensure_thumbnails(paths): tạo hàng loạt trong thread pool (chỉ file chưa có thumbnail).
+"""
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from PIL import Image
+
+from core.disk_cache import make_key, cache_path, prune
+from core.parallel import iter_parallel
+
+THUMB_NS = "thumbs"
+THUMB_MAX_PX = 320
+THUMB_QUALITY = 80
+THUMB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_THUMB_WORKERS = 4
+
+
+def write_thumbnail(img: Union[Image.Image, Path, str], dst: Path, max_px: int = THUMB_MAX_PX) -> Path:
+    """Thu nhỏ (giữ tỉ lệ) và ghi WebP atomic."""
+    if isinstance(img, Image.Image):
+        th = img.copy()
+    else:
+        with Image.open(img) as src:
+            src.draft("RGB", (max_px, max_px))  # JPEG: giải mã thẳng ở độ phân giải thấp
+            th = src.copy()
+    th.thumbnail((max_px, max_px))
+    if th.mode not in ("RGB", "RGBA"):
+        th = th.convert("RGB")
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    th.save(tmp, "WEBP", quality=THUMB_QUALITY)
+    os.replace(tmp, dst)
+    return dst
+
+
+def _thumb_key(src: Path, max_px: int) -> Optional[str]:
+    try:
+        st = src.stat()
+    except OSError:
+        return None
+    return make_key("thumb-v1", str(src.resolve()), st.st_mtime_ns, st.st_size, max_px)
+
+
+def thumbnail_for(src: Union[Path, str], max_px: int = THUMB_MAX_PX) -> Optional[Path]:
+    """Đường dẫn thumbnail (tạo nếu chưa có / ảnh gốc đã đổi); None nếu không đọc được ảnh."""
+    src = Path(src)
+    key = _thumb_key(src, max_px)
+    if key is None:
+        return None
+    dst = cache_path(THUMB_NS, key, suffix=".webp")
+    if dst.exists():
+        return dst
+    try:
+        write_thumbnail(src, dst, max_px)
+    except Exception:
+        return None
+    return dst
+
+
+def ensure_thumbnails(paths: Iterable[Union[Path, str]], max_px: int = THUMB_MAX_PX,
+                      max_workers: int = DEFAULT_THUMB_WORKERS) -> Dict[str, Optional[Path]]:
+    """Tạo thumbnail song song cho nhiều ảnh; trả về {đường dẫn gốc: thumbnail|None}."""
+    items = list(dict.fromkeys(str(p) for p in paths))
+    out: Dict[str, Optional[Path]] = {}
+    if not items:
+        return out
+    for i, res, err in iter_parallel(lambda p: thumbnail_for(p, max_px), items, max_workers=max_workers):
+        out[items[i]] = None if err is not None else res
+    prune(THUMB_NS, THUMB_CACHE_MAX_BYTES)
+    return out
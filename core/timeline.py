@@ -0,0 +1,185 @@
+# core/timeline.py
+# -*- coding: utf-8 -*-
+"""
+Timeline của tập: gộp FULL_SCRIPT (Narration/Dialogue/Sound Effects/BGM/Transition) và veo31_segments
+vào 1 mô hình track chung, xuất JSON / EDL (CMX3600) cho CapCut, Premiere, Resolve…
+
+  tracks = {"video": [...], "voice": [...], "sfx": [...], "bgm": [...]}
+  clip   = {"track", "kind", "start", "end", "label", "text", "ref"}   (giây, float)
+
+- voice: mỗi hàng lời thoại/dẫn chuyện nối tiếp nhau, độ dài ước lượng theo số âm tiết + ngắt câu.
+- sfx: cue SFX đặt tại vị trí hiện tại (đè lên lời kế tiếp); Transition chiếm 1 khoảng trống riêng.
+- bgm: mỗi hàng BGM mở 1 cue, kéo dài tới cue BGM kế tiếp (hoặc hết tập).
+- video: clip Veo (mặc định 8 giây) xếp liên tiếp theo cảnh, độc lập với track tiếng.
+Dựng trong 1 lượt qua các hàng + segments (tuyến tính theo độ dài script) → dựng lại mỗi lần sửa được.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from core.text_utils import iter_tts_lines, parse_script_table
+
+TRACKS = ("video", "voice", "sfx", "bgm")
+DEFAULT_FPS = 24
+VEO_CLIP_SEC = 8.0
+
+# Tốc độ đọc (âm tiết/giây) theo loại hàng; tiếng Việt 1 từ ≈ 1 âm tiết
+SYLLABLES_PER_SEC = {"narration": 3.2, "dialogue": 3.4, "voice system": 2.9}
+DEFAULT_SYLLABLES_PER_SEC = 3.2
+COMMA_PAUSE_SEC = 0.25
+SENTENCE_PAUSE_SEC = 0.45
+LINE_GAP_SEC = 0.2
+MIN_LINE_SEC = 0.8
+SFX_SEC = 2.0
+SFX_LEAD_SEC = 0.5
+TRANSITION_SEC = 1.0
+
+_COMMA = re.compile(r"[,;:—–]")
+_SENTENCE = re.compile(r"[.!?…]+")
+
+
+def estimate_speech_sec(text: str, syllables_per_sec: float = DEFAULT_SYLLABLES_PER_SEC) -> float:
+    """Ước lượng thời lượng đọc 1 đoạn (giây)."""
+    text = (text or "").strip()
+    if not text:
+        return 0.0
+    words = len(text.split())
+    pauses = len(_COMMA.findall(text)) * COMMA_PAUSE_SEC + len(_SENTENCE.findall(text)) * SENTENCE_PAUSE_SEC
+    return max(MIN_LINE_SEC, words / syllables_per_sec + pauses)
+
+
+def _row_kind(ctype: str) -> str:
+    c = (ctype or "").lower()
+    if "sound effect" in c or c.startswith("sfx"):
+        return "sfx"
+    if "bgm" in c or "nhạc nền" in c:
+        return "bgm"
+    if "transition" in c or "chuyển cảnh" in c:
+        return "transition"
+    if "voice system" in c or "system" in c:
+        return "voice system"
+    if "dialog" in c:
+        return "dialogue"
+    return "narration"
+
+
+def _clip(track: str, kind: str, start: float, end: float, label: str, text: str = "",
+          ref: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {"track": track, "kind": kind, "start": round(start, 3), "end": round(end, 3),
+            "label": label, "text": text, "ref": ref or {}}
+
+
+def _seg_duration(seg: Dict[str, Any]) -> float:
+    try:
+        d = float(seg.get("duration_sec") or VEO_CLIP_SEC)
+    except (TypeError, ValueError):
+        d = VEO_CLIP_SEC
+    return d if d > 0 else VEO_CLIP_SEC
+
+
+def build_timeline(
+    script_text: str,
+    scenes: Optional[List[Dict[str, Any]]] = None,
+    speech_sec: Optional[float] = None,
+    fps: int = DEFAULT_FPS,
+) -> Dict[str, Any]:
+    """
+    Dựng timeline từ bảng FULL_SCRIPT + scenes (veo31_segments).
+    speech_sec: thời lượng thật của file TTS đã render (nếu có) → co giãn track tiếng cho khớp.
+    """
+    tracks: Dict[str, List[Dict[str, Any]]] = {t: [] for t in TRACKS}
+    cursor = 0.0
+    bgm_open: Optional[Dict[str, Any]] = None
+
+    for i, row in enumerate(parse_script_table(script_text or "")):
+        kind = _row_kind(row["ctype"])
+        content = row["content"]
+        ref = {"row": i}
+        if kind == "sfx":
+            tracks["sfx"].append(_clip("sfx", "sfx", cursor, cursor + SFX_SEC, content[:60], content, ref))
+            cursor += SFX_LEAD_SEC
+        elif kind == "transition":
+            tracks["sfx"].append(_clip("sfx", "transition", cursor, cursor + TRANSITION_SEC, content[:60], content, ref))
+            cursor += TRANSITION_SEC
+        elif kind == "bgm":
+            if bgm_open is not None:
+                bgm_open["end"] = round(cursor, 3)
+            bgm_open = _clip("bgm", "bgm", cursor, cursor, content[:60], content, ref)
+            tracks["bgm"].append(bgm_open)
+        else:
+            rate = SYLLABLES_PER_SEC.get(kind, DEFAULT_SYLLABLES_PER_SEC)
+            for ln in iter_tts_lines([content]):
+                dur = estimate_speech_sec(ln["text"], rate)
+                tracks["voice"].append(_clip("voice", kind, cursor, cursor + dur, ln["speaker"], ln["text"], ref))
+                cursor += dur + LINE_GAP_SEC
+
+    audio_end = max(0.0, cursor - LINE_GAP_SEC) if tracks["voice"] else cursor
+    if speech_sec and audio_end > 0:
+        scale = float(speech_sec) / audio_end
+        for t in ("voice", "sfx", "bgm"):
+            for c in tracks[t]:
+                c["start"] = round(c["start"] * scale, 3)
+                c["end"] = round(c["end"] * scale, 3)
+        audio_end = float(speech_sec)
+
+    v = 0.0
+    for si, sc in enumerate(scenes or []):
+        name = sc.get("scene", f"Cảnh {si + 1}")
+        for j, seg in enumerate(sc.get("veo31_segments") or [], 1):
+            dur = _seg_duration(seg)
+            label = f"{name} — {seg.get('title') or f'Clip {j}'}"
+            tracks["video"].append(_clip("video", "veo", v, v + dur, label, seg.get("veo_prompt", ""),
+                                         {"scene": si, "segment": j - 1}))
+            v += dur
+
+    duration = max(audio_end, v)
+    if bgm_open is not None:
+        bgm_open["end"] = round(duration, 3)
+    tracks["bgm"] = [c for c in tracks["bgm"] if c["end"] > c["start"]]
+    return {
+        "fps": int(fps),
+        "duration": round(duration, 3),
+        "audio_sec": round(audio_end, 3),
+        "video_sec": round(v, 3),
+        "drift_sec": round(v - audio_end, 3),  # >0: hình dài hơn tiếng
+        "tracks": tracks,
+    }
+
+
+def build_episode_timeline(ep: Any, speech_sec: Optional[float] = None, fps: int = DEFAULT_FPS) -> Dict[str, Any]:
+    return build_timeline(ep.script_text or "", (ep.assets or {}).get("scenes", []) or [], speech_sec, fps)
+
+
+# ====== Export ======
+
+def timeline_to_json(tl: Dict[str, Any]) -> str:
+    return json.dumps(tl, ensure_ascii=False, indent=2)
+
+
+def _timecode(f: int, fps: int) -> str:
+    return f"{f // (3600 * fps):02d}:{f // (60 * fps) % 60:02d}:{f // fps % 60:02d}:{f % fps:02d}"
+
+
+# track → kênh EDL
+_EDL_CHANNELS = {"video": "V", "voice": "A", "sfx": "A2", "bgm": "A3"}
+
+
+def timeline_to_edl(tl: Dict[str, Any], title: str = "EPISODE") -> str:
+    """EDL CMX3600 (NON-DROP FRAME): mỗi clip 1 event, reel AX, source bắt đầu từ 00:00:00:00."""
+    fps = int(tl.get("fps") or DEFAULT_FPS)
+    lines = [f"TITLE: {title}", "FCM: NON-DROP FRAME", ""]
+    n = 0
+    for track in TRACKS:
+        ch = _EDL_CHANNELS[track]
+        for c in tl["tracks"].get(track, []):
+            n += 1
+            f_in, f_out = round(c["start"] * fps), round(c["end"] * fps)  # làm tròn theo frame 1 lần → src/rec khớp
+            lines.append(
+                f"{n:03d}  AX       {ch:<5} C        "
+                f"{_timecode(0, fps)} {_timecode(f_out - f_in, fps)} {_timecode(f_in, fps)} {_timecode(f_out, fps)}"
+            )
+            lines.append(f"* FROM CLIP NAME: {track.upper()} - {c['label']}".replace("\n", " "))
+            if c.get("text"):
+                lines.append(f"* COMMENT: {c['text'][:120]}".replace("\n", " "))
+            lines.append("")
+    return "\n".join(lines)
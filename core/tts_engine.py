@@ -0,0 +1,264 @@
+# core/tts_engine.py
+# -*- coding: utf-8 -*-
+"""
+Render TTS cho cả tập:
+  tts_text → iter_tts_lines → chunk theo người nói → tổng hợp song song (backend cắm được) → ghép 1 file.
+- Mỗi chunk cache trên đĩa theo (backend, các trường voice backend dùng, text): sửa 1 dòng chỉ tổng hợp lại chunk chứa dòng đó.
+- Ranh giới chunk chọn theo nội dung câu (không dồn theo độ dài từ đầu văn bản) nên sửa 1 chỗ
+  không làm lệch toàn bộ các chunk phía sau.
+- Backend: "gtts" (cần mạng) và "stub" (offline: WAV im lặng theo độ dài chữ, để chạy thử/dry-run).
+"""
+import hashlib
+import io
+import os
+import re
+import shutil
+import wave
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.disk_cache import make_key, cache_get, cache_put, prune
+from core.parallel import iter_parallel, DEFAULT_WORKERS
+from core.text_utils import iter_tts_lines, suggest_styles
+
+CACHE_NS = "tts"
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+CHUNK_MIN_CHARS = 120
+CHUNK_MAX_CHARS = 450
+
+ProgressFn = Callable[[float, str], None]
+
+# ====== Backends: fn(text, voice) -> bytes ======
+
+def _gtts_synthesize(text: str, voice: Dict[str, Any]) -> bytes:
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(text, lang=voice.get("lang", "vi"), tld=voice.get("tld", "com"), slow=bool(voice.get("slow"))).write_to_fp(buf)
+    return buf.getvalue()
+
+
+def _stub_synthesize(text: str, voice: Dict[str, Any], rate: int = 8000) -> bytes:
+    """WAV im lặng ~ 15 ký tự/giây (offline, không phụ thuộc mạng/ffmpeg)."""
+    n = int(rate * max(0.3, len(text) / 15.0))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * n)
+    return buf.getvalue()
+
+
+# tên → (hàm tổng hợp, định dạng file)
+BACKENDS: Dict[str, Tuple[Callable[[str, Dict[str, Any]], bytes], str]] = {
+    "gtts": (_gtts_synthesize, "mp3"),
+    "stub": (_stub_synthesize, "wav"),
+}
+# Trường voice mà backend thực sự dùng → chỉ các trường này vào key cache
+# (VD: gTTS bỏ qua "style" → đổi style không được làm trượt cache). Backend không khai báo: cả dict voice.
+VOICE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "gtts": ("lang", "tld", "slow"),
+    "stub": (),
+}
+
+
+def available_backends() -> List[str]:
+    out = []
+    try:
+        import gtts  # noqa: F401
+        out.append("gtts")
+    except Exception:
+        pass
+    out.append("stub")
+    return out
+
+
+# ====== Voice & chunk ======
+
+def default_voices(speakers: List[str], lang: str = "vi") -> Dict[str, Dict[str, Any]]:
+    """Thiết lập giọng mặc định theo suggest_styles (style chỉ vào key cache với backend có dùng style)."""
+    styles = suggest_styles(speakers)
+    return {sp: {"lang": lang, "tld": "com", "slow": False, "style": styles.get(sp, "")} for sp in speakers}
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…。！？])\s+")
+
+
+def _units(text: str) -> List[str]:
+    """Tách câu; câu quá dài cắt tiếp theo khoảng trắng."""
+    out = []
+    for sent in _SENTENCE_END.split(text):
+        sent = sent.strip()
+        while len(sent) > CHUNK_MAX_CHARS:
+            cut = sent.rfind(" ", 0, CHUNK_MAX_CHARS)
+            cut = cut if cut > 0 else CHUNK_MAX_CHARS
+            out.append(sent[:cut].strip())
+            sent = sent[cut:].strip()
+        if sent:
+            out.append(sent)
+    return out
+
+
+def _is_boundary(unit: str) -> bool:
+    # content-defined: ~1/3 số câu là điểm cắt, chỉ phụ thuộc chính câu đó
+    return hashlib.blake2b(unit.encode("utf-8"), digest_size=2).digest()[0] % 3 == 0
+
+
+def _voice_key(backend: str, voice: Dict[str, Any]) -> Dict[str, Any]:
+    fields = VOICE_FIELDS.get(backend)
+    return dict(voice) if fields is None else {k: voice.get(k) for k in fields}
+
+
+def plan_chunks(tts_text: str, voices: Optional[Dict[str, Dict[str, Any]]] = None,
+                backend: str = "gtts") -> List[Dict[str, Any]]:
+    """
+    Các dòng liên tiếp cùng người nói gộp lại; chunk kết thúc khi đổi người nói, khi đủ dài và gặp
+    câu "điểm cắt", hoặc khi chạm CHUNK_MAX_CHARS.
+    Trả về [{"speaker", "text", "voice", "key"}].
+    """
+    runs: List[Tuple[str, List[str]]] = []
+    for ln in iter_tts_lines(tts_text or ""):
+        sp, units = ln["speaker"], _units(ln["text"])
+        if runs and runs[-1][0] == sp:
+            runs[-1][1].extend(units)
+        else:
+            runs.append((sp, units))
+
+    voices = dict(voices or {})
+    missing = [sp for sp, _ in runs if sp not in voices]
+    voices.update(default_voices(list(dict.fromkeys(missing))))
+
+    chunks: List[Dict[str, Any]] = []
+
+    def emit(sp: str, parts: List[str]) -> None:
+        if not parts:
+            return
+        text = " ".join(parts)
+        v = voices[sp]
+        chunks.append({"speaker": sp, "text": text, "voice": v, "key": make_key("tts-v2", backend, _voice_key(backend, v), text)})
+
+    for sp, units in runs:
+        cur: List[str] = []
+        size = 0
+        for u in units:
+            if cur and size + len(u) + 1 > CHUNK_MAX_CHARS:
+                emit(sp, cur)
+                cur, size = [], 0
+            cur.append(u)
+            size += len(u) + 1
+            if size >= CHUNK_MIN_CHARS and _is_boundary(u):
+                emit(sp, cur)
+                cur, size = [], 0
+        emit(sp, cur)
+    return chunks
+
+
+# ====== Ghép audio ======
+
+def _concat_wav(parts: List[bytes]) -> bytes:
+    out = io.BytesIO()
+    params = None
+    with wave.open(out, "wb") as w:
+        for p in parts:
+            with wave.open(io.BytesIO(p), "rb") as r:
+                if params is None:
+                    params = r.getparams()
+                    w.setparams(params)
+                w.writeframes(r.readframes(r.getnframes()))
+    return out.getvalue()
+
+
+def _concat_audio(parts: List[bytes], fmt: str) -> bytes:
+    if fmt == "wav":
+        return _concat_wav(parts)
+    if shutil.which("ffmpeg") or shutil.which("avconv"):
+        try:
+            from pydub import AudioSegment
+            seg = AudioSegment.empty()
+            for p in parts:
+                seg += AudioSegment.from_file(io.BytesIO(p), format=fmt)
+            buf = io.BytesIO()
+            seg.export(buf, format=fmt)
+            return buf.getvalue()
+        except Exception:
+            pass
+    # MP3 là chuỗi frame độc lập → nối bytes vẫn phát được (fallback khi không có ffmpeg)
+    return b"".join(parts)
+
+
+def audio_duration_sec(path: Path) -> Optional[float]:
+    """Thời lượng file audio đã render (WAV đọc trực tiếp; MP3 cần ffmpeg) hoặc None."""
+    path = Path(path)
+    try:
+        if path.suffix.lower() == ".wav":
+            with wave.open(str(path), "rb") as r:
+                return r.getnframes() / float(r.getframerate())
+        if shutil.which("ffmpeg") or shutil.which("avconv"):
+            from pydub import AudioSegment
+            return len(AudioSegment.from_file(str(path))) / 1000.0
+    except Exception:
+        pass
+    return None
+
+
+# ====== Render ======
+
+def render_tts(
+    tts_text: str,
+    out_base: Path,
+    backend: str = "gtts",
+    voices: Optional[Dict[str, Dict[str, Any]]] = None,
+    max_workers: int = DEFAULT_WORKERS,
+    use_cache: bool = True,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """
+    Render cả tập ra out_base + ".mp3"/".wav" (tuỳ backend).
+    Trả về {"path", "chunks", "synthesized", "cached", "errors": [(i, msg)]}.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"TTS backend không hỗ trợ: {backend}")
+    synth, fmt = BACKENDS[backend]
+    chunks = plan_chunks(tts_text, voices, backend)
+    if not chunks:
+        raise ValueError("TTS trống — không có dòng nào để đọc.")
+
+    audio: List[Optional[bytes]] = [None] * len(chunks)
+    pending: Dict[str, List[int]] = {}  # key → các chunk trùng nội dung (chỉ tổng hợp 1 lần)
+    for i, ch in enumerate(chunks):
+        hit = cache_get(CACHE_NS, ch["key"], suffix=f".{fmt}") if use_cache else None
+        if hit is not None:
+            audio[i] = hit
+        else:
+            pending.setdefault(ch["key"], []).append(i)
+    todo = [ids[0] for ids in pending.values()]
+    n_cached = len(chunks) - sum(len(ids) for ids in pending.values())
+
+    errors: List[Tuple[int, str]] = []
+
+    def _one(i: int) -> bytes:
+        data = synth(chunks[i]["text"], chunks[i]["voice"])
+        cache_put(CACHE_NS, chunks[i]["key"], data, suffix=f".{fmt}")
+        return data
+
+    for k, (j, data, err) in enumerate(iter_parallel(_one, todo, max_workers=max_workers), 1):
+        i = todo[j]
+        if err is not None:
+            errors.append((i, str(err)))
+        else:
+            for same in pending[chunks[i]["key"]]:
+                audio[same] = data
+        if progress:
+            progress(k / len(todo), f"TTS {k}/{len(todo)} chunk mới ({n_cached} lấy từ cache)")
+    if todo:
+        prune(CACHE_NS, CACHE_MAX_BYTES)
+    if errors:
+        return {"path": None, "chunks": len(chunks), "synthesized": len(todo) - len(errors),
+                "cached": n_cached, "errors": sorted(errors)}
+
+    out = Path(f"{out_base}.{fmt}")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(_concat_audio([a for a in audio if a], fmt))
+    os.replace(tmp, out)
+    return {"path": out, "chunks": len(chunks), "synthesized": len(todo), "cached": n_cached, "errors": []}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Đồng bộ project trong session_state với đĩa:
+- __project_sig__ = (file, project_signature) của bản đang mở; sidebar chỉ nạp lại khi chữ ký trên đĩa khác
+  (worker / tiến trình khác vừa ghi). UI tự lưu → save_and_mark() cập nhật chữ ký, không tự nạp lại chính mình.
+- Nạp lại từ đĩa → quên state widget của tập, nếu không giá trị cũ trong session_state sẽ ghi đè dữ liệu mới.
+"""
+import re
+from pathlib import Path
+from typing import Optional
+
+import streamlit as st
+
+from core.data_models import Project
+from core.project_io import load_project, project_signature, save_project
+
+SIG_KEY = "__project_sig__"
+
+# Widget gắn với nội dung tập (key "<loại>_<sidx>_<tập>[_<cảnh>]")
+_EPISODE_WIDGET_KEY = re.compile(r"^(?:(?:script|tts)_(\d+)_(\d+)|(?:scene_name|imgp|sfxp|chars)_(\d+)_(\d+)_\d+)$")
+
+
+def forget_episode_widgets(sidx: Optional[int] = None, ep_idx: Optional[int] = None) -> None:
+    """Xoá state widget của mọi tập (hoặc chỉ tập sidx/ep_idx, 0-based)."""
+    for k in list(st.session_state.keys()):
+        m = _EPISODE_WIDGET_KEY.match(str(k))
+        if not m:
+            continue
+        if sidx is not None:
+            if m.group(1) is not None:
+                s, e = int(m.group(1)), int(m.group(2))
+            else:
+                s, e = int(m.group(3)), int(m.group(4)) - 1  # widget cảnh dùng ep.index (1-based)
+            if (s, e) != (sidx, ep_idx):
+                continue
+        del st.session_state[k]
+
+
+def mark_synced(path: Path) -> None:
+    """Ghi nhận bản trên đĩa của path là bản session đang giữ."""
+    path = Path(path)
+    st.session_state[SIG_KEY] = (path.name, project_signature(path))
+
+
+def is_synced(path: Path) -> bool:
+    path = Path(path)
+    return st.session_state.get(SIG_KEY) == (path.name, project_signature(path))
+
+
+def save_and_mark(proj: Project) -> Path:
+    """save_project + cập nhật chữ ký → rerun sau không nạp lại (và không xoá widget) vì thay đổi của chính UI."""
+    f = save_project(proj)
+    if (st.session_state.get(SIG_KEY) or (None,))[0] in (None, f.name):
+        mark_synced(f)
+    return f
+
+
+def reload_from_disk(path: Path) -> Project:
+    """Nạp lại project (lazy) từ đĩa, quên widget của các tập và cập nhật chữ ký."""
+    proj = load_project(Path(path), lazy=True)
+    st.session_state.project = proj
+    forget_episode_widgets()
+    mark_synced(path)
+    return proj
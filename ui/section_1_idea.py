@@ -2,7 +2,9 @@ import streamlit as st
 from core.data_models import Project, Season
 from core.prompt_builders import build_storyline_prompt
 from core.gemini_helpers import gemini_json, gemini_text
+from core.schemas import STORYLINE_SCHEMA
 from core.presets import PRESETS
+from core import metrics
 try:
     from core.presets import PRESET_ALIASES
 except Exception:
@@ -53,10 +55,11 @@ def render_section_1(model):
 
     # Sinh 5 phương án
     if st.button("✨ Tạo 5 gợi ý cốt truyện", disabled=not bool(model and idea)):
-        with st.spinner("Đang tạo gợi ý..."):
+        with st.spinner("Đang tạo gợi ý..."), metrics.tags(project=proj_name, stage="storyline"):
             preset_text = ", ".join(preset_selected)  # 🔑 luôn truyền chuỗi
             prompt = build_storyline_prompt(idea, preset_text)
-            data = gemini_json(model, prompt)
+            use_cache = st.session_state.get("use_gemini_cache", True)
+            data = gemini_json(model, prompt, use_cache=use_cache, schema=STORYLINE_SCHEMA)
 
             choices = []
             if isinstance(data, list) and data:
@@ -70,7 +73,7 @@ def render_section_1(model):
             else:
                 text_raw = data.get("raw") if isinstance(data, dict) else ""
                 if not text_raw:
-                    text_raw = gemini_text(model, prompt)
+                    text_raw = gemini_text(model, prompt, use_cache=use_cache)
                 # Dùng lại parser bạn đang có:
                 from core.ui_utils import parse_storyline_blocks as _p  # nếu bạn đã tách ra
                 try:
@@ -1,48 +1,13 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
-from core.data_models import Project, Season, Episode
-from core.prompt_builders import build_outline_prompt_season
+from core.data_models import Project, Season
+from core.prompt_builders import build_outline_prompt_season_parts
 from core.gemini_helpers import gemini_json
-from core.project_io import save_project
-
-def _season_recap_text(p: Project) -> str:
-    if not p or not p.seasons:
-        return ""
-    parts = []
-    # recap các mùa trước (không gồm mùa hiện tại)
-    for s in p.seasons[:-1]:
-        arcs = "; ".join([o.get("title", "") for o in s.outline[:3]]) if s.outline else ""
-        parts.append(f"Mùa {s.season_index}: {arcs}")
-    return "\n".join(parts)
-
-def _clean_ep_title(raw_title: str, ep_index: int) -> str:
-    """
-    Chuẩn hoá tiêu đề:
-    - Gỡ mọi tiền tố numbering: 'Tập 1', 'tap 01', 'Ep 3', 'Episode 10'
-      + chấp nhận dấu cách đặc biệt \u00A0, zero-width \u200b
-      + chấp nhận colon ASCII ':' và fullwidth '：'
-      + chấp nhận gạch nối/ascii & unicode: - – — · • .
-    - Trả về phần tiêu đề tinh gọn. Nếu rỗng → 'Tập {ep_index}'.
-    """
-    import re
-    t = (raw_title or "").strip()
-    if not t:
-        return f"Tập {ep_index}"
-
-    # chuẩn hoá khoảng trắng: thay NO-BREAK SPACE/zero-width thành space thường
-    t = t.replace("\u00A0", " ").replace("\u200b", "")
-
-    # 1) Xoá các pattern có dấu câu sau số
-    t = re.sub(
-        r'^\s*(?:t[âa]p|tap|ep(?:isode)?)\s*\d+\s*[:：\-\–\—\.\·•]\s*',
-        '', t, flags=re.IGNORECASE
-    )
-    # 2) Xoá nốt trường hợp chỉ có số mà không dấu câu (ex: "Tập 3  Tiêu đề")
-    t = re.sub(r'^\s*(?:t[âa]p|tap|ep(?:isode)?)\s*\d+\s*', '', t, flags=re.IGNORECASE)
-
-    # dọn đuôi kí tự thừa
-    t = t.strip(" -:：·.•—–").strip()
-    return t or f"Tập {ep_index}"
+from core.schemas import OUTLINE_SCHEMA
+from core.project_io import ensure_season_loaded
+from core.episode_pipeline import _season_recap_text, _clean_ep_title, apply_outline_data, stage_tags
+from core.image_jobs import build_image_jobs_for_season, season_jobs_to_json
+from ui.project_state import save_and_mark
 
 def render_section_2(model):
     st.header("2) Lên dàn bài (Outline) theo số tập — theo Mùa đang chọn")
@@ -70,7 +35,7 @@ def render_section_2(model):
             new_season = Season(season_index=next_idx, episode_count=10, outline=[], episodes=[])
             proj.seasons.append(new_season)
             st.session_state.current_season_idx = len(proj.seasons) - 1
-            save_project(proj)
+            save_and_mark(proj)
             st.success(f"Đã tạo Mùa {next_idx}.")
     with colS3:
         if len(proj.seasons) > 1:
@@ -78,10 +43,11 @@ def render_section_2(model):
                 idx = st.session_state.current_season_idx
                 del proj.seasons[idx]
                 st.session_state.current_season_idx = max(0, idx - 1)
-                save_project(proj)
+                save_and_mark(proj)
                 st.success("Đã xoá Mùa.")
 
     sidx = st.session_state.current_season_idx
+    ensure_season_loaded(proj, sidx)
     cur_season = proj.seasons[sidx]
 
     ep_count = st.number_input(
@@ -90,36 +56,15 @@ def render_section_2(model):
     )
 
     if st.button("🧭 Tạo dàn bài cho Mùa này", disabled=not bool(model), key=f"btn_outline_s{sidx}"):
-        with st.spinner("Đang tạo dàn bài..."):
+        with st.spinner("Đang tạo dàn bài..."), stage_tags(proj, sidx, None, "outline"):
             recap = _season_recap_text(proj) if sidx > 0 else ""
-            prompt = build_outline_prompt_season(proj.chosen_storyline, int(ep_count), recap, preset_name=proj.preset)
-            data = gemini_json(model, prompt)
-
-            outline_list = []
-            if isinstance(data, list):
-                for idx, item in enumerate(data, 1):
-                    raw_title = item.get("title") or ""
-                    title = _clean_ep_title(raw_title, idx)     # << dùng hàm mạnh
-                    beat = item.get("beat") or ""
-                    outline_list.append({"title": title, "beat": beat})
-            else:
-                lines = str(data).splitlines()
-                for i, ln in enumerate(lines, 1):
-                    outline_list.append({"title": f"Tập {i}", "beat": ln})
+            prefix, prompt = build_outline_prompt_season_parts(proj.chosen_storyline, int(ep_count), recap, preset_name=proj.preset)
+            data = gemini_json(model, prompt, use_cache=st.session_state.get("use_gemini_cache", True),
+                               prefix=prefix, cache_owner=proj.name, schema=OUTLINE_SCHEMA)
 
-            cur_season.episode_count = int(ep_count)
-            cur_season.outline = outline_list
-            # tạo Episode list từ outline, title đã clean
-            cur_season.episodes = [
-            Episode(
-                index=i+1,
-                title=_clean_ep_title(o.get("title", f"Tập {i+1}"), i+1),
-                summary=o.get("beat", "")
-            )
-            for i, o in enumerate(outline_list)
-            ]
+            apply_outline_data(cur_season, data, int(ep_count))
             proj.seasons[sidx] = cur_season
-            save_project(proj)
+            save_and_mark(proj)
             st.success(f"Đã tạo dàn bài cho Mùa {cur_season.season_index}.")
 
     if cur_season.outline:
@@ -130,5 +75,16 @@ def render_section_2(model):
             with st.expander(f"Tập {i}: {title_show}"):
                 st.write(row["beat"])
         if st.button("✅ Duyệt dàn bài mùa này", key=f"approve_outline_s{sidx}"):
-            save_project(proj)
+            save_and_mark(proj)
             st.success("Đã duyệt dàn bài cho Mùa hiện tại.")
+
+    if any((ep.assets or {}).get("scenes") for ep in cur_season.episodes):
+        if st.button("🖼️ Dựng image jobs cả Mùa", key=f"season_jobs_s{sidx}"):
+            batches = build_image_jobs_for_season(proj, cur_season)
+            n_jobs = sum(len(b["jobs"]) for b in batches)
+            st.download_button(
+                f"⬇️ image_jobs_season_{cur_season.season_index:02d}.json ({n_jobs} job)",
+                data=season_jobs_to_json(batches),
+                file_name=f"image_jobs_season_{cur_season.season_index:02d}.json",
+                mime="application/json", key=f"season_jobs_dl_s{sidx}",
+            )
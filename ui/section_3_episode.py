@@ -1,18 +1,31 @@
 # -*- coding: utf-8 -*-
-import json
 import re
+
 import streamlit as st
 
 from core.data_models import Project, Episode 
-from core.prompt_builders import build_episode_prompt
-from core.gemini_helpers import gemini_json 
-from core.gemini_image import  gemini25_image_generate
-from core.project_io import save_project
-from core.text_utils import (
-    clean_tts_text, extract_characters, _safe_name, capcut_sfx_name
-)
+from core.prompt_builders import build_episode_prompt_parts
+from core.gemini_helpers import gemini_json, gemini_stream, _parse_json_text
+from core.schemas import EPISODE_SCHEMA
+from core.json_stream import StreamingJsonObject
+from core.gemini_image import DEFAULT_IMAGE_WORKERS, DEFAULT_IMAGE_TIMEOUT_SEC
+from core.media_files import media_abs
+from core.thumbnails import ensure_thumbnails
+from core.text_utils import _safe_name, parse_script_table
 from core.character_bible import ai_generate_character_bible, seed_from_text
-from core.veo31_helpers import build_veo31_segments_prompt
+from core.parallel import iter_parallel, DEFAULT_WORKERS
+from core import job_queue
+from core.project_io import DATA_DIR, ensure_season_loaded, reload_episode
+from core.episode_pipeline import (
+    _normalize_to_table, _gen_veo_for_scene, _keyframe_index, apply_episode_data, iter_keyframe_images,
+    run_tts_stage, find_tts_audio, stage_tags,
+)
+from core.tts_engine import available_backends, audio_duration_sec
+from core.disk_cache import make_key
+from core.memo import content_memo, copy_rows
+from core.profiling import timed
+from core.timeline import build_episode_timeline, timeline_to_json, timeline_to_edl, TRACKS
+from ui.project_state import forget_episode_widgets, reload_from_disk, save_and_mark
 
 # --- Optional TTS deps ---
 try:
@@ -23,153 +36,10 @@ except Exception:
 
 
 # ===================== Helpers =====================
-
-def _normalize_to_table(text: str) -> str:
-    """
-    Chuẩn hoá về bảng 3 cột + tự chèn gợi ý CapCut (FX + BGM) CHO TỪNG HÀNG,
-    kể cả khi input đã là bảng Markdown.
-    Không thêm/xoá hàng; chỉ bổ sung gợi ý vào cột Technical Notes nếu thiếu.
-    """
-    import re
-    from core.text_utils import capcut_sfx_name  # gợi ý FX có sẵn
-
-    if not text:
-        return ""
-
-    # Gợi ý BGM theo loại
-    CAPCUT_BGM_MAP = {
-        "narration":   "CapCut BGM: Calm Piano, Emotional Strings, Ambient Pad, Soft Wind …",
-        "dialogue":    "CapCut BGM: Soft Piano, Gentle Guitar, Light Ambient, Romantic Background …",
-        "voice system":"CapCut BGM: Digital Drone, Synth Pad, Sci-Fi Ambient, Echo Pulse …",
-        "bgm":         "CapCut BGM: Epic Battle, Dark Ambient, Mystery Drone, Cinematic Rise …",
-    }
-    CAPCUT_FX_FALLBACK = "CapCut FX: Whoosh Short, Flash Transition, Riser Hit …"
-
-    def _bgm_hint(ctype_lc: str) -> str:
-        for k, v in CAPCUT_BGM_MAP.items():
-            if k in ctype_lc:
-                return v
-        return ""
-
-    def _augment_notes(ctype: str, notes: str) -> str:
-        """Ghép thêm CapCut FX/BGM nếu notes chưa có."""
-        c_lc = (ctype or "").strip().lower()
-        notes = notes or ""
-        if "capcut" in notes.lower():
-            return notes  # đã có gợi ý, giữ nguyên
-
-        fx_hint = capcut_sfx_name(ctype) or ""
-        if "transition" in c_lc and not fx_hint:
-            fx_hint = CAPCUT_FX_FALLBACK
-        bgm_hint = _bgm_hint(c_lc)
-
-        # Quy tắc: SFX/Transition → ưu tiên FX; Narration/Dialogue/BGM/Voice → BGM
-        extra = fx_hint if any(k in c_lc for k in ["sound effects", "transition"]) else bgm_hint
-        merged = (notes + (" " + extra if extra else "")).strip()
-        return merged
-
-    header_regex = r'^\|\s*Content Type\s*\|\s*Detailed Content\s*\|\s*Technical Notes\s*\|\s*$'
-    has_header = bool(re.search(header_regex, text, flags=re.I | re.M))
-
-    out = ["| Content Type | Detailed Content | Technical Notes |", "|---|---|---|"]
-
-    if has_header:
-        # Parse lại bảng hiện có -> augment notes cho từng hàng
-        for ln in text.splitlines():
-            line = ln.strip()
-            if not line or line.startswith("|---"):
-                continue
-            if re.search(header_regex, line, flags=re.I):
-                continue
-            if not line.startswith("|"):
-                continue
-
-            cols = [c.strip() for c in line.strip("|").split("|")]
-            if len(cols) < 3:
-                continue
-            ctype, content, notes = cols[:3]
-
-            notes2 = _augment_notes(ctype, notes)
-            # Escape '|' để không vỡ bảng
-            content2 = (content or "").replace("|", r"\|")
-            notes2 = (notes2 or "").replace("|", r"\|")
-            out.append(f"| {ctype} | {content2} | {notes2} |")
-        return "\n".join(out)
-
-    # Input chưa là bảng → chuyển từng dòng + bơm gợi ý
-    rows = []
-    for raw in text.splitlines():
-        s = raw.strip()
-        if not s:
-            continue
-        ctype, content, notes = "Narration", s, ""
-        low = s.lower()
-
-        if low.startswith("narration:"):
-            ctype, content = "Narration", s.split(":", 1)[1].strip()
-        elif low.startswith("dialogue:") or low.startswith("dialog:"):
-            ctype, content = "Dialogue", s.split(":", 1)[1].strip()
-        elif low.startswith("voice system:") or low.startswith("system:"):
-            ctype, content = "Voice System", s.split(":", 1)[1].strip()
-        elif low.startswith("sfx:") or s.startswith("[SFX]"):
-            ctype = "Sound Effects"
-            content = s.split("]", 1)[1].strip() if s.startswith("[SFX]") and "]" in s else s.split(":", 1)[1].strip()
-        elif low.startswith("bgm:"):
-            ctype, content = "BGM", s.split(":", 1)[1].strip()
-        elif low.startswith("transition:"):
-            ctype, content = "Transition", s.split(":", 1)[1].strip()
-
-        notes2 = _augment_notes(ctype, notes)
-        rows.append((ctype, content, notes2))
-
-    for ctype, content, notes in rows:
-        out.append(f"| {ctype} | {str(content).replace('|', r'\\|')} | {str(notes).replace('|', r'\\|')} |")
-
-    return "\n".join(out)
-
-
-def _assets_list_from_json(data: dict) -> list:
-    """
-    Lấy list scene từ JSON trả về của model (FULL/ASSETS/TTS).
-    """
-    scenes = []
-    try:
-        raw = data.get("ASSETS") or data.get("assets") or []
-        if isinstance(raw, list):
-            for it in raw:
-                scenes.append({
-                    "scene": (it.get("scene") or "").strip(),
-                    "image_prompt": (it.get("image_prompt") or "").strip(),
-                    "sfx_prompt": (it.get("sfx_prompt") or "").strip(),
-                    "characters": it.get("characters", []),
-                })
-    except Exception:
-        pass
-    return scenes
-
+# (chuẩn hoá bảng, ASSETS, keyframes & Veo nằm ở core.episode_pipeline)
 
 # --------- Scene suggestion from Narration (auto-split) ---------
 
-def _parse_markdown_script_table(md: str):
-    """Trả về list hàng: [{'ctype','content','notes'}] từ bảng 3 cột."""
-    if not md:
-        return []
-    rows = []
-    for line in md.splitlines():
-        line = line.strip()
-        if not line.startswith("|") or "|---" in line:
-            continue
-        parts = [p.strip() for p in line.strip("|").split("|")]
-        if len(parts) < 3:
-            continue
-        c0, c1, c2 = parts[:3]
-        # bỏ header
-        header = c0.lower()
-        if "content type" in header:
-            continue
-        rows.append({"ctype": c0.strip(), "content": c1.strip(), "notes": c2.strip()})
-    return rows
-
 _VI_LOCATION_HINTS = [
     r"\bTông\b", r"\bTộc\b", r"\bTông Môn\b", r"\bTông môn\b", r"\bMôn phái\b",
     r"\bTrường\b", r"\bDiễn Võ Trường\b", r"\bSảnh\b", r"\bĐiện\b", r"\bThành\b",
@@ -243,9 +113,11 @@ def _expand_narration_to_scenes(n_text: str):
         scenes.append({"scene": "Narration — minh hoạ", "image_prompt": text, "sfx_prompt": "", "characters": []})
     return scenes
 
+@timed("section_3.suggest_scenes_from_script")
+@content_memo(maxsize=32, key=lambda ep: make_key(ep.script_text or ""), copy=copy_rows)
 def _suggest_scenes_from_script(ep: Episode):
     """Đọc bảng 3 cột; mỗi Narration -> 2-3 scene đề xuất, không ghi đè."""
-    rows = _parse_markdown_script_table(ep.script_text or "")
+    rows = parse_script_table(ep.script_text or "")
     suggestions = []
     for r in rows:
         if r["ctype"].lower().startswith("narration"):
@@ -269,18 +141,21 @@ def _render_character_bible_block(model, proj: Project, ep: Episode, sidx: int,
 
     with colA:
         if st.button("🪄 Tạo Character Bible (AI)", key=f"cb_ai_{sidx}_{ep_idx}", disabled=not bool(model)):
-            with st.spinner("Đang tạo Character Bible..."):
+            with st.spinner("Đang tạo Character Bible..."), stage_tags(proj, sidx, None, "character_bible"):
                 cb = ai_generate_character_bible(
                     model,
                     project_name=proj.name,
                     idea=proj.idea,
                     chosen_storyline=proj.chosen_storyline,
                     outline=proj.seasons[sidx].outline,
-                    max_chars=8
+                    max_chars=8,
+                    use_cache=st.session_state.get("use_gemini_cache", True),
+                    preset_name=proj.preset,
+                    cache_owner=proj.name,
                 )
                 if cb and isinstance(cb, dict):
                     proj.character_bible = cb
-                    save_project(proj)
+                    save_and_mark(proj)
                     st.success("Đã tạo Character Bible.")
 
     with colB:
@@ -288,12 +163,12 @@ def _render_character_bible_block(model, proj: Project, ep: Episode, sidx: int,
             base_cb = proj.character_bible or {"characters": []}
             merged = seed_from_text(base_cb, (ep.script_text or "") + "\n" + (ep.tts_text or ""))
             proj.character_bible = merged
-            save_project(proj)
+            save_and_mark(proj)
             st.success("Đã seed thêm tên nhân vật từ script/TTS.")
 
     with colC:
         if st.button("💾 Lưu Character Bible", key=f"cb_save_{sidx}_{ep_idx}"):
-            save_project(proj)
+            save_and_mark(proj)
             st.success("Đã lưu Character Bible.")
 
     # Bảng chỉnh nhanh
@@ -315,181 +190,173 @@ def _render_character_bible_block(model, proj: Project, ep: Episode, sidx: int,
             c["notes"] = st.text_area("Notes", value=c.get("notes",""), key=f"cb_notes_{sidx}_{ep_idx}_{i}")
             chars[i-1] = c
     proj.character_bible["characters"] = chars
-# --------- Veo3 helpers ---------
 
-def _gen_veo_for_scene(model, proj: Project, ep: Episode, sc: dict, max_segments: int = 3) -> dict:
+
+def _apply_finished_jobs(proj: Project, jobs) -> None:
+    """Job vừa xong (chưa thấy ở rerun trước) → nạp lại tập đó từ đĩa; lần đầu chỉ ghi nhận."""
+    seen_key = f"__jobs_seen_{proj.name}__"
+    done = {j["id"]: j["updated_at"] for j in jobs if j["status"] == job_queue.STATUS_DONE}
+    seen = st.session_state.get(seen_key)
+    st.session_state[seen_key] = done
+    if seen is None:
+        return
+    fresh = [j for j in jobs if j["id"] in done and seen.get(j["id"]) != done[j["id"]]]
+    for j in fresh:
+        if j["stage"] == "character_bible":
+            continue  # Bible nằm ở file index → sidebar tự nạp lại theo chữ ký
+        if reload_episode(proj, j["season"], j["episode"]):
+            forget_episode_widgets(j["season"], j["episode"])
+
+
+def _render_job_queue_block(model, proj: Project, sidx: int, ep_idx: int):
     """
-    Gọi Gemini để sinh segments Veo 3.1 từ scene.
-    Mỗi segment tương ứng với 1 frame/keyframe chi tiết, có prompt đồng bộ hình ảnh.
+    Khối UI hàng đợi nền: enqueue các bước cho tập/mùa hiện tại, xem tiến độ, huỷ job.
+    Worker chạy riêng:  python -m core.job_queue --workers 2
     """
-    sc_name = sc.get("scene", "Cảnh")
-    scene_text = sc.get("image_prompt", "") or sc.get("sfx_prompt", "") or ep.summary
-    char_in_scene = sc.get("characters", [])
-
-    # 1️⃣ Tách keyframes tương ứng scene
-    try:
-        txt_block, frame_list = _compose_scene_image_prompts(proj, ep)
-        # chỉ lấy frames thuộc scene hiện tại
-        frames = [f for f in frame_list if f["scene"] == sc_name]
-    except Exception:
-        frames = []
-
-    # 2️⃣ Nếu không có frame riêng, fallback 1 frame duy nhất
-    if not frames:
-        frames = [{
-            "scene": sc_name,
-            "frame": 1,
-            "frame_name": f"{sc_name} — Frame 1",
-            "characters": char_in_scene,
-            "image_prompt": _styleize_image_prompt(
-                base=scene_text,
-                aspect_ratio=proj.aspect_ratio,
-                donghua_style=proj.donghua_style,
-                characters=char_in_scene,
-                character_bible=proj.character_bible or {}
+    st.caption("Job chạy trong worker nền (`python -m core.job_queue --workers 2`), không bị huỷ khi rerun/đổi tab.")
+    params = {
+        "model_name": getattr(model, "model_name", "") if model else "",
+        "use_cache": st.session_state.get("use_gemini_cache", True),
+        "use_tts_cache": st.session_state.get("use_tts_cache", True),
+    }
+    force = st.checkbox("Chạy lại cả job đã xong", value=False, key=f"jq_force_{sidx}_{ep_idx}")
+    colQ1, colQ2, colQ3, colQ4 = st.columns(4)
+    with colQ1:
+        if st.button("📝 Xếp hàng: kịch bản tập này", key=f"jq_ep_{sidx}_{ep_idx}"):
+            job_queue.enqueue(proj.name, sidx, ep_idx, "episode", params, force=force)
+    with colQ2:
+        if st.button("🎬 Xếp hàng: Veo tập này", key=f"jq_veo_{sidx}_{ep_idx}"):
+            job_queue.enqueue(proj.name, sidx, ep_idx, "veo", params, force=force)
+        if st.button("🖼️ Xếp hàng: ảnh keyframe tập này", key=f"jq_img_{sidx}_{ep_idx}"):
+            job_queue.enqueue(proj.name, sidx, ep_idx, "images", params, force=force)
+    with colQ3:
+        if st.button("📚 Xếp hàng: kịch bản + Veo cả Mùa", key=f"jq_season_{sidx}"):
+            for i in range(len(proj.seasons[sidx].episodes)):
+                job_queue.enqueue(proj.name, sidx, i, "episode", params, force=force)
+                job_queue.enqueue(proj.name, sidx, i, "veo", params, force=force)
+    with colQ4:
+        if st.button("🔄 Tải lại project từ đĩa", key=f"jq_reload_{sidx}_{ep_idx}"):
+            reload_from_disk(DATA_DIR / f"{_safe_name(proj.name)}.json")
+            st.rerun()  # phần còn lại của lượt này vẫn cầm object project cũ → vẽ lại từ bản vừa nạp
+
+    jobs = job_queue.list_jobs(proj.name, limit=50)
+    _apply_finished_jobs(proj, jobs)
+    if not jobs:
+        st.caption("Chưa có job nào cho project này.")
+        return
+    for j in jobs:
+        colJ1, colJ2 = st.columns([5, 1])
+        with colJ1:
+            st.progress(
+                min(max(float(j["progress"] or 0), 0.0), 1.0),
+                text=f"#{j['id']} · Mùa {j['season'] + 1} · Tập {j['episode'] + 1} · {j['stage']} · "
+                     f"{j['status']} — {(j['message'] or '').splitlines()[0] if j['message'] else ''}",
             )
-        }]
-
-    # 3️⃣ Sinh prompt tổng cho Veo (mô tả cách chia segment theo frame)
-    veo_header_prompt = f"""
-Bạn là đạo diễn tiền kỳ Veo 3.1.
-Phân tích cảnh: **{sc_name}**
-Từ các frame key sau, hãy tạo segments video liền mạch (mỗi frame = 1 segment ~8 giây).
-Mỗi segment phải mô tả:
-- hành động / biểu cảm nhân vật
-- chuyển động camera
-- ánh sáng, âm thanh / ambience
-- continuity giữa frame trước & sau
-- phong cách: donghua, 24fps cinematic
-
-Danh sách keyframe:
-{json.dumps([f["image_prompt"] for f in frames], ensure_ascii=False, indent=2)}
-
-Trả về JSON duy nhất:
-{{
-  "scene": "{sc_name}",
-  "segments": [
-    {{
-      "title": "ngắn gọn 3–7 từ",
-      "duration_sec": 8,
-      "characters": ["Tên A","Tên B"],
-      "veo_prompt": "mô tả shot chi tiết theo frame này, continuity, 24fps, {proj.aspect_ratio}",
-      "sfx": "ambience/SFX gợi ý",
-      "notes": "continuity / camera / ánh sáng"
-    }}
-  ]
-}}
-    """.strip()
-
-    # 4️⃣ Gọi Gemini model
-    try:
-        veo_result = gemini_json(model, veo_header_prompt)
-    except Exception as e:
-        sc["veo_error"] = str(e)
-        veo_result = None
-
-    # 5️⃣ Lưu kết quả vào scene
-    sc["veo_prompt"] = veo_header_prompt
-    if isinstance(veo_result, dict) and isinstance(veo_result.get("segments"), list):
-        sc["veo31_segments"] = veo_result["segments"]
-    else:
-        sc["veo31_segments"] = []
-        sc["veo_raw_response"] = veo_result
-
-    return sc
-
-
-# ====== build image prompts per scene (anchor frames) ======
-
-def _styleize_image_prompt(base: str, aspect_ratio: str, donghua_style: bool, characters: list, character_bible: dict) -> str:
-    """Hợp nhất image_prompt + style + nhân vật để render frame/ảnh neo (anchor) cho đồng bộ video."""
-    base = (base or "").strip()
-    char_descriptors = []
-    if character_bible and character_bible.get("characters"):
-        by_name = {c.get("name"): c for c in character_bible["characters"] if c.get("name")}
-        for n in characters or []:
-            c = by_name.get(n)
-            if not c:
-                continue
-            piece = f"{c.get('name')}: {c.get('look','')}; hair {c.get('hair','')}; outfit {c.get('outfit','')}; colors {c.get('color_theme','')}"
-            char_descriptors.append(piece)
-
-    style = (
-        "cel-shaded, clean lineart, Chinese donghua stylization, Asian facial features, "
-        "natural black/dark hair unless specified, soft skin rendering, rich fabric texture, "
-        "avoid photorealism, avoid western/European facial structure"
-        if donghua_style else
-        "cinematic stylized look, avoid hyper-realistic faces"
-    )
-    neg = "low quality, blurry, extra fingers, deformed hands, photorealistic, western/European facial structure"
-
-    ar = aspect_ratio or "16:9"
-    char_block = (" | ".join(char_descriptors)).strip()
-    if char_block:
-        char_block = f"Characters: {char_block}. "
-
-    return (
-        f"{char_block}{base}. "
-        f"Style: {style}. "
-        f"Shot: keyframe still for video sync; aspect ratio {ar}; 24fps context. "
-        f"Negative: {neg}."
-    )
-
-def _compose_scene_image_prompts(proj: Project, ep: Episode):
+        with colJ2:
+            if j["status"] in job_queue.ACTIVE_STATUSES:
+                if st.button("✖ Huỷ", key=f"jq_cancel_{j['id']}"):
+                    job_queue.cancel(j["id"])
+
+
+def _render_scene_gallery(ep, sidx: int, ep_idx: int):
     """
-    Sinh danh sách prompt ảnh chi tiết (keyframes) từ 1 scene:
-    - Mỗi Narration / Sound Effects → 1 frame riêng.
-    - Bảo toàn characters + phong cách.
+    Ảnh đã lưu của từng cảnh: mỗi rerun chỉ gửi thumbnail; ảnh gốc chỉ hiển thị khi bấm 🔍.
+    Thumbnail thiếu (ảnh cũ / file chép vào) được tạo bù song song và cache trên đĩa.
     """
-    scenes = (ep.assets or {}).get("scenes", []) or []
-    out_lines, out_json = [], []
-    for i, sc in enumerate(scenes, 1):
-        name = sc.get("scene", f"Cảnh {i}")
-        base_text = sc.get("image_prompt", "") or sc.get("sfx_prompt", "") or ep.summary
-        chars = sc.get("characters", [])
-
-        # Lấy nội dung script tương ứng scene này để chia nhỏ frame
-        raw_script = (ep.script_text or "")
-        # tìm các dòng chứa từ khóa trong tên scene
-        sublines = []
-        for ln in raw_script.splitlines():
-            if not ln.strip().startswith("|"):
-                continue
-            if any(k in ln for k in [name.split()[0], "Narration", "Sound Effects"]):
-                sublines.append(ln)
-        # nếu không có -> 1 frame
-        if not sublines:
-            sublines = [base_text]
-
-        for j, ln in enumerate(sublines, 1):
-            desc = ln
-            if "|" in ln:
-                parts = [p.strip() for p in ln.strip("|").split("|")]
-                if len(parts) >= 2:
-                    desc = parts[1]
-            # hợp nhất style + char
-            full_prompt = _styleize_image_prompt(
-                base=desc,
-                aspect_ratio=proj.aspect_ratio,
-                donghua_style=proj.donghua_style,
-                characters=chars,
-                character_bible=proj.character_bible or {}
-            )
-            frame_name = f"{name} — Frame {j}"
-            out_lines.append(
-                f"### Scene {i}: {frame_name}\n"
-                f"- Characters: {', '.join(chars) if chars else '(none)'}\n"
-                f"- Image Prompt:\n{full_prompt}\n"
-            )
-            out_json.append({
-                "scene_index": i,
-                "scene": name,
-                "frame": j,
-                "frame_name": frame_name,
-                "characters": chars,
-                "image_prompt": full_prompt
-            })
-    return ("\n".join(out_lines)).strip(), out_json
+    scenes = [sc for sc in (ep.assets or {}).get("scenes", []) or [] if sc.get("images")]
+    if not scenes:
+        return
+    full_key = f"__fullres_{sidx}_{ep_idx}__"
+    with st.expander(f"🖼️ Ảnh đã lưu ({sum(len(sc['images']) for sc in scenes)})", expanded=False):
+        def _thumb(e):
+            return media_abs(e["thumb"]) if e.get("thumb") and media_abs(e["thumb"]).is_file() else None
+
+        missing = [media_abs(e["path"]) for sc in scenes for e in sc["images"] if e.get("path") and _thumb(e) is None]
+        backfill = ensure_thumbnails(missing) if missing else {}
+
+        full = st.session_state.get(full_key)
+        if full and media_abs(full).is_file():
+            st.image(str(media_abs(full)), caption=full, use_column_width=True)
+            if st.button("✖ Đóng ảnh gốc", key=f"{full_key}close"):
+                st.session_state.pop(full_key, None)
+                st.rerun()
+
+        for si, sc in enumerate(scenes):
+            st.markdown(f"**{sc.get('scene', '')}**")
+            cols = st.columns(4)
+            for n, e in enumerate(sc["images"]):
+                src = media_abs(e.get("path", ""))
+                if not src.is_file():
+                    continue
+                thumb = _thumb(e) or backfill.get(str(src))
+                with cols[n % 4]:
+                    cap = e.get("frame_name") or f"Frame {e.get('frame')}"
+                    if thumb:
+                        st.image(str(thumb), caption=cap)
+                    else:
+                        st.caption(cap)
+                    if st.button("🔍", key=f"{full_key}{si}_{n}", help="Xem ảnh gốc"):
+                        st.session_state[full_key] = e["path"]
+                        st.rerun()
+
+
+def _render_timeline_block(proj: Project, ep: Episode, sidx: int, ep_idx: int):
+    """Timeline voice/SFX/BGM/Veo của tập + tải JSON/EDL."""
+    audio = find_tts_audio(proj, sidx, ep_idx)
+    speech_sec = audio_duration_sec(audio) if audio else None
+    tl = build_episode_timeline(ep, speech_sec=speech_sec)
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Tổng thời lượng", f"{tl['duration']:.1f}s")
+    c2.metric("Tiếng" + (" (theo file TTS)" if speech_sec else " (ước lượng)"), f"{tl['audio_sec']:.1f}s")
+    c3.metric("Hình (Veo)", f"{tl['video_sec']:.1f}s", delta=f"{tl['drift_sec']:+.1f}s", delta_color="off")
+    rows = [
+        {"track": c["track"], "loại": c["kind"], "bắt đầu": c["start"], "kết thúc": c["end"],
+         "nhãn": c["label"], "nội dung": c["text"][:80]}
+        for t in TRACKS for c in tl["tracks"][t]
+    ]
+    if not rows:
+        st.info("Chưa có FULL_SCRIPT hoặc segments Veo để dựng timeline.")
+        return
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    name = f"S{proj.seasons[sidx].season_index:02d}E{ep.index:02d}"
+    d1, d2 = st.columns(2)
+    d1.download_button("⬇️ timeline.json", data=timeline_to_json(tl), file_name=f"{name}_timeline.json",
+                       mime="application/json", key=f"tl_json_{sidx}_{ep_idx}")
+    d2.download_button("⬇️ timeline.edl", data=timeline_to_edl(tl, name), file_name=f"{name}.edl",
+                       mime="text/plain", key=f"tl_edl_{sidx}_{ep_idx}")
+
+
+def _stream_episode_json(model, prompt: str, use_cache: bool = True, prefix: str = "", cache_owner=None):
+    """
+    Sinh FULL/ASSETS/TTS dạng streaming: bảng script hiện dần, scene ASSETS hiện ngay khi
+    mỗi object hoàn tất. Trả về dict như gemini_json.
+    """
+    parser = StreamingJsonObject()
+    script_box = st.empty()
+    assets_box = st.empty()
+    tts_box = st.empty()
+    n_assets = -1
+    with st.spinner("Đang sinh kịch bản tập (streaming)..."):
+        for piece in gemini_stream(model, prompt, json_mode=True, use_cache=use_cache,
+                                   prefix=prefix, cache_owner=cache_owner, schema=EPISODE_SCHEMA):
+            parser.feed(piece)
+            script = parser.get("FULL_SCRIPT") or parser.get("full_script") or ""
+            if script:
+                script_box.markdown(script)
+            assets = parser.get("ASSETS") or parser.get("assets") or []
+            if isinstance(assets, list) and len(assets) != n_assets:
+                n_assets = len(assets)
+                names = ", ".join((a.get("scene") or "?") for a in assets if isinstance(a, dict))
+                assets_box.caption(f"🎬 ASSETS: {n_assets} cảnh — {names}")
+            tts = parser.get("TTS") or parser.get("tts") or ""
+            if tts:
+                tts_box.caption(f"🗣️ TTS: {len(tts)} ký tự…")
+    script_box.empty()
+    assets_box.empty()
+    tts_box.empty()
+    if parser.done:
+        return parser.result()
+    return _parse_json_text(parser.text)
 
 
 # ===================== Main UI =====================
@@ -506,6 +373,7 @@ def render_section_3(model, use_tts: bool):
         return
 
     sidx = st.session_state.get("current_season_idx", 0)
+    ensure_season_loaded(proj, sidx)
     cur_season = proj.seasons[sidx]
 
     st.subheader("Chọn tập")
@@ -521,42 +389,22 @@ def render_section_3(model, use_tts: bool):
     # ===== Sinh FULL/ASSETS/TTS =====
     col1, col2 = st.columns(2)
     with col1:
+        use_stream = st.toggle("Streaming (hiện kịch bản dần khi đang sinh)", value=True, key=f"stream_ep_s{sidx}_{ep_idx}")
         if st.button("✍️ Sinh nội dung tập (FULL/ASSETS/TTS)", disabled=not bool(model), key=f"write_ep_s{sidx}_{ep_idx}"):
-            with st.spinner("Đang sinh kịch bản tập..."):
-                prompt = build_episode_prompt(proj.chosen_storyline, ep.title, ep.summary, preset_name=proj.preset)
-                data = gemini_json(model, prompt)
-
-            if isinstance(data, dict):
-                full_script = data.get("FULL_SCRIPT") or data.get("full_script") or ""
-                assets_list = _assets_list_from_json(data)
-                tts_text = data.get("TTS") or data.get("tts") or ""
-
-                full_script = _normalize_to_table(full_script)
-                ep.script_text = full_script
-                ep.assets = {"scenes": assets_list}
-                ep.tts_text = clean_tts_text(tts_text)
-
-                # Seed nhân vật vào Character Bible
-                try:
-                    char_from_script = extract_characters(ep.script_text)
-                    char_from_tts = extract_characters(ep.tts_text or "")
-                    char_names_all = sorted(set(char_from_script) | set(char_from_tts))
-                    if char_names_all:
-                        proj.character_bible = proj.character_bible or {"characters": []}
-                        existing = {c.get("name") for c in proj.character_bible.get("characters", [])}
-                        for n in char_names_all:
-                            if n and n not in existing:
-                                proj.character_bible.setdefault("characters", []).append({
-                                    "name": n, "role": "", "age": "",
-                                    "look": "gương mặt Á Đông; tránh nét siêu thực Tây phương",
-                                    "hair": "", "outfit": "", "color_theme": "", "notes": "donghua/cel-shaded"
-                                })
-                except Exception:
-                    pass
+            prefix, prompt = build_episode_prompt_parts(proj.chosen_storyline, ep.title, ep.summary, preset_name=proj.preset)
+            use_cache = st.session_state.get("use_gemini_cache", True)
+            with stage_tags(proj, sidx, ep_idx, "episode"):
+                if use_stream:
+                    data = _stream_episode_json(model, prompt, use_cache=use_cache, prefix=prefix, cache_owner=proj.name)
+                else:
+                    with st.spinner("Đang sinh kịch bản tập..."):
+                        data = gemini_json(model, prompt, use_cache=use_cache, prefix=prefix, cache_owner=proj.name,
+                                           schema=EPISODE_SCHEMA)
 
+            if apply_episode_data(proj, ep, data):
                 cur_season.episodes[ep_idx] = ep
                 proj.seasons[sidx] = cur_season
-                save_project(proj)
+                save_and_mark(proj)
                 st.success("Đã sinh kịch bản & lưu vào project.")
             else:
                 st.error("AI trả về dữ liệu không đúng định dạng JSON.")
@@ -565,11 +413,14 @@ def render_section_3(model, use_tts: bool):
         if st.button("💾 Lưu lại thay đổi hiện tại", key=f"save_ep_s{sidx}_{ep_idx}"):
             cur_season.episodes[ep_idx] = ep
             proj.seasons[sidx] = cur_season
-            save_project(proj)
+            save_and_mark(proj)
             st.success("Đã lưu.")
 
     # ===== Tabs =====
-    tabs = st.tabs(["📖 Truyện", "🖼️🎚️ Prompts & Veo 3.1", "🗣️ TTS & MP3", "📚 Character Bible"])
+    with st.expander("🗂️ Hàng đợi chạy nền", expanded=False):
+        _render_job_queue_block(model, proj, sidx, ep_idx)
+
+    tabs = st.tabs(["📖 Truyện", "🖼️🎚️ Prompts & Veo 3.1", "🗣️ TTS & MP3", "📚 Character Bible", "🎞️ Timeline"])
 
     # ---- Tab 1: Script
     with tabs[0]:
@@ -585,12 +436,12 @@ def render_section_3(model, use_tts: bool):
         if st.button("🧹 Chuẩn hoá bảng 3 cột", key=f"normalize_{sidx}_{ep_idx}"):
             ep.script_text = _normalize_to_table(ep.script_text)
             st.session_state.project.seasons[sidx].episodes[ep_idx] = ep
-            save_project(st.session_state.project)
+            save_and_mark(st.session_state.project)
             st.success("Đã chuẩn hoá bảng 3 cột.")
         if st.button("➕ Bơm nhanh SFX/BGM/Transition vào bảng"):
             ep.script_text = _normalize_to_table(ep.script_text or "")
             st.session_state.project.seasons[sidx].episodes[ep_idx] = ep
-            save_project(st.session_state.project)
+            save_and_mark(st.session_state.project)
             st.success("Đã kiểm tra và chèn SFX/BGM/Transition (nếu thiếu).")
     # ---- Tab 2: Assets + Veo 3.1 + Image Prompts + Scene Suggestion
     with tabs[1]:
@@ -615,7 +466,7 @@ def render_section_3(model, use_tts: bool):
         if st.button("💾 Lưu thay đổi Scenes", key=f"save_scenes_{sidx}_{ep_idx}"):
             ep.assets = {"scenes": scenes}
             st.session_state.project.seasons[sidx].episodes[ep_idx] = ep
-            save_project(st.session_state.project)
+            save_and_mark(st.session_state.project)
             st.success("Đã lưu Scenes.")
 
         # ====== Gợi ý SCENES từ Narration (tự phân rã 1 Narration -> 2~3 cảnh)
@@ -651,7 +502,7 @@ def render_section_3(model, use_tts: bool):
                         merged.append(sc)
                     ep.assets = {"scenes": merged}
                     st.session_state.project.seasons[sidx].episodes[ep_idx] = ep
-                    save_project(st.session_state.project)
+                    save_and_mark(st.session_state.project)
                     st.success(f"Đã thêm {len(suggested)} cảnh vào Scenes.")
 
         with st.expander("👀 Xem trước cảnh đề xuất từ Narration"):
@@ -668,7 +519,8 @@ def render_section_3(model, use_tts: bool):
         # ===== NEW: Xuất prompt Ảnh theo cảnh (anchor frames)
         st.markdown("----")
         st.subheader("📸 Xuất prompt Ảnh theo Cảnh (anchor frames)")
-        txt_block, json_block = _compose_scene_image_prompts(proj, ep)
+        kf_index = _keyframe_index(proj, ep)
+        txt_block, json_block = kf_index["text"], kf_index["frames"]
         colP1, colP2 = st.columns(2)
         with colP1:
             st.caption("Shotlist & Image Prompts (Text)")
@@ -680,7 +532,7 @@ def render_section_3(model, use_tts: bool):
         st.markdown("----")
         st.subheader("🧠 Tạo hình ảnh từng cảnh (Gemini 2.5)")
 
-        colI1, colI2 = st.columns([1, 1])
+        colI1, colI2, colI3 = st.columns([1, 1, 1])
         with colI1:
             img_model = st.selectbox(
                 "Model ảnh",
@@ -690,23 +542,33 @@ def render_section_3(model, use_tts: bool):
             )
         with colI2:
             img_size = st.selectbox("Kích thước gợi ý", ["1024x576", "1280x720", "1024x1024", "720x1280"], index=0)
+        with colI3:
+            img_workers = st.number_input("Số ảnh song song", min_value=1, max_value=16, value=DEFAULT_IMAGE_WORKERS, step=1, key=f"img_workers_{sidx}_{ep_idx}")
+            img_timeout = st.number_input("Timeout mỗi ảnh (giây)", min_value=10, max_value=600, value=DEFAULT_IMAGE_TIMEOUT_SEC, step=10, key=f"img_timeout_{sidx}_{ep_idx}")
 
         if st.button("🪄 Tạo ảnh cho toàn bộ cảnh (Gemini 2.5)"):
-            txt_block, json_block = _compose_scene_image_prompts(proj, ep)
-            images = []
-            for sc in json_block:
-                with st.spinner(f"Đang tạo ảnh: {sc['scene']} …"):
-                    img, msg = gemini25_image_generate(sc["image_prompt"], model_name=img_model, size_hint=img_size)
-                    if img is not None:
-                        st.image(img, caption=sc["scene"], use_column_width=True)
-                        images.append({"scene": sc["scene"], "image": img})
+            n_frames = len(_keyframe_index(proj, ep)["frames"])
+            n_ok = 0
+            progress = st.progress(0.0, text=f"0/{n_frames} ảnh")
+            with st.spinner(f"Đang tạo {n_frames} ảnh …"):
+                # ảnh ghi thẳng ra media dir; UI chỉ hiển thị thumbnail, không giữ PIL trong session_state
+                for k, total, fr, entry, msg in iter_keyframe_images(
+                    proj, sidx, ep_idx, model_name=img_model, size_hint=img_size,
+                    max_workers=int(img_workers), timeout_sec=float(img_timeout),
+                    use_cache=st.session_state.get("use_gemini_cache", True),
+                ):
+                    if entry is not None:
+                        n_ok += 1
+                        cap = fr["frame_name"] + (" · từ kho ảnh" if msg == "cache" else "")
+                        st.image(str(media_abs(entry["thumb"])), caption=cap)
                     else:
-                        st.warning(f"{sc['scene']}: {msg}")
-            st.session_state["__gemini_images__"] = images
-            if images:
-                st.success(f"Đã tạo {len(images)} ảnh bằng {img_model}.")
-
+                        st.warning(f"{fr['frame_name']}: {msg}")
+                    progress.progress(k / total, text=f"{k}/{total} ảnh")
+            if n_ok:
+                save_and_mark(proj)
+                st.success(f"Đã tạo {n_ok} ảnh bằng {img_model} — lưu trong thư mục media của tập.")
 
+        _render_scene_gallery(ep, sidx, ep_idx)
 
         # ===== Veo 3.1 (tạo segments) — dùng form + state để tránh "ẩn mất"
         st.markdown("---")
@@ -733,6 +595,7 @@ def render_section_3(model, use_tts: bool):
         with st.form(key=f"{veo_key_base}_form_all"):
             colV1, colV2 = st.columns([1, 1])
             with colV1:
+                veo_workers = st.number_input("Số luồng song song", min_value=1, max_value=16, value=DEFAULT_WORKERS, step=1, key=f"{veo_key_base}_workers")
                 run_all = st.form_submit_button("⚡ Sinh Veo 3.1 cho TẤT CẢ cảnh", disabled=(not bool(model) or n_scenes == 0))
             with colV2:
                 pick_min = 1
@@ -745,18 +608,38 @@ def render_section_3(model, use_tts: bool):
                 st.session_state[f"{veo_key_base}_busy"] = True
                 st.session_state[f"{veo_key_base}_last_error"] = None
                 try:
-                    with st.spinner("Đang sinh Veo 3.1..."):
+                    use_cache = st.session_state.get("use_gemini_cache", True)
+                    with st.spinner("Đang sinh Veo 3.1..."), stage_tags(proj, sidx, ep_idx, "veo"):
                         if run_all:
-                            new_scenes = []
-                            for idx_scene, sc in enumerate(ss_scenes, 1):
-                                new_scenes.append(_gen_veo_for_scene(model, proj, ep, sc, max_segments=3))
+                            # Fan-out song song; giữ đúng thứ tự cảnh khi ghép lại
+                            new_scenes = list(ss_scenes)
+                            progress = st.progress(0.0, text=f"0/{n_scenes} cảnh")
+                            status_box = st.empty()
+                            done_names = []
+
+                            _keyframe_index(proj, ep)  # dựng index 1 lần trước khi fan-out
+
+                            def _one(sc):
+                                return _gen_veo_for_scene(model, proj, ep, sc, max_segments=3, use_cache=use_cache)
+
+                            for k, (i_sc, res, err) in enumerate(iter_parallel(_one, ss_scenes, max_workers=int(veo_workers)), 1):
+                                name = ss_scenes[i_sc].get("scene", f"Cảnh {i_sc + 1}")
+                                if err is not None:
+                                    ss_scenes[i_sc]["veo_error"] = str(err)
+                                    done_names.append(f"❌ {i_sc + 1}. {name}: {err}")
+                                else:
+                                    new_scenes[i_sc] = res
+                                    n_segs = len(res.get("veo31_segments") or [])
+                                    done_names.append(f"✅ {i_sc + 1}. {name} — {n_segs} segment")
+                                progress.progress(k / n_scenes, text=f"{k}/{n_scenes} cảnh")
+                                status_box.markdown("\n".join(f"- {t}" for t in done_names))
                             ss_scenes = new_scenes
                         else:
                             if n_scenes == 0:
                                 st.warning("Chưa có scene để sinh Veo.")
                             else:
                                 idx = max(0, min(int(pick) - 1, n_scenes - 1))
-                                ss_scenes[idx] = _gen_veo_for_scene(model, proj, ep, ss_scenes[idx], max_segments=3)
+                                ss_scenes[idx] = _gen_veo_for_scene(model, proj, ep, ss_scenes[idx], max_segments=3, use_cache=use_cache)
 
                         # Cập nhật vào session_state TRƯỚC
                         st.session_state[f"{veo_key_base}_scenes"] = ss_scenes
@@ -764,7 +647,7 @@ def render_section_3(model, use_tts: bool):
                         # Đồng bộ ngược vào project & lưu
                         ep.assets = {"scenes": ss_scenes}
                         st.session_state.project.seasons[sidx].episodes[ep.index - 1] = ep
-                        save_project(st.session_state.project)
+                        save_and_mark(st.session_state.project)
                         st.success("Đã sinh Veo 3.1.")
                 except Exception as ex:
                     st.session_state[f"{veo_key_base}_last_error"] = ex
@@ -799,10 +682,39 @@ def render_section_3(model, use_tts: bool):
         st.subheader("TTS Text")
         ep.tts_text = st.text_area("Bản TTS (có thể chỉnh tay trước khi render giọng)", value=ep.tts_text or "", height=300, key=f"tts_{sidx}_{ep_idx}")
         if HAS_GTTS and use_tts:
-            st.caption("gTTS khả dụng. (Tạo MP3 nên chạy cục bộ để tránh giới hạn thời gian).")
+            st.caption("gTTS khả dụng. Chỉ các đoạn đã sửa được tổng hợp lại; phần còn lại lấy từ cache.")
         else:
-            st.caption("Bạn có thể copy TTS text để dùng với công cụ TTS khác.")
+            st.caption("Bạn có thể copy TTS text để dùng với công cụ TTS khác (hoặc render thử bằng backend 'stub').")
+        backends = available_backends() if use_tts else ["stub"]
+        cT1, cT2 = st.columns(2)
+        with cT1:
+            tts_backend = st.selectbox("Backend giọng đọc", backends, key=f"tts_backend_{sidx}_{ep_idx}")
+        with cT2:
+            tts_workers = st.number_input("Số chunk song song", 1, 16, DEFAULT_WORKERS, key=f"tts_workers_{sidx}_{ep_idx}")
+        if st.button("🔊 Render audio tập này", disabled=not (ep.tts_text or "").strip(), key=f"tts_render_{sidx}_{ep_idx}"):
+            bar = st.progress(0.0, text="Đang chia chunk…")
+            try:
+                res = run_tts_stage(
+                    proj, sidx, ep_idx, backend=tts_backend, max_workers=int(tts_workers),
+                    use_cache=st.session_state.get("use_tts_cache", True),
+                    progress=lambda f, msg: bar.progress(min(1.0, f), text=msg),
+                )
+            except ValueError as e:
+                res = None
+                st.error(str(e))
+            bar.empty()
+            if res and res["errors"]:
+                st.error(f"{len(res['errors'])} chunk lỗi — ví dụ: {res['errors'][0][1]}")
+            elif res:
+                st.success(f"Đã render {res['chunks']} chunk ({res['synthesized']} mới, {res['cached']} từ cache).")
+        audio = find_tts_audio(proj, sidx, ep_idx)
+        if audio:
+            st.audio(str(audio))
 
     # ---- Tab 4: Character Bible
     with tabs[3]:
         _render_character_bible_block(model, proj, ep, sidx, ep_idx)
+
+    # ---- Tab 5: Timeline (dựng lại mỗi lần render: tuyến tính theo độ dài script)
+    with tabs[4]:
+        _render_timeline_block(proj, ep, sidx, ep_idx)
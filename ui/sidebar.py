@@ -1,7 +1,13 @@
 import streamlit as st
 from pathlib import Path
 from core.env_loader import load_env, get_key_info, validate_key_format, set_runtime_key, write_dotenv_key, reset_caches_and_rerun
-from core.project_io import DATA_DIR, save_project, load_project, export_zip
+from core.project_io import DATA_DIR, export_zip_file, list_projects
+from core.disk_cache import clear as clear_disk_cache
+from core.gemini_helpers import CACHE_NS as GEMINI_CACHE_NS
+from core.image_store import STORE_NS as IMAGE_STORE_NS
+from core.tts_engine import CACHE_NS as TTS_CACHE_NS
+from core import context_cache, memo, metrics, profiling
+from ui.project_state import is_synced, reload_from_disk, save_and_mark
 
 def render_sidebar():
     st.sidebar.title("⚙️ Cấu hình")
@@ -65,31 +71,84 @@ def render_sidebar():
     custom_model = st.sidebar.text_input("Model tuỳ chọn", value="", help="Ví dụ: gemini-2.5-flash")
     model_name = custom_model or model_name
 
-    use_tts = st.sidebar.toggle("Bật TTS (gTTS)", value=False, help="Tạo file MP3 cho tab TTS")
+    use_tts = st.sidebar.toggle("Bật TTS (gTTS)", value=False, help="Render giọng đọc bằng gTTS trong tab TTS")
+
+    st.sidebar.toggle(
+        "Dùng cache phản hồi Gemini", value=True, key="use_gemini_cache",
+        help="Prompt (và ảnh cùng prompt + seed) giống hệt sẽ trả kết quả đã lưu thay vì gọi lại API. Tắt để buộc sinh mới."
+    )
+    st.sidebar.toggle(
+        "Dùng lại audio TTS đã render", value=True, key="use_tts_cache",
+        help="Chunk giọng đọc không đổi (cùng text + giọng) lấy từ cache đĩa, chỉ tổng hợp phần mới. Độc lập với cache Gemini."
+    )
+    if st.sidebar.button("🧹 Xoá cache Gemini"):
+        n = clear_disk_cache(GEMINI_CACHE_NS)
+        st.sidebar.success(f"Đã xoá {n} mục cache.")
+    if st.sidebar.button("🧹 Xoá kho ảnh đã sinh"):
+        n = clear_disk_cache(IMAGE_STORE_NS)
+        st.sidebar.success(f"Đã xoá {n} ảnh.")
+    if st.sidebar.button("🧹 Xoá cache TTS"):
+        n = clear_disk_cache(TTS_CACHE_NS)
+        st.sidebar.success(f"Đã xoá {n} đoạn audio.")
 
     st.sidebar.markdown("---")
     st.sidebar.subheader("📁 Dự án")
-    proj_files = sorted(DATA_DIR.glob("*.json"))
-    if proj_files:
-        sel_file = st.sidebar.selectbox("Mở project", ["(Chọn)"] + [f.name for f in proj_files])
+    proj_index = list_projects()
+    if proj_index:
+        labels = {it["file"]: f"{it['name']} · {it['seasons']} mùa / {it['episodes']} tập · {it['size'] // 1024} KB"
+                  for it in proj_index}
+        sel_file = st.sidebar.selectbox(
+            "Mở project", ["(Chọn)"] + list(labels), format_func=lambda f: labels.get(f, f)
+        )
         if sel_file != "(Chọn)":
-            st.session_state.project = load_project(DATA_DIR / sel_file)
+            # Chỉ parse lại khi đổi lựa chọn hoặc index/shard bị tiến trình khác ghi (UI tự lưu thì đã cập nhật chữ ký)
+            if st.session_state.project is None or not is_synced(DATA_DIR / sel_file):
+                prev = st.session_state.project
+                cur = reload_from_disk(DATA_DIR / sel_file)
+                if prev is not None and prev.name != cur.name:
+                    context_cache.release(prev.name)  # đổi project → xoá context cache của project cũ
             st.sidebar.success(f"Đã mở {sel_file}")
 
     if st.sidebar.button("💾 Lưu project", type="primary"):
         if st.session_state.project:
-            f = save_project(st.session_state.project)
+            f = save_and_mark(st.session_state.project)
             st.sidebar.success(f"Đã lưu: {f.name}")
         else:
             st.sidebar.warning("Chưa có project")
 
     if st.sidebar.button("📦 Export ZIP"):
         if st.session_state.project:
-            zbytes = export_zip(st.session_state.project)
-            st.sidebar.download_button("Tải xuống project.zip", data=zbytes, file_name="project.zip")
+            zpath = export_zip_file(st.session_state.project)
+            with open(zpath, "rb") as zf:
+                st.sidebar.download_button("Tải xuống project.zip", data=zf, file_name="project.zip",
+                                           mime="application/zip")
         else:
             st.sidebar.warning("Chưa có project")
 
+    proj = st.session_state.get("project")
+    if proj:
+        with st.sidebar.expander("📊 Token & chi phí (ước tính)", expanded=False):
+            by_ep = metrics.episode_rollup(proj.name)
+            if not by_ep:
+                st.caption("Chưa có lệnh gọi nào được ghi cho project này.")
+            else:
+                tot = {k: sum(r[k] for r in by_ep) for k in ("calls", "prompt_tokens", "output_tokens", "cost_usd", "cache_hits")}
+                st.metric("Chi phí", f"${tot['cost_usd']:.4f}")
+                st.caption(f"{tot['calls']} lệnh gọi · {tot['cache_hits']} cache hit · "
+                           f"{tot['prompt_tokens']:,} token vào / {tot['output_tokens']:,} token ra")
+                st.caption("Theo stage")
+                st.dataframe([{"stage": r["stage"] or "-", "gọi": r["calls"], "vào": r["prompt_tokens"],
+                               "ra": r["output_tokens"], "giây": r["latency_s"], "$": r["cost_usd"]}
+                              for r in metrics.stage_rollup(proj.name)], hide_index=True)
+                st.caption("Theo tập (tập 0 = cấp mùa/project)")
+                st.dataframe([{"mùa": r["season"], "tập": r["episode"], "gọi": r["calls"],
+                               "vào": r["prompt_tokens"], "ra": r["output_tokens"], "cached": r["cached_tokens"],
+                               "retry": r["retries"], "lỗi": r["errors"], "$": r["cost_usd"]}
+                              for r in by_ep], hide_index=True)
+                if st.button("🧹 Xoá số liệu project này"):
+                    n = metrics.clear(proj.name)
+                    st.success(f"Đã xoá {n} bản ghi.")
+
     # Debug (ẩn key)
     current_key2 = load_env()
     if current_key2:
@@ -98,3 +157,48 @@ def render_sidebar():
         st.sidebar.error("Chưa thấy GEMINI_API_KEY trong .env.")
 
     return model_name, use_tts
+
+
+def render_profiling_panel():
+    """Panel debug: bật/tắt đo thời gian, bảng percentile qua các rerun, ghi trace cProfile/pyinstrument."""
+    with st.sidebar.expander("⏱️ Profiling (debug)", expanded=False):
+        on = st.checkbox("Bật đo thời gian hot-path", value=profiling.is_enabled(), key="profiling_enabled",
+                         help="Đo mỗi lần rerun + từng section + các hàm xử lý cục bộ. Có thể bật sẵn bằng GSS_PROFILE=1.")
+        if on != profiling.is_enabled():
+            profiling.set_enabled(on)
+            st.caption("Áp dụng từ lần rerun kế tiếp.")
+        if not profiling.is_enabled():
+            return
+
+        rows = profiling.stats()
+        if not rows:
+            st.caption("Chưa có mẫu đo nào.")
+        else:
+            last = next((r for r in rows if r["name"] == "rerun"), None)
+            if last:
+                st.metric("Rerun gần nhất", f"{last['last_ms']:.0f} ms",
+                          help=f"p50 {last['p50_ms']:.0f} ms · p90 {last['p90_ms']:.0f} ms · p99 {last['p99_ms']:.0f} ms")
+            st.dataframe([{"mục": r["name"], "lần": r["calls"], "tổng (s)": r["total_s"], "p50": r["p50_ms"],
+                           "p90": r["p90_ms"], "p99": r["p99_ms"], "max": r["max_ms"], "gần nhất": r["last_ms"]}
+                          for r in rows], hide_index=True)
+            st.caption(f"Đơn vị ms; percentile trên {profiling.WINDOW} mẫu gần nhất mỗi mục.")
+
+        memo_rows = [r for r in memo.stats() if r["hits"] or r["misses"]]
+        if memo_rows:
+            st.caption("Memo theo nội dung (hit = rerun không phải tính lại)")
+            st.dataframe([{"hàm": r["name"], "mục": r["entries"], "hit": r["hits"], "miss": r["misses"]}
+                          for r in memo_rows], hide_index=True)
+
+        tracer = st.selectbox("Trình profile", profiling.available_tracers(), key="profiling_tracer")
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("🔬 Trace lần rerun tới"):
+                profiling.request_trace(tracer)
+                st.rerun()
+        with c2:
+            if st.button("♻️ Xoá số đo"):
+                profiling.reset()
+                st.rerun()
+
+        for p in profiling.list_traces()[:5]:
+            st.download_button(f"⬇️ {p.name}", data=p.read_bytes(), file_name=p.name, key=f"trace_{p.name}")